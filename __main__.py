@@ -1,7 +1,12 @@
 import pulumi
+import lookups
+import sizing
 from network import create_network_infrastructure
 from security import create_security_groups, create_iam_resources
-from instances import create_instances
+from instances import create_instances, pinned_host_offsets
+from environment import create_environments
+from images import create_images
+from artifacts import create_app_artifact
 from utils import create_ssh_key, create_config_file
 
 # Configuration
@@ -9,30 +14,125 @@ config = pulumi.Config()
 DB_NAME = config.require("dbName")
 DB_VAULT_USER = config.require("dbVaultUser")
 SSH_KEY_NAME = config.require("sshKeyName")
+PARALLEL_PROVISIONING = config.get_bool("parallelProvisioning") or False
+BAKE_IMAGES = config.get_bool("bakeImages") or False
+AZ_COUNT = config.get_int("availabilityZones") or 1
+VPC_ENDPOINTS = config.get_bool("vpcEndpoints") or False
+NODEJS_AUTOSCALING = config.get_object("nodejsAutoscaling")
+MYSQL_TUNING_PROFILE = config.get("mysqlTuningProfile") or "oltp-write-heavy"
+MYSQL_REPLICAS = config.get_int("mysqlReplicas") or 0
+REDIS_TUNING = config.get_object("redisTuning")
+REDIS_REPLICAS = config.get_int("redisReplicas") or 0
+REDIS_SENTINEL = config.get_bool("redisSentinel") or False
+MYSQL_PROXY = config.get_bool("mysqlProxy") or False
+VAULT_AGENT = config.get_bool("vaultAgent") or False
+APP_ARTIFACT = config.get_bool("appArtifact") or False
+APP_REF = config.get("appRef") or "HEAD"
+APT_PROXY = config.get("aptProxy")
+VAULT_CLUSTER_SIZE = config.get_int("vaultClusterSize") or 1
+VAULT_SEAL = config.get_object("vaultSeal") or {"type": "awskms"}
+if VAULT_SEAL.get("type") == "transit":
+    VAULT_SEAL = {**VAULT_SEAL, "token": config.require_secret("vaultTransitToken")}
+SIZING = sizing.resolve_sizing(
+    config.get("sizingProfile") or "dev",
+    config.get_object("instanceSizing")
+)
+ENVIRONMENTS = config.get_object("environments") or []
+SHARED_NETWORK = config.get_bool("sharedNetwork")
+if SHARED_NETWORK is None:
+    SHARED_NETWORK = True
+if ENVIRONMENTS and BAKE_IMAGES and not SHARED_NETWORK:
+    raise ValueError("bakeImages needs sharedNetwork when environments are set, images are built in the shared VPC")
+LOOKUP_CACHE_TTL = config.get_int("lookupCacheTtl")
+if LOOKUP_CACHE_TTL is None:
+    LOOKUP_CACHE_TTL = lookups.DEFAULT_TTL
+
+# Resolve region, AZs and key pair concurrently before anything needs them
+lookups.prefetch(SSH_KEY_NAME, ttl=LOOKUP_CACHE_TTL)
 
 # Create infrastructure components
 aws_key = create_ssh_key(SSH_KEY_NAME)
 
-network = create_network_infrastructure()
-vpc = network["vpc"]
-public_subnet = network["public_subnet"]
-private_subnet = network["private_subnet"]
-
-security = create_security_groups(vpc, public_subnet, private_subnet)
-iam_resources = create_iam_resources()
-
-instances = create_instances(
-    network=network,
-    security_groups=security,
-    iam_profile=iam_resources["instance_profile"],
-    config={
-        "db_name": DB_NAME,
-        "db_vault_user": DB_VAULT_USER,
-        "ssh_key_name": SSH_KEY_NAME,
-        "aws_key": aws_key
-    }
+# Environments sharing a VPC pin their hosts in consecutive blocks
+PINNED_ENVIRONMENTS = len(ENVIRONMENTS) if ENVIRONMENTS and SHARED_NETWORK else 1
+
+network_settings = {
+    "az_count": AZ_COUNT,
+    "vpc_endpoints": VPC_ENDPOINTS,
+    "reserved_host_offsets": pinned_host_offsets(PINNED_ENVIRONMENTS) if PARALLEL_PROVISIONING else ()
+}
+security_settings = {
+    "load_balanced": bool(NODEJS_AUTOSCALING),
+    "vault_cluster": VAULT_CLUSTER_SIZE > 1,
+    "redis_sentinel": REDIS_SENTINEL
+}
+
+# Environments share one VPC and NAT unless each should get its own
+network = None
+if not ENVIRONMENTS or SHARED_NETWORK:
+    network = create_network_infrastructure(**network_settings)
+
+iam_resources = create_iam_resources(
+    vault_cluster=VAULT_CLUSTER_SIZE > 1,
+    vault_seal=VAULT_SEAL.get("type")
 )
 
-# Export results
-create_config_file(instances, SSH_KEY_NAME)
-pulumi.export('NodeJS Running On http://public_ip:3000', instances['nodejs'].public_ip)
\ No newline at end of file
+# Optionally bake one AMI per role so instances boot with packages installed
+amis = create_images(network) if BAKE_IMAGES else {}
+
+# Optionally build the app once and ship it to the app servers through S3
+app_artifact = create_app_artifact(iam_resources["role"], APP_REF) if APP_ARTIFACT else None
+
+instance_settings = {
+    "db_name": DB_NAME,
+    "db_vault_user": DB_VAULT_USER,
+    "ssh_key_name": SSH_KEY_NAME,
+    "aws_key": aws_key,
+    "parallel_provisioning": PARALLEL_PROVISIONING,
+    "amis": amis,
+    "nodejs_autoscaling": NODEJS_AUTOSCALING,
+    "sizing": SIZING,
+    "mysql_tuning_profile": MYSQL_TUNING_PROFILE,
+    "mysql_replicas": MYSQL_REPLICAS,
+    "mysql_proxy": MYSQL_PROXY,
+    "vault_agent": VAULT_AGENT,
+    "app_artifact": app_artifact,
+    "apt_proxy": APT_PROXY,
+    "redis_tuning": REDIS_TUNING,
+    "redis_replicas": REDIS_REPLICAS,
+    "redis_sentinel": REDIS_SENTINEL,
+    "vault_cluster_size": VAULT_CLUSTER_SIZE,
+    "vault_seal": VAULT_SEAL,
+    "vault_kms_key": iam_resources["vault_kms_key"]
+}
+
+def export_endpoint(instances, label_prefix=''):
+    """Export where the app of one environment can be reached"""
+    if NODEJS_AUTOSCALING:
+        pulumi.export(f'{label_prefix}NodeJS Running On', pulumi.Output.concat('http://', instances['nodejs_load_balancer'].dns_name))
+    else:
+        pulumi.export(f'{label_prefix}NodeJS Running On http://public_ip:3000', instances['nodejs'].public_ip)
+
+if ENVIRONMENTS:
+    environments = create_environments(
+        ENVIRONMENTS, network, iam_resources["instance_profile"],
+        network_settings, security_settings, instance_settings
+    )
+    for name, environment in environments.items():
+        create_config_file(environment.instances, SSH_KEY_NAME, f'{name}-')
+        export_endpoint(environment.instances, f'{name}: ')
+else:
+    security = create_security_groups(
+        network["vpc"],
+        **security_settings
+    )
+    instances = create_instances(
+        network=network,
+        security_groups=security,
+        iam_profile=iam_resources["instance_profile"],
+        config=instance_settings
+    )
+
+    # Export results
+    create_config_file(instances, SSH_KEY_NAME)
+    export_endpoint(instances)
\ No newline at end of file
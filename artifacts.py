@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import pulumi
+import pulumi_aws as aws
+
+# The app the Node.js tier runs; nodejs-setup.sh clones the same repository
+# when no artifact is available
+APP_REPOSITORY = 'https://github.com/kcnaiamh/Demo-App-1.git'
+
+# Built tarballs, one per commit. A commit never changes, so they never expire
+CACHE_DIR = '.pulumi-cache/artifacts'
+
+def resolve_revision(repository: str, ref: str) -> str:
+    """Resolve a branch, tag or HEAD to the commit hash it points at"""
+    if re.fullmatch(r'[0-9a-f]{40}', ref):
+        return ref
+    output = subprocess.run(['git', 'ls-remote', repository, ref],
+                            check=True, capture_output=True, text=True).stdout
+    if not output:
+        raise ValueError(f"appRef '{ref}' not found in {repository}")
+    return output.split()[0]
+
+def build_app_tarball(repository: str, revision: str) -> str:
+    """Check out the revision, install its dependencies and pack the result,
+    unless the tarball of that revision is cached already"""
+    tarball_path = os.path.join(CACHE_DIR, f'app-{revision}.tar.gz')
+    if os.path.exists(tarball_path):
+        return tarball_path
+
+    pulumi.log.info(f"Building app artifact for {revision[:12]}")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory() as work_dir:
+        app_dir = os.path.join(work_dir, 'app')
+        for command in (['git', 'init', '--quiet', app_dir],
+                        ['git', '-C', app_dir, 'fetch', '--quiet', '--depth', '1', repository, revision],
+                        ['git', '-C', app_dir, 'checkout', '--quiet', 'FETCH_HEAD']):
+            subprocess.run(command, check=True)
+        shutil.rmtree(os.path.join(app_dir, '.git'))
+
+        # npm ci installs exactly the lock file; without one fall back to
+        # what the app servers would have run
+        has_lock = os.path.exists(os.path.join(app_dir, 'package-lock.json'))
+        subprocess.run(['npm', 'ci' if has_lock else 'install', '--no-audit', '--no-fund'],
+                       cwd=app_dir, check=True)
+
+        # Pack to a temporary name so an interrupted build is never cached
+        partial_path = f'{tarball_path}.partial'
+        with tarfile.open(partial_path, 'w:gz') as tarball:
+            tarball.add(app_dir, arcname='.')
+        os.replace(partial_path, tarball_path)
+
+    return tarball_path
+
+def create_app_artifact(role, ref='HEAD'):
+    """Upload the app, dependencies included, to S3 keyed by its commit and
+    let the instance role read it"""
+    revision = resolve_revision(APP_REPOSITORY, ref)
+    tarball_path = build_app_tarball(APP_REPOSITORY, revision)
+
+    bucket = aws.s3.BucketV2('app-artifacts',
+        bucket_prefix='app-artifacts-',
+        force_destroy=True
+    )
+
+    aws.s3.BucketPublicAccessBlock('app-artifacts-public-access',
+        bucket=bucket.id,
+        block_public_acls=True,
+        block_public_policy=True,
+        ignore_public_acls=True,
+        restrict_public_buckets=True
+    )
+
+    # The key carries the commit, so a new revision is a new object. Pulumi
+    # would delete the old one on replacement; it is retained instead for
+    # instances still booting from it, and goes with the bucket on destroy
+    artifact = aws.s3.BucketObjectv2('app-artifact',
+        bucket=bucket.id,
+        key=f'app/{revision}.tar.gz',
+        source=pulumi.FileAsset(tarball_path),
+        opts=pulumi.ResourceOptions(retain_on_delete=True)
+    )
+
+    read_policy = aws.iam.RolePolicy('appArtifactRead',
+        role=role.id,
+        policy=bucket.arn.apply(lambda arn: json.dumps({
+            "Version": "2012-10-17",
+            "Statement": [{
+                "Effect": "Allow",
+                "Action": "s3:GetObject",
+                "Resource": f'{arn}/app/*'
+            }]
+        }))
+    )
+
+    # Resolves once the object is uploaded and readable by the instances
+    url = pulumi.Output.all(artifact.bucket, artifact.key, read_policy.id).apply(
+        lambda args: f's3://{args[0]}/{args[1]}'
+    )
+
+    return {
+        "revision": revision,
+        "url": url,
+        "bucket": bucket,
+        "object": artifact
+    }
@@ -0,0 +1,36 @@
+"""Compare deploy critical-path depth of serial and parallel provisioning.
+
+Each mode is synthesized offline in its own interpreter (the Pulumi runtime
+keeps global state) and the longest dependency chain is reported, both in
+resources and in EC2 instances that have to boot one after another.
+
+Usage: python benchmarks/critical_path.py
+"""
+import json
+import os
+import subprocess
+import sys
+
+HARNESS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'harness.py')
+
+MODES = {
+    "serial": ["parallelProvisioning=false"],
+    "parallel": ["parallelProvisioning=true"],
+}
+
+
+def run_mode(overrides):
+    """Synthesize the stack with the given config overrides"""
+    cmd = [sys.executable, HARNESS]
+    for override in overrides:
+        cmd += ['--config', override]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+if __name__ == '__main__':
+    print(f"{'mode':<10} {'resources':>9} {'depth':>6} {'instance chain':>15} {'synth (s)':>10}")
+    for mode, overrides in MODES.items():
+        result = run_mode(overrides)
+        print(f"{mode:<10} {result['resources']:>9} {result['critical_path_depth']:>6} "
+              f"{result['instance_chain_depth']:>15} {result['synthesis_seconds']:>10}")
@@ -0,0 +1,220 @@
+"""Run the Pulumi program offline against mocked AWS providers.
+
+Every resource registration is recorded together with the resources it
+depends on, so callers can reason about the dependency graph the engine
+would walk during a real `pulumi up`.
+
+Usage: python benchmarks/harness.py [--config key=value ...]
+Prints a JSON summary of the synthesized stack.
+"""
+import argparse
+import contextlib
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import pulumi
+from pulumi.runtime import mocks
+
+INSTANCE_TYPE = 'aws:ec2/instance:Instance'
+
+DEFAULT_CONFIG = {
+    "dbName": "my_database",
+    "dbVaultUser": "vault_admin",
+    "sshKeyName": "master-key",
+    "lookupCacheTtl": 0,
+}
+
+
+def project_name() -> str:
+    """Return the project name declared in Pulumi.yaml"""
+    with open(os.path.join(ROOT_DIR, 'Pulumi.yaml')) as fd:
+        for line in fd:
+            if line.startswith('name:'):
+                return line.split(':', 1)[1].strip()
+    raise ValueError('Pulumi.yaml has no project name')
+
+
+class RecordingMonitor(mocks.MockMonitor):
+    """Mock monitor that remembers the dependencies of every resource"""
+
+    def __init__(self, mocks_impl):
+        super().__init__(mocks_impl)
+        self.graph = {}
+
+    def RegisterResource(self, request):
+        response = super().RegisterResource(request)
+        if request.type != 'pulumi:pulumi:Stack':
+            self.graph[response.urn] = {
+                "type": request.type,
+                "name": request.name,
+                "dependencies": sorted(set(request.dependencies)),
+            }
+        return response
+
+
+def plain(value):
+    """Unwrap a value the engine marked as secret"""
+    if isinstance(value, dict) and pulumi.runtime.rpc._special_sig_key in value:
+        return value.get('value')
+    return value
+
+
+class AwsMocks(pulumi.runtime.Mocks):
+    """Minimal stand-ins for the AWS and TLS providers used by the program"""
+
+    def __init__(self, availability_zones=('ap-southeast-1a', 'ap-southeast-1b', 'ap-southeast-1c')):
+        self.availability_zones = list(availability_zones)
+        self.user_data = {}
+        self._next_host = 100
+
+    def new_resource(self, args):
+        state = dict(args.inputs)
+        if args.typ == INSTANCE_TYPE:
+            self._next_host += 1
+            state.setdefault('privateIp', f'10.0.2.{self._next_host}')
+            state['publicIp'] = f'203.0.113.{self._next_host}'
+            user_data = plain(state.get('userData')) or plain(state.get('userDataBase64')) or ''
+            self.user_data[args.name] = len(user_data.encode())
+        elif args.typ == 'aws:ec2/launchTemplate:LaunchTemplate':
+            self.user_data[args.name] = len((plain(state.get('userData')) or '').encode())
+            state['latestVersion'] = 1
+        elif args.typ == 'aws:imagebuilder/image:Image':
+            state['outputResources'] = [{'amis': [{'image': f'ami-{args.name}'}]}]
+        elif args.typ in ('aws:lb/loadBalancer:LoadBalancer', 'aws:lb/targetGroup:TargetGroup'):
+            state['arnSuffix'] = f'app/{args.name}/mock'
+            state['dnsName'] = f'{args.name}.elb.amazonaws.com'
+        elif args.typ == 'random:index/randomPassword:RandomPassword':
+            state['result'] = f'Mock-{args.name}'
+        elif args.typ == 'tls:index/privateKey:PrivateKey':
+            state['privateKeyPem'] = 'mock-private-key'
+            state['publicKeyOpenssh'] = 'ssh-rsa AAAAmock'
+        state.setdefault('arn', f'arn:aws:mock:::{args.name}')
+        state.setdefault('name', args.name)
+        return [f'{args.name}-id', state]
+
+    def call(self, args):
+        if args.token == 'aws:index/getAvailabilityZones:getAvailabilityZones':
+            return {'names': self.availability_zones, 'zoneIds': self.availability_zones}
+        if args.token == 'aws:index/getRegion:getRegion':
+            return {'name': 'ap-southeast-1', 'id': 'ap-southeast-1'}
+        if args.token == 'aws:ec2/getKeyPair:getKeyPair':
+            return {}, [('keyName', 'reading EC2 Key Pairs: no matching EC2 Key Pair found')]
+        return {}
+
+
+def critical_path(graph, weight=lambda node: 1) -> int:
+    """Length of the heaviest dependency chain in the recorded graph"""
+    memo = {}
+
+    def depth(urn):
+        if urn not in memo:
+            node = graph[urn]
+            parents = [depth(dep) for dep in node["dependencies"] if dep in graph]
+            memo[urn] = weight(node) + max(parents, default=0)
+        return memo[urn]
+
+    return max((depth(urn) for urn in graph), default=0)
+
+
+def blast_radius(graph, types=(INSTANCE_TYPE,)) -> dict:
+    """Number of resources that depend, directly or not, on each resource of the given types.
+
+    Replacing one of them makes the engine revisit at least that many
+    resources downstream.
+    """
+    dependents = {urn: set() for urn in graph}
+    for urn, node in graph.items():
+        for dep in node["dependencies"]:
+            if dep in dependents:
+                dependents[dep].add(urn)
+
+    def reach(urn):
+        seen, stack = set(), [urn]
+        while stack:
+            for child in dependents[stack.pop()]:
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return len(seen)
+
+    return {node["name"]: reach(urn) for urn, node in graph.items() if node["type"] in types}
+
+
+def synthesize(config=None, stack='bench'):
+    """Run __main__.py under mocks and summarize what it registered"""
+    values = dict(DEFAULT_CONFIG, **(config or {}))
+    project = project_name()
+    pulumi.runtime.set_all_config({f'{project}:{key}': str(value) for key, value in values.items()})
+
+    aws_mocks = AwsMocks()
+    monitor = RecordingMonitor(aws_mocks)
+    pulumi.runtime.set_mocks(aws_mocks, project=project, stack=stack, preview=False, monitor=monitor)
+
+    # The program writes the SSH key and config under ~/.ssh, and its lookup
+    # cache goes to the same throwaway directory so every run starts cold
+    # and leaves nothing behind in the repository
+    home = tempfile.mkdtemp(prefix='pulumi-bench-')
+    os.makedirs(os.path.join(home, '.ssh'))
+    os.environ['HOME'] = home
+    sys.path.insert(0, ROOT_DIR)
+    import lookups
+    lookups.CACHE_DIR = os.path.join(home, 'cache', 'lookups')
+
+    @pulumi.runtime.test
+    def program():
+        runpy.run_path(os.path.join(ROOT_DIR, '__main__.py'), run_name='__main__')
+
+    cwd = os.getcwd()
+    os.chdir(ROOT_DIR)
+    started = time.perf_counter()
+    try:
+        # Keep the program's own prints out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            program()
+    finally:
+        elapsed = time.perf_counter() - started
+        os.chdir(cwd)
+        shutil.rmtree(home, ignore_errors=True)
+
+    graph = monitor.graph
+    return {
+        "config": values,
+        "synthesis_seconds": round(elapsed, 4),
+        "resources": len(graph),
+        "critical_path_depth": critical_path(graph),
+        "instance_chain_depth": critical_path(graph, lambda node: int(node["type"] == INSTANCE_TYPE)),
+        "resource_types": dict(sorted(Counter(node["type"] for node in graph.values()).items())),
+        "blast_radius": blast_radius(graph),
+        "user_data_bytes": aws_mocks.user_data,
+        "graph": graph,
+    }
+
+
+def parse_config(pairs):
+    """Turn ['key=value', ...] into a config dict"""
+    config = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        config[key] = value
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', action='append', metavar='KEY=VALUE', help='stack config override')
+    parser.add_argument('--graph', action='store_true', help='include the full dependency graph')
+    args = parser.parse_args()
+
+    result = synthesize(parse_config(args.config))
+    if not args.graph:
+        result.pop("graph")
+    json.dump(result, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,145 @@
+"""Throughput of health status publication strategies against a Redis server.
+
+Compares, for the same per-tick workload (SET with TTL for every monitored
+unit plus a PUBLISH for every unit that changed state):
+
+  redis-cli    one redis-cli process per command, as the old check scripts did
+  persistent   one command per round trip over a single connection
+  pipelined    the health agent's batch, one MULTI/EXEC round trip per tick
+
+By default a throwaway `redis-server` is started on a free local port as a
+stand-in for the Redis instance; use --redis HOST:PORT to target another.
+
+Usage: python benchmarks/health_publish.py [--units 4] [--ticks 500]
+"""
+import argparse
+import importlib.util
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'scripts', 'health', 'health_agent.py')
+
+
+def load_agent():
+    """Import the health agent from its script path"""
+    spec = importlib.util.spec_from_file_location('health_agent', AGENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_redis_server(password):
+    """Start a local redis-server stand-in, return (process, port)"""
+    if not shutil.which('redis-server'):
+        sys.exit("redis-server not found on PATH; install it or pass --redis HOST:PORT")
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='redis-bench-')
+    process = subprocess.Popen(
+        ['redis-server', '--port', str(port), '--requirepass', password,
+         '--save', '', '--appendonly', 'no', '--dir', workdir],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    sys.exit("redis-server did not start")
+
+
+def tick_commands(agent_module, units, tick):
+    """The agent's batch for one tick in which every unit changed state"""
+    agent = agent_module.HealthAgent(None, units)
+    for unit in units:
+        agent.states[unit] = "UP" if tick % 2 else "DOWN"
+    agent.unpublished = set(units)
+    return agent.batch()
+
+
+def run_redis_cli(host, port, password, batches):
+    env = dict(os.environ, REDISCLI_AUTH=password)
+    for commands in batches:
+        for command in commands:
+            subprocess.run(['redis-cli', '-h', host, '-p', str(port)] + [str(arg) for arg in command],
+                           env=env, check=True, stdout=subprocess.DEVNULL)
+    return sum(len(commands) for commands in batches)
+
+
+def run_persistent(connection, batches):
+    for commands in batches:
+        for command in commands:
+            connection.command(*command)
+    return sum(len(commands) for commands in batches)
+
+
+def run_pipelined(connection, batches):
+    for commands in batches:
+        connection.transaction(commands)
+    return len(batches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--redis', metavar='HOST:PORT', help='existing Redis server to use')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--units', type=int, default=4, help='monitored units per agent')
+    parser.add_argument('--ticks', type=int, default=500)
+    parser.add_argument('--cli-ticks', type=int, default=50, help='ticks for the (slow) redis-cli strategy')
+    args = parser.parse_args()
+
+    agent_module = load_agent()
+    server = None
+    if args.redis:
+        host, _, port = args.redis.partition(':')
+        port = int(port or agent_module.REDIS_PORT)
+    else:
+        server, port = start_redis_server(args.password)
+        host = '127.0.0.1'
+
+    units = [f'unit{i}' for i in range(args.units)]
+    try:
+        connection = agent_module.RedisConnection(host, port, password=args.password)
+        connection.command('DEL', agent_module.EVENTS_STREAM)
+
+        strategies = [
+            ('persistent', args.ticks, lambda batches: run_persistent(connection, batches)),
+            ('pipelined', args.ticks, lambda batches: run_pipelined(connection, batches)),
+        ]
+        if shutil.which('redis-cli'):
+            strategies.insert(0, ('redis-cli', args.cli_ticks,
+                                  lambda batches: run_redis_cli(host, port, args.password, batches)))
+        else:
+            print("redis-cli not found on PATH, skipping the redis-cli strategy", file=sys.stderr)
+
+        print(f"{'strategy':<12} {'ticks/s':>10} {'ms/tick':>9} {'round trips/tick':>17}")
+        for name, ticks, run in strategies:
+            batches = [tick_commands(agent_module, units, tick) for tick in range(ticks)]
+            started = time.perf_counter()
+            round_trips = run(batches)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<12} {ticks / elapsed:>10.1f} {elapsed / ticks * 1000:>9.3f} {round_trips / ticks:>17.1f}")
+
+        # Every transition of every strategy must have landed in the stream
+        expected = sum(ticks for _, ticks, _ in strategies) * len(units)
+        recorded = connection.command('XLEN', agent_module.EVENTS_STREAM)
+        print(f"{agent_module.EVENTS_STREAM}: {recorded} events recorded (expected {expected})")
+        connection.close()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,477 @@
+"""Load test of the deployed roles against local container stand-ins.
+
+Brings up MySQL, Redis, Vault and the Node.js app with `docker compose`,
+configured from the same sources as the real instances:
+
+  mysql   mysql:8.0 with the zz-tuning.cnf that tuning.py renders for the
+          db sizing and --mysql-profile, the Vault admin user as created by
+          mysql-setup.sh and schema.sql
+  redis   redis:7 with the tuning.conf rendered for the redis sizing and
+          --redis-tuning
+  vault   a dev-mode Vault, configured over its HTTP API with the database
+          secrets engine, roles, policy and AppRole read out of vault-setup.sh
+  app     the app built by artifacts.py (appRef) with the .env that
+          nodejs-setup.sh writes
+
+Every container gets the memory and vCPUs of its role's instance type, so
+the rendered settings size themselves against the same limits as on EC2.
+It then drives HTTP load against the app and reports:
+
+  latency     p50 / p99 / max and throughput for every --path
+  mysql       peak Threads_connected, Max_used_connections and the
+              rendered max_connections
+  vault       database credentials issued per second with the app's AppRole
+              (every issue is a CREATE USER on MySQL)
+
+Use it to compare tuning changes before rolling them out. Vault runs with
+in-memory storage and everything shares the local machine, so compare runs
+with each other, not with production numbers.
+
+Usage: python benchmarks/loadtest.py [--sizing-profile dev] [--mysql-profile oltp-write-heavy]
+                                     [--redis-tuning JSON] [--app-ref HEAD] [--path / ...]
+                                     [--concurrency 16] [--duration 30] [--json]
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import secrets
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import artifacts
+import sizing
+import tuning
+
+DB_NAME = 'my_database'
+DB_VAULT_USER = 'vault_admin'
+APP_PORT = 3000
+
+VAULT_SETUP_SCRIPT = os.path.join(ROOT_DIR, 'scripts', 'vault', 'vault-setup.sh')
+MYSQL_SETUP_SCRIPT = os.path.join(ROOT_DIR, 'scripts', 'mysql', 'mysql-setup.sh')
+
+
+def shell_expand(text, variables):
+    """Substitute ${NAME} references. Fails on a name it has no value for,
+    so a new variable in a script stops the run instead of going unnoticed"""
+    def value(match):
+        if match.group(1) not in variables:
+            raise ValueError(f"no load test value for ${{{match.group(1)}}}")
+        return variables[match.group(1)]
+    return re.sub(r'\$\{(\w+)\}', value, text)
+
+
+def heredoc(script, marker):
+    """Body of the first <<EOF heredoc after marker"""
+    match = re.search(re.escape(marker) + r'.*?<<\s*EOF\n(.*?)^EOF$', script, re.DOTALL | re.MULTILINE)
+    if not match:
+        raise ValueError(f"no heredoc after '{marker}'")
+    return match.group(1)
+
+
+def vault_writes(script):
+    """Path and parameters of every `vault write` command line in script"""
+    writes = {}
+    for match in re.finditer(r'^\s*vault write ((?:.*\\\n)*.*)$', script, re.MULTILINE):
+        words = [word for word in shlex.split(match.group(1).replace('\\\n', ' ')) if not word.startswith('-')]
+        writes[words[0]] = dict(word.split('=', 1) for word in words[1:])
+    return writes
+
+
+def vault_setup():
+    """The database roles, app policy and AppRole settings of vault-setup.sh"""
+    script = open(VAULT_SETUP_SCRIPT).read()
+    writes = vault_writes(script)
+    roles = {path.split('/')[-1]: {key: shell_expand(value, {"DB_NAME": DB_NAME})
+                                   for key, value in params.items()}
+             for path, params in writes.items() if path.startswith('database/roles/')}
+    if not roles:
+        raise ValueError(f"no database roles found in {VAULT_SETUP_SCRIPT}")
+    return {
+        "roles": roles,
+        "policy": heredoc(script, 'nodejs-policy.hcl'),
+        "approle": writes['auth/approle/role/nodejs-role'],
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def role_limits(spec):
+    """Compose resource limits matching a role's instance type"""
+    resources = sizing.instance_resources(spec["instanceType"])
+    return {"resources": {"limits": {"cpus": str(resources["vcpus"]),
+                                     "memory": f'{resources["memory_mib"]}M'}}}
+
+
+def mysql_init_sql(vault_password):
+    """The Vault admin user of mysql-setup.sh, allowed from the container
+    network instead of the private subnets, and schema.sql"""
+    vault_user = heredoc(open(MYSQL_SETUP_SCRIPT).read(), 'VAULT USER CREATION')
+    schema = open(os.path.join(ROOT_DIR, 'scripts', 'mysql', 'schema.sql')).read()
+    return shell_expand(vault_user, {
+        "DB_NAME": DB_NAME,
+        "DB_VAULT_USER": DB_VAULT_USER,
+        "DB_VAULT_PASS": vault_password,
+        "host": '%',
+    }) + f'USE {DB_NAME};\n{schema}'
+
+
+def compose_file(stack_sizing, passwords, ports):
+    """docker compose definition of the stand-ins. JSON is valid YAML"""
+    return {
+        "services": {
+            "mysql": {
+                "image": "mysql:8.0",
+                "environment": {"MYSQL_ROOT_PASSWORD": passwords["root"], "MYSQL_DATABASE": DB_NAME},
+                "volumes": ["./zz-tuning.cnf:/etc/mysql/conf.d/zz-tuning.cnf:ro",
+                            "./init.sql:/docker-entrypoint-initdb.d/init.sql:ro"],
+                "healthcheck": {"test": ["CMD", "mysqladmin", "ping", "-h", "127.0.0.1",
+                                         f'-p{passwords["root"]}'],
+                                "interval": "2s", "retries": 60},
+                "deploy": role_limits(stack_sizing["db"]),
+            },
+            "redis": {
+                "image": "redis:7",
+                "command": ["redis-server", "/usr/local/etc/redis/tuning.conf",
+                            "--requirepass", passwords["redis"]],
+                "volumes": ["./tuning.conf:/usr/local/etc/redis/tuning.conf:ro"],
+                "healthcheck": {"test": ["CMD", "redis-cli", "-a", passwords["redis"], "--no-auth-warning", "ping"],
+                                "interval": "2s", "retries": 30},
+                "deploy": role_limits(stack_sizing["redis"]),
+            },
+            "vault": {
+                "image": "hashicorp/vault:1.17",
+                "command": ["server", "-dev", "-dev-listen-address=0.0.0.0:8200"],
+                "environment": {"VAULT_DEV_ROOT_TOKEN_ID": passwords["vault_token"]},
+                "cap_add": ["IPC_LOCK"],
+                "ports": [f'127.0.0.1:{ports["vault"]}:8200'],
+                "healthcheck": {"test": ["CMD", "vault", "status", "-address=http://127.0.0.1:8200"],
+                                "interval": "2s", "retries": 30},
+                "deploy": role_limits(stack_sizing["vault"]),
+            },
+            "app": {
+                # The Node.js major nodejs-install.sh installs on the app servers
+                "image": "node:18",
+                "working_dir": "/opt/app",
+                # What nodejs-setup.sh does with an artifact, then nodejs-app.service
+                "command": ["sh", "-c", "npm rebuild && cd src && exec node app.js"],
+                "volumes": ["./app:/opt/app"],
+                "ports": [f'127.0.0.1:{ports["app"]}:{APP_PORT}'],
+                "depends_on": ["mysql", "redis", "vault"],
+                "profiles": ["app"],
+                "deploy": role_limits(stack_sizing["nodejs"]),
+            },
+        }
+    }
+
+
+class Stack:
+    """The stand-ins of one run, in their own compose project"""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.project = f'loadtest-{os.getpid()}'
+
+    def compose(self, *args, capture=False):
+        cmd = ['docker', 'compose', '-p', self.project, '-f', 'compose.json'] + list(args)
+        result = subprocess.run(cmd, cwd=self.workdir, check=True, text=True,
+                                capture_output=capture, stdout=None if capture else subprocess.DEVNULL)
+        return result.stdout if capture else None
+
+    def mysql_status(self, root_password):
+        """Threads_connected and Max_used_connections of the MySQL stand-in"""
+        output = self.compose('exec', '-T', '-e', f'MYSQL_PWD={root_password}', 'mysql',
+                              'mysql', '-uroot', '-N', '-e',
+                              "SHOW GLOBAL STATUS WHERE Variable_name IN ('Threads_connected', 'Max_used_connections')",
+                              capture=True)
+        return {name: int(value) for name, value in (line.split('\t') for line in output.splitlines() if line)}
+
+    def down(self):
+        self.compose('--profile', 'app', 'down', '--volumes', '--remove-orphans')
+
+
+class Vault:
+    """Just enough of the Vault HTTP API to configure it and issue credentials"""
+
+    def __init__(self, address, token):
+        self.address = address
+        self.token = token
+
+    def request(self, method, path, body=None, token=None):
+        request = urllib.request.Request(
+            f'{self.address}/v1/{path}', method=method,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={"X-Vault-Token": token or self.token}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else {}
+
+    def configure(self, vault_password):
+        """The database engine, roles, policy and AppRole of vault-setup.sh; returns (role_id, secret_id)"""
+        setup = vault_setup()
+        self.request('POST', 'sys/mounts/database', {"type": "database"})
+        self.request('POST', 'database/config/mysql-database', {
+            "plugin_name": "mysql-database-plugin",
+            "connection_url": "{{username}}:{{password}}@tcp(mysql:3306)/",
+            "allowed_roles": ','.join(setup["roles"]),
+            "username": DB_VAULT_USER,
+            "password": vault_password,
+        })
+        for role, params in setup["roles"].items():
+            self.request('POST', f'database/roles/{role}', params)
+        self.request('POST', 'sys/auth/approle', {"type": "approle"})
+        self.request('PUT', 'sys/policies/acl/nodejs-policy', {"policy": setup["policy"]})
+        self.request('POST', 'auth/approle/role/nodejs-role', setup["approle"])
+        role_id = self.request('GET', 'auth/approle/role/nodejs-role/role-id')["data"]["role_id"]
+        secret_id = self.request('POST', 'auth/approle/role/nodejs-role/secret-id', {})["data"]["secret_id"]
+        return role_id, secret_id
+
+    def login(self, role_id, secret_id):
+        return self.request('POST', 'auth/approle/login',
+                            {"role_id": role_id, "secret_id": secret_id})["auth"]["client_token"]
+
+
+def app_env(example, values):
+    """Fill in .env.example the way nodejs-setup.sh does: replace a key's
+    line, or append it when the example doesn't have it"""
+    for key, value in values.items():
+        line = f"{key}='{value}'"
+        example, count = re.subn(rf'^{key}=.*$', lambda _: line, example, flags=re.MULTILINE)
+        if not count:
+            example = example.rstrip('\n') + f'\n{line}\n'
+    return example
+
+
+def wait_for_http(port, path, timeout=180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', path)
+            if connection.getresponse().status < 500:
+                return
+        except OSError:
+            pass
+        time.sleep(1)
+    sys.exit(f"app did not answer on port {port} within {timeout}s")
+
+
+def run_for(duration, concurrency, work):
+    """Call work() from `concurrency` threads until `duration` seconds have
+    passed; returns the values it returned and the number of failures"""
+    deadline = time.monotonic() + duration
+    results, failures = [], [0]
+    lock = threading.Lock()
+
+    def worker():
+        state = {}
+        while time.monotonic() < deadline:
+            try:
+                value = work(state)
+            except (OSError, http.client.HTTPException, ValueError, KeyError):
+                value = None
+            with lock:
+                if value is None:
+                    failures[0] += 1
+                else:
+                    results.append(value)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, failures[0]
+
+
+def http_load(port, path, duration, concurrency):
+    """Latency percentiles (ms) and throughput of GET path over keep-alive connections"""
+    def request(state):
+        if 'connection' not in state:
+            state['connection'] = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        started = time.perf_counter()
+        try:
+            state['connection'].request('GET', path)
+            response = state['connection'].getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            state.pop('connection').close()
+            raise
+        if response.status >= 500:
+            raise ValueError(response.status)
+        return (time.perf_counter() - started) * 1000
+
+    latencies, failures = run_for(duration, concurrency, request)
+    if len(latencies) < 2:
+        return {"path": path, "requests": len(latencies), "errors": failures}
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "path": path,
+        "requests": len(latencies),
+        "errors": failures,
+        "rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(cuts[49], 2),
+        "p99_ms": round(cuts[98], 2),
+        "max_ms": round(max(latencies), 2),
+    }
+
+
+def credential_rate(vault, token, duration, concurrency):
+    """Database credentials Vault issues per second to the app's token"""
+    def issue(state):
+        return vault.request('GET', 'database/creds/nodejs-app', token=token)["lease_id"]
+
+    leases, failures = run_for(duration, concurrency, issue)
+    return {"issued": len(leases), "errors": failures, "per_second": round(len(leases) / duration, 1)}
+
+
+def sample_mysql(stack, root_password, stop, samples):
+    """Record Threads_connected about once a second until stop is set"""
+    while not stop.wait(1):
+        try:
+            samples.append(stack.mysql_status(root_password)["Threads_connected"])
+        except (subprocess.CalledProcessError, KeyError, ValueError):
+            pass
+
+
+def prepare(workdir, stack_sizing, args, passwords):
+    """Render configs, build and unpack the app, write the compose file"""
+    with open(os.path.join(workdir, 'zz-tuning.cnf'), 'w') as fd:
+        fd.write(tuning.render_mysql_config(stack_sizing["db"], args.mysql_profile))
+    with open(os.path.join(workdir, 'tuning.conf'), 'w') as fd:
+        fd.write(tuning.render_redis_config(stack_sizing["redis"], args.redis_tuning))
+    with open(os.path.join(workdir, 'init.sql'), 'w') as fd:
+        fd.write(mysql_init_sql(passwords["vault"]))
+
+    revision = artifacts.resolve_revision(artifacts.APP_REPOSITORY, args.app_ref)
+    tarball_path = artifacts.build_app_tarball(artifacts.APP_REPOSITORY, revision)
+    with tarfile.open(tarball_path) as tarball:
+        tarball.extractall(os.path.join(workdir, 'app'))
+
+    ports = {"app": free_port(), "vault": free_port()}
+    with open(os.path.join(workdir, 'compose.json'), 'w') as fd:
+        json.dump(compose_file(stack_sizing, passwords, ports), fd, indent=2)
+    return revision, ports
+
+
+def print_report(report):
+    print(f"app {report['revision'][:12]}, sizing {report['sizing_profile']}, "
+          f"MySQL profile {report['mysql_profile']}, concurrency {report['concurrency']}")
+    print(f"{'path':<24} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} {'errors':>7}")
+    for result in report["http"]:
+        print(f"{result['path']:<24} {result.get('rps', 0):>9} {result.get('p50_ms', '-'):>9} "
+              f"{result.get('p99_ms', '-'):>9} {result.get('max_ms', '-'):>9} {result['errors']:>7}")
+    mysql = report["mysql"]
+    print(f"mysql: peak Threads_connected {mysql['peak_threads_connected']}, "
+          f"Max_used_connections {mysql['max_used_connections']} of max_connections {mysql['max_connections']}")
+    vault = report["vault"]
+    print(f"vault: {vault['per_second']} credentials/s ({vault['issued']} issued, {vault['errors']} errors)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizing-profile', default='dev', choices=sorted(sizing.PROFILES))
+    parser.add_argument('--instance-sizing', type=json.loads, help='instanceSizing overrides as JSON')
+    parser.add_argument('--mysql-profile', default='oltp-write-heavy', choices=sorted(tuning.MYSQL_PROFILES))
+    parser.add_argument('--redis-tuning', type=json.loads, help='redisTuning settings as JSON')
+    parser.add_argument('--app-ref', default='HEAD', help='branch, tag or commit of the app')
+    parser.add_argument('--path', action='append', help='request path, repeatable (default /)')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent HTTP connections')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of HTTP load per path')
+    parser.add_argument('--vault-concurrency', type=int, default=8)
+    parser.add_argument('--vault-duration', type=float, default=10, help='seconds of credential issuance')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--keep', action='store_true', help='leave the containers running')
+    args = parser.parse_args()
+
+    if not shutil.which('docker'):
+        sys.exit("docker not found on PATH; the stand-ins run with docker compose")
+    # Artifacts are cached under the project directory, as in a Pulumi run
+    os.chdir(ROOT_DIR)
+
+    stack_sizing = sizing.resolve_sizing(args.sizing_profile, args.instance_sizing)
+    passwords = {name: secrets.token_hex(12) for name in ("root", "vault", "redis", "vault_token")}
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    stack = Stack(workdir)
+
+    try:
+        revision, ports = prepare(workdir, stack_sizing, args, passwords)
+        stack.compose('up', '--detach', '--wait', 'mysql', 'redis', 'vault')
+
+        vault = Vault(f'http://127.0.0.1:{ports["vault"]}', passwords["vault_token"])
+        role_id, secret_id = vault.configure(passwords["vault"])
+
+        env_path = os.path.join(workdir, 'app', 'src', '.env')
+        with open(os.path.join(workdir, 'app', 'src', '.env.example')) as fd:
+            example = fd.read()
+        with open(env_path, 'w') as fd:
+            fd.write(app_env(example, {
+                "HOST_IP": "127.0.0.1",
+                "MYSQL_HOST_IP": "mysql",
+                "MYSQL_READ_HOST_IPS": "mysql",
+                "MYSQL_DATABASE": DB_NAME,
+                "VAULT_ADDR": "http://vault:8200",
+                "REDIS_HOST": "redis",
+                "REDIS_SENTINELS": "",
+                "REDIS_PASSWORD": passwords["redis"],
+                "VAULT_ROLE_ID": role_id,
+                "VAULT_SECRET_ID": secret_id,
+            }))
+
+        stack.compose('--profile', 'app', 'up', '--detach', 'app')
+        paths = args.path or ['/']
+        wait_for_http(ports["app"], paths[0])
+
+        stop, samples = threading.Event(), []
+        sampler = threading.Thread(target=sample_mysql, args=(stack, passwords["root"], stop, samples))
+        sampler.start()
+        try:
+            http_results = [http_load(ports["app"], path, args.duration, args.concurrency) for path in paths]
+        finally:
+            stop.set()
+            sampler.join()
+
+        token = vault.login(role_id, secret_id)
+        report = {
+            "revision": revision,
+            "sizing_profile": args.sizing_profile,
+            "mysql_profile": args.mysql_profile,
+            "concurrency": args.concurrency,
+            "http": http_results,
+            "mysql": {
+                "peak_threads_connected": max(samples, default=0),
+                "max_used_connections": stack.mysql_status(passwords["root"])["Max_used_connections"],
+                "max_connections": tuning.mysql_settings(stack_sizing["db"], args.mysql_profile)["max_connections"],
+            },
+            "vault": credential_rate(vault, token, args.vault_duration, args.vault_concurrency),
+        }
+
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+    finally:
+        if args.keep:
+            print(f"Containers left running: docker compose -p {stack.project} -f {workdir}/compose.json", file=sys.stderr)
+        else:
+            if os.path.exists(os.path.join(workdir, 'compose.json')):
+                stack.down()
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,122 @@
+"""Offline synthesis benchmark suite for a set of stack configurations.
+
+Every scenario is synthesized under Pulumi mocks (see harness.py) in its
+own interpreter, since the Pulumi runtime keeps global state, and repeated
+to get a stable synthesis time. For each scenario it reports:
+
+  synth (s)   median wall time of the Pulumi program under mocks
+  resources   registered resources
+  depth       longest dependency chain, in resources and in EC2 instances
+  blast       most resources downstream of a single instance, i.e. what a
+              replacement of that instance makes the engine revisit
+  user_data   largest rendered user_data; EC2 rejects more than 16 KiB
+
+With --baseline the results are compared to an earlier --output file and
+the suite exits non-zero when synthesis gets slower than the tolerance,
+or the resource count, depth or blast radius of a scenario grows.
+
+Usage: python benchmarks/suite.py [--repeat 3] [--scenario NAME ...]
+                                  [--output results.json] [--baseline results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HARNESS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'harness.py')
+
+USER_DATA_LIMIT = 16 * 1024
+
+SCENARIOS = {
+    "default": [],
+    "parallel": ["parallelProvisioning=true"],
+    "multi-az-asg": ["availabilityZones=3", 'nodejsAutoscaling={"minSize": 2, "maxSize": 6}'],
+    "replicated": ["mysqlReplicas=2", "redisReplicas=2", "redisSentinel=true"],
+    "vault-ha": ["vaultClusterSize=3", "availabilityZones=3"],
+    "sidecars": ["mysqlProxy=true", "vaultAgent=true", "mysqlReplicas=1"],
+    "environments": ['environments=["shard-a", "shard-b", "shard-c"]'],
+    "prod": ["sizingProfile=prod", "availabilityZones=3", "mysqlReplicas=2", "redisReplicas=2",
+             "redisSentinel=true", "vaultClusterSize=3", "mysqlProxy=true", "vaultAgent=true",
+             'nodejsAutoscaling={"minSize": 2, "maxSize": 6}'],
+}
+
+# Metrics where any increase counts as a regression
+GROWTH_METRICS = ("resources", "critical_path_depth", "instance_chain_depth", "max_blast_radius")
+
+
+def run_scenario(overrides):
+    """Synthesize the stack once with the given config overrides"""
+    cmd = [sys.executable, HARNESS]
+    for override in overrides:
+        cmd += ['--config', override]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def measure(overrides, repeat):
+    """Summarize `repeat` runs of one scenario"""
+    runs = [run_scenario(overrides) for _ in range(repeat)]
+    result = runs[-1]
+    return {
+        "synthesis_seconds": round(statistics.median(run["synthesis_seconds"] for run in runs), 4),
+        "resources": result["resources"],
+        "critical_path_depth": result["critical_path_depth"],
+        "instance_chain_depth": result["instance_chain_depth"],
+        "max_blast_radius": max(result["blast_radius"].values(), default=0),
+        "max_user_data_bytes": max(result["user_data_bytes"].values(), default=0),
+        "resource_types": result["resource_types"],
+        "blast_radius": result["blast_radius"],
+        "user_data_bytes": result["user_data_bytes"],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against a baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in GROWTH_METRICS:
+            if result[metric] > base[metric]:
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]}")
+        if result["synthesis_seconds"] > base["synthesis_seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: synthesis_seconds {base['synthesis_seconds']} -> {result['synthesis_seconds']}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario (median time is reported)')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='only run these scenarios')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed synthesis time growth (default 0.25)')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'scenario':<14} {'synth (s)':>10} {'resources':>9} {'depth':>6} {'instances':>9} "
+          f"{'blast':>6} {'user_data':>10}")
+    for name in args.scenario or SCENARIOS:
+        result = measure(SCENARIOS[name], args.repeat)
+        results[name] = result
+        print(f"{name:<14} {result['synthesis_seconds']:>10} {result['resources']:>9} "
+              f"{result['critical_path_depth']:>6} {result['instance_chain_depth']:>9} "
+              f"{result['max_blast_radius']:>6} {result['max_user_data_bytes']:>10}")
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2)
+
+    problems = [f"{name}: user_data of {resource} is {size} bytes, over the EC2 limit"
+                for name, result in results.items()
+                for resource, size in result["user_data_bytes"].items() if size > USER_DATA_LIMIT]
+    if args.baseline:
+        with open(args.baseline) as fd:
+            problems += compare(results, json.load(fd), args.tolerance)
+
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
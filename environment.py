@@ -0,0 +1,77 @@
+import re
+import pulumi
+from network import create_network_infrastructure
+from security import create_security_groups
+from instances import create_instances, check_pinned_replicas, PINNED_HOST_BLOCK
+
+# Environment names prefix AWS resource names, and load balancer and
+# target group names (with Pulumi's 8 character suffix) must fit in 32
+ENVIRONMENT_NAME = re.compile(r'^[a-z][a-z0-9-]{0,12}$')
+
+class AppEnvironment(pulumi.ComponentResource):
+    """One copy of the application stack (app servers, MySQL, Redis and
+    Vault) with every resource name prefixed by the environment name"""
+
+    def __init__(self, name, network, iam_profile, network_settings, security_settings, instance_settings,
+                 host_offset=0, opts=None):
+        super().__init__('app:index:Environment', name, None, opts)
+        prefix = f'{name}-'
+
+        # Without a shared network the environment gets its own VPC
+        if network is None:
+            network = create_network_infrastructure(**network_settings, name_prefix=prefix, parent=self)
+
+        security = create_security_groups(
+            network["vpc"],
+            **security_settings,
+            name_prefix=prefix,
+            parent=self
+        )
+
+        self.network = network
+        self.instances = create_instances(
+            network=network,
+            security_groups=security,
+            iam_profile=iam_profile,
+            config={
+                **instance_settings,
+                "name_prefix": prefix,
+                "parent": self,
+                "host_offset": host_offset
+            }
+        )
+
+        self.register_outputs({
+            "redis": self.instances["redis"].private_ip,
+            "db": self.instances["db"].private_ip,
+            "vault": self.instances["vault"].private_ip
+        })
+
+def create_environments(names, network, iam_profile, network_settings, security_settings, instance_settings):
+    """Create one AppEnvironment per name. They share `network` when given,
+    otherwise each creates its own; all of them use the same IAM profile"""
+    for name in names:
+        if not ENVIRONMENT_NAME.match(name):
+            raise ValueError(f"Environment name '{name}' must be 1-13 lowercase letters, digits or hyphens, starting with a letter")
+    if len(set(names)) != len(names):
+        raise ValueError(f"Environment names must be unique, got {names}")
+
+    # Pinned hosts of environments in one subnet each get their own block
+    pinned = network is not None and instance_settings.get("parallel_provisioning")
+    if pinned and len(names) * PINNED_HOST_BLOCK > 240:
+        raise ValueError(f"At most {240 // PINNED_HOST_BLOCK} environments fit in a shared /24 subnet with parallelProvisioning")
+    if instance_settings.get("parallel_provisioning"):
+        check_pinned_replicas(instance_settings.get("mysql_replicas", 0), instance_settings.get("redis_replicas", 0))
+
+    return {
+        name: AppEnvironment(
+            name,
+            network=network,
+            iam_profile=iam_profile,
+            network_settings=network_settings,
+            security_settings=security_settings,
+            instance_settings=instance_settings,
+            host_offset=index * PINNED_HOST_BLOCK if pinned else 0
+        )
+        for index, name in enumerate(names)
+    }
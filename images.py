@@ -0,0 +1,113 @@
+import hashlib
+import json
+import pulumi
+import pulumi_aws as aws
+from instances import BASE_AMI
+from security import create_image_builder_security_group, create_image_builder_iam_resources
+from utils import read_file
+
+# Install script baked into each role's AMI. Keys match the roles used by
+# create_instances
+IMAGE_ROLES = {
+    "redis": 'scripts/redis/redis-install.sh',
+    "db": 'scripts/mysql/mysql-install.sh',
+    "vault": 'scripts/vault/vault-install.sh',
+    "nodejs": 'scripts/app_server/nodejs-install.sh',
+}
+
+# Per-instance state the install leaves in the image, removed as the last
+# bake step. MySQL writes its server_uuid to auto.cnf on first start, and
+# replicas refuse to replicate from a source with the same UUID; without
+# the file every instance booting from the AMI generates its own
+IMAGE_CLEANUP = {
+    "db": ['systemctl stop mysql', 'rm -f /var/lib/mysql/auto.cnf'],
+}
+
+def content_version(*parts: str) -> str:
+    """Derive a semantic version from content so that a changed script
+    publishes a new Image Builder version instead of clashing with the old one"""
+    digest = hashlib.sha256(''.join(parts).encode()).hexdigest()
+    return f'1.0.{int(digest[:7], 16)}'
+
+def create_images(network, build_instance_type='t3.small'):
+    """Bake one AMI per role with EC2 Image Builder"""
+
+    # Package helpers the install scripts source
+    bootstrap_library = read_file('scripts/common/bootstrap.sh')
+
+    security_group = create_image_builder_security_group(network["vpc"])
+    iam_resources = create_image_builder_iam_resources()
+
+    infrastructure = aws.imagebuilder.InfrastructureConfiguration(
+        resource_name='image-builder-infra',
+        instance_profile_name=iam_resources["instance_profile"].name,
+        instance_types=[build_instance_type],
+        subnet_id=network["private_subnet"].id,
+        security_group_ids=[security_group.id],
+        terminate_instance_on_failure=True,
+        tags={'Name': 'image-builder-infra'},
+        opts=pulumi.ResourceOptions(
+            depends_on=[
+                network["nat_gateway"],
+                network["private_route_table_association"]
+            ] + network["host_reservations"][0]
+        )
+    )
+
+    amis = {}
+    for role, script_path in IMAGE_ROLES.items():
+        install_script = read_file(script_path)
+        cleanup = IMAGE_CLEANUP.get(role, [])
+        version = content_version(BASE_AMI, bootstrap_library, install_script, *cleanup)
+
+        # Image Builder component data is YAML, and JSON is valid YAML
+        component = aws.imagebuilder.Component(
+            resource_name=f'{role}-install',
+            platform='Linux',
+            version=version,
+            data=json.dumps({
+                "name": f'{role}-install',
+                "schemaVersion": 1.0,
+                "phases": [{
+                    "name": "build",
+                    "steps": [{
+                        "name": "Install",
+                        "action": "ExecuteBash",
+                        "inputs": {
+                            "commands": [
+                                "mkdir -p /usr/local/lib/provisioning",
+                                f"cat > /usr/local/lib/provisioning/bootstrap.sh << 'LIBRARY'\n{bootstrap_library}\nLIBRARY",
+                                f"cat > /tmp/install.sh << 'INSTALL'\n{install_script}\nINSTALL",
+                                "DEBIAN_FRONTEND=noninteractive bash /tmp/install.sh",
+                                "rm -f /tmp/install.sh"
+                            ] + cleanup
+                        }
+                    }]
+                }]
+            })
+        )
+
+        recipe = aws.imagebuilder.ImageRecipe(
+            resource_name=f'{role}-recipe',
+            parent_image=BASE_AMI,
+            version=version,
+            components=[
+                aws.imagebuilder.ImageRecipeComponentArgs(component_arn=component.arn)
+            ]
+        )
+
+        image = aws.imagebuilder.Image(
+            resource_name=f'{role}-image',
+            image_recipe_arn=recipe.arn,
+            infrastructure_configuration_arn=infrastructure.arn,
+            image_tests_configuration=aws.imagebuilder.ImageImageTestsConfigurationArgs(
+                image_tests_enabled=False
+            ),
+            tags={'Name': f'{role}-image'}
+        )
+
+        amis[role] = image.output_resources.apply(
+            lambda resources: resources[0].amis[0].image
+        )
+
+    return amis
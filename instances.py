@@ -1,6 +1,113 @@
 import pulumi
 import pulumi_aws as aws
-from utils import read_file, gen_password
+import lookups
+import sizing
+import tuning
+from network import az_resource_name
+from render import render_user_data
+from updates import create_config_document, config_association
+from utils import read_file, stable_password, host_ip, mysql_host_pattern
+
+# Stock Ubuntu image, used for every role that has no pre-baked AMI
+BASE_AMI = 'ami-01811d4912b4ccb26'
+
+# Fixed host offsets inside the private subnet, used when instances are
+# provisioned in parallel and can't wait for each other's private IPs
+REDIS_HOST_OFFSET = 10
+DB_HOST_OFFSET = 11
+VAULT_HOST_OFFSET = 12
+# Replica i is pinned at this offset + i in its subnet
+DB_REPLICA_HOST_OFFSET = 20
+REDIS_REPLICA_HOST_OFFSET = 30
+# Offsets 0 to 39 of the subnet, shifted by 40 for every further
+# environment sharing it
+PINNED_HOST_BLOCK = 40
+
+def pinned_host_offsets(environments=1):
+    """Host offsets that parallel provisioning may pin in each private
+    subnet when the given number of environments share it. They are
+    reserved in the subnets (see network.py) so AWS never hands them out"""
+    return range(REDIS_HOST_OFFSET, environments * PINNED_HOST_BLOCK)
+
+def check_pinned_replicas(mysql_replicas, redis_replicas):
+    """Parallel provisioning pins replica i at its role's offset + i, so
+    each role has room for 10 before running into the next block"""
+    limits = {
+        "mysqlReplicas": (mysql_replicas, REDIS_REPLICA_HOST_OFFSET - DB_REPLICA_HOST_OFFSET),
+        "redisReplicas": (redis_replicas, PINNED_HOST_BLOCK - REDIS_REPLICA_HOST_OFFSET),
+    }
+    for key, (count, limit) in limits.items():
+        if count >= limit:
+            raise ValueError(f"{key} must be below {limit} with parallelProvisioning, got {count}")
+
+# Seconds a booting Redis or MySQL server waits for SSM to push its tuning
+# file. State Manager applies an association within a minute or two of the
+# agent registering, so running out means the association failed; boot
+# then stops with a failed tuning-wait phase instead of hanging
+TUNING_WAIT_TIMEOUT = 600
+
+def install_step(name, script):
+    """Render the user_data snippet that runs a role's install script"""
+    return f'''\
+cat > /usr/local/bin/{name} << 'INSTALL'
+{script}
+INSTALL
+
+chmod +x /usr/local/bin/{name}
+phase install /usr/local/bin/{name} && \\
+rm /usr/local/bin/{name}
+'''
+
+def library_step(name, script):
+    """Render the user_data snippet that installs a shell library sourced by
+    the setup scripts. Comment lines are dropped to save user_data space,
+    the libraries have no heredocs they could belong to"""
+    code = '\n'.join(line for line in script.splitlines()
+                     if not line.lstrip().startswith('#') or line.startswith('#!'))
+    return f'''\
+mkdir -p /usr/local/lib/provisioning
+cat > /usr/local/lib/provisioning/{name} << 'LIBRARY'
+{code}
+LIBRARY
+'''
+
+def boot_step(libraries, node, redis_host, redis_password, ready_name=None):
+    """Render the user_data snippet that loads the boot phase and readiness helpers and records the boot phase.
+    With ready_name, the marker a replaced instance left behind is cleared before anything else runs"""
+    ready_clear = f'ready_clear {ready_name}\n' if ready_name else ''
+    return f'''\
+{libraries}
+export BOOT_NODE={node} BOOT_REDIS_HOST={redis_host} BOOT_REDIS_PASSWORD={redis_password}
+source /usr/local/lib/provisioning/phases.sh
+source /usr/local/lib/provisioning/readiness.sh
+phase_boot
+{ready_clear}'''
+
+def data_volume_step(spec, library):
+    """Render the user_data snippet that tells the setup script to use the role's data volume"""
+    if not spec.get("dataVolume"):
+        return ''
+    return 'echo "DATA_VOLUME=true" >> /etc/environment\n\n' + library
+
+def health_agent_step(units, agent_script, agent_service, node=None):
+    """Render the user_data snippet that deploys the health agent for the given systemd units"""
+    node_env = f'echo "HEALTH_NODE={node}" >> /etc/environment\n' if node else ''
+    return f'''\
+echo "HEALTH_UNITS={','.join(units)}" >> /etc/environment
+{node_env}
+cat > /usr/local/bin/health-agent << 'EOF'
+{agent_script}
+EOF
+
+cat > /etc/systemd/system/health-agent.service << 'EOF'
+{agent_service}
+EOF
+
+chmod 755 /usr/local/bin/health-agent
+
+systemctl daemon-reload
+systemctl enable --now health-agent.service
+'''
 
 def create_instances(network, security_groups, iam_profile, config):
     """Create EC2 instances for each component"""
@@ -9,98 +116,299 @@ def create_instances(network, security_groups, iam_profile, config):
     DB_VAULT_USER = config["db_vault_user"]
     SSH_KEY_NAME = config["ssh_key_name"]
     aws_key = config["aws_key"]
-    REGION_NAME = aws.get_region().name
-
-    # Generate passwords
-    REDIS_PASSWORD = gen_password(12)
-    DB_VAULT_PASS = gen_password(12)
-
-    # Read script files
+    PARALLEL = config.get("parallel_provisioning", False)
+    AMIS = config.get("amis") or {}
+    AUTOSCALING = config.get("nodejs_autoscaling")
+    SIZING = config.get("sizing") or sizing.resolve_sizing()
+    MYSQL_TUNING_PROFILE = config.get("mysql_tuning_profile") or "oltp-write-heavy"
+    MYSQL_REPLICAS = config.get("mysql_replicas", 0)
+    DB_REPLICATION_USER = 'replicator'
+    REDIS_TUNING = config.get("redis_tuning")
+    REDIS_REPLICAS = config.get("redis_replicas", 0)
+    REDIS_SENTINEL = config.get("redis_sentinel", False)
+    MYSQL_PROXY = config.get("mysql_proxy", False)
+    VAULT_AGENT = config.get("vault_agent", False)
+    APP_ARTIFACT = config.get("app_artifact")
+    APT_PROXY = config.get("apt_proxy")
+    DB_POOL_USER = 'nodejs_pool'
+    # Set when the instances belong to one of several environments
+    # (see environment.py): prefix for resource names and SSM parameters,
+    # parent component, and a shift of the pinned host offsets so that
+    # environments sharing a subnet don't collide
+    NAME_PREFIX = config.get("name_prefix", "")
+    PARENT = config.get("parent")
+    HOST_OFFSET = config.get("host_offset", 0)
+
+    if PARALLEL:
+        check_pinned_replicas(MYSQL_REPLICAS, REDIS_REPLICAS)
+    if REDIS_SENTINEL and REDIS_REPLICAS < 2:
+        raise ValueError("redisSentinel needs redisReplicas >= 2, so that a majority of three Sentinels can agree on a failover")
+    REGION_NAME = lookups.region()
+    VAULT_CLUSTER_SIZE = config.get("vault_cluster_size", 1)
+    VAULT_CLUSTER_TAG = f'{pulumi.get_project()}-{pulumi.get_stack()}-{NAME_PREFIX}vault'
+    VAULT_SEAL = config.get("vault_seal") or {"type": "awskms"}
+    VAULT_KMS_KEY = config.get("vault_kms_key")
+
+    if VAULT_SEAL.get("type") not in ("awskms", "transit"):
+        raise ValueError(f"vaultSeal.type must be 'awskms' or 'transit', got '{VAULT_SEAL.get('type')}'")
+    if VAULT_SEAL["type"] == "awskms" and VAULT_KMS_KEY is None:
+        raise ValueError("vaultSeal awskms needs the KMS key from create_iam_resources")
+
+    if VAULT_CLUSTER_SIZE < 1:
+        raise ValueError(f"vaultClusterSize must be at least 1, got {VAULT_CLUSTER_SIZE}")
+    if VAULT_CLUSTER_SIZE % 2 == 0:
+        pulumi.log.warn(f"vaultClusterSize {VAULT_CLUSTER_SIZE} is even; Raft tolerates no more failures than with {VAULT_CLUSTER_SIZE - 1} nodes")
+
+    # Generate passwords. They live in the stack state, so user_data stays
+    # the same from one run to the next
+    def password(name, n):
+        return stable_password(f'{NAME_PREFIX}{name}', n, PARENT)
+
+    REDIS_PASSWORD = password('redis-password', 12)
+    DB_ROOT_PASS = password('db-root-password', 12)
+    DB_VAULT_PASS = password('db-vault-password', 12)
+    DB_REPLICATION_PASS = password('db-replication-password', 12) if MYSQL_REPLICAS else ''
+    REDIS_CONFIG_COMMAND = password('redis-config-command', 16).apply(lambda suffix: f'CONFIG-{suffix}') if REDIS_SENTINEL else ''
+    PROXYSQL_ADMIN_PASS = password('proxysql-admin-password', 16) if MYSQL_PROXY else ''
+    DB_POOL_FRONTEND_PASS = password('db-pool-frontend-password', 16) if MYSQL_PROXY else ''
+
+    # Read script files. Roles booting from a pre-baked AMI already have
+    # their packages, so their user_data skips the install step. Install
+    # scripts share the package helpers in bootstrap.sh
+    bootstrap_library = library_step('bootstrap.sh', read_file('scripts/common/bootstrap.sh'))
+    if APT_PROXY:
+        bootstrap_library += f'export APT_PROXY_URL={APT_PROXY}\n'
+    redis_install = '' if "redis" in AMIS else bootstrap_library + install_step('redis-install.sh', read_file('scripts/redis/redis-install.sh'))
+    mysql_install = '' if "db" in AMIS else bootstrap_library + install_step('mysql-install.sh', read_file('scripts/mysql/mysql-install.sh'))
+    vault_install = '' if "vault" in AMIS else bootstrap_library + install_step('vault-install.sh', read_file('scripts/vault/vault-install.sh'))
+    nodejs_install = '' if "nodejs" in AMIS else bootstrap_library + install_step('nodejs-install.sh', read_file('scripts/app_server/nodejs-install.sh'))
     redis_setup_script = read_file('scripts/redis/redis-setup.sh')
+    redis_tuning = tuning.render_redis_config(SIZING["redis"], REDIS_TUNING)
     mysql_setup_script = read_file('scripts/mysql/mysql-setup.sh')
-    mysql_hcheck_script = read_file('scripts/mysql/mysql-check.sh')
-    mysql_hcheck_service = read_file('scripts/mysql/mysql-check.service')
+    mysql_tuning = tuning.render_mysql_config(SIZING["db"], MYSQL_TUNING_PROFILE)
+    if MYSQL_REPLICAS:
+        mysql_tuning += '\n' + tuning.render_mysql_replication_config(1)
+    mysql_replica_setup_script = read_file('scripts/mysql/mysql-replica-setup.sh')
     db_schema = read_file('scripts/mysql/schema.sql')
     vault_setup_script = read_file('scripts/vault/vault-setup.sh')
-    vault_hcheck_script = read_file('scripts/vault/vault-check.sh')
-    vault_hcheck_service = read_file('scripts/vault/vault-check.service')
     nodejs_setup_script = read_file('scripts/app_server/nodejs-setup.sh')
     nodejs_app_service = read_file('scripts/app_server/nodejs-app.service')
-
-    # Create Redis instance
-    def generate_redis_user_data(redis_password):
+    proxysql_install = install_step('proxysql-install.sh', read_file('scripts/proxysql/proxysql-install.sh')) if MYSQL_PROXY else ''
+    if MYSQL_PROXY and "nodejs" in AMIS:
+        proxysql_install = bootstrap_library + proxysql_install
+    proxysql_setup_script = read_file('scripts/proxysql/proxysql-setup.sh')
+    vault_agent_setup_script = read_file('scripts/vault_agent/vault-agent-setup.sh')
+    vault_agent_service = read_file('scripts/vault_agent/vault-agent.service')
+    proxysql_refresh_script = read_file('scripts/proxysql/proxysql_refresh.py')
+    proxysql_refresh_service = read_file('scripts/proxysql/proxysql-refresh.service')
+    health_agent_script = read_file('scripts/health/health_agent.py')
+    health_agent_service = read_file('scripts/health/health-agent.service')
+    boot_libraries = (library_step('phases.sh', read_file('scripts/common/phases.sh')) +
+                      library_step('readiness.sh', read_file('scripts/common/readiness.sh')))
+    data_volume_library = library_step('data-volume.sh', read_file('scripts/common/data-volume.sh'))
+    redis_data_volume = data_volume_step(SIZING["redis"], data_volume_library)
+    mysql_data_volume = data_volume_step(SIZING["db"], data_volume_library)
+    mysql_health = health_agent_step(['mysql'], health_agent_script, health_agent_service)
+
+    # In parallel mode private IPs are pinned up front, so the only ordering
+    # left between instances is the network they boot into. Boot-time
+    # ordering (e.g. Vault waiting for MySQL) is handled by the setup scripts.
+    key_deps = [aws_key] if aws_key else []
+    private_subnets = network["private_subnets"]
+
+    def network_deps(index=0):
+        """The NAT gateway, route table association and subnet of the AZ an
+        instance placed by index lands in; it has no egress before them"""
+        az = index % len(private_subnets)
+        return [
+            network["nat_gateways"][az],
+            network["private_route_table_associations"][az],
+            private_subnets[az]
+        ] + network["host_reservations"][az] + key_deps
+
+    # The app servers boot in the public subnets and need the internet
+    # gateway route of every one of them
+    public_network_deps = [
+        network["internet_gateway"],
+        network["public_route_table"]
+    ] + network["public_route_table_associations"] + key_deps
+
+    def mysql_hosts(count):
+        """MySQL account hosts of the private subnets that count instances
+        placed by index land in, comma separated"""
+        cidrs = [subnet.cidr_block for subnet in private_subnets[:count]]
+        return pulumi.Output.all(*cidrs).apply(lambda cidrs: ','.join(mysql_host_pattern(cidr) for cidr in cidrs))
+
+    # Tuning files are not part of user_data. SSM pushes them to the running
+    # servers and restarts the service, so tuning changes update in place
+    config_document = create_config_document(NAME_PREFIX, PARENT)
+
+    if PARALLEL:
+        private_cidr = network["private_subnet"].cidr_block
+        redis_ip = private_cidr.apply(lambda cidr: host_ip(cidr, HOST_OFFSET + REDIS_HOST_OFFSET))
+        db_ip = private_cidr.apply(lambda cidr: host_ip(cidr, HOST_OFFSET + DB_HOST_OFFSET))
+        vault_ip = private_cidr.apply(lambda cidr: host_ip(cidr, HOST_OFFSET + VAULT_HOST_OFFSET))
+    else:
+        redis_ip = db_ip = vault_ip = None
+
+    # Create Redis instance. Replicas and Sentinel use the same user_data
+    # with a different role
+    def generate_redis_user_data(redis_password, redis_role='primary', primary_ip='', config_command='', node=f'{NAME_PREFIX}redis-server'):
+        # Boot phases and readiness markers go to the primary; replicas are read-only
+        ready_name = 'redis' if redis_role == 'primary' else node
+        # A new primary starts empty, only replicas can find a stale marker
+        boot = boot_step(boot_libraries, node, primary_ip or '127.0.0.1', redis_password,
+                         ready_name=node if redis_role == 'replica' else None)
+        topology_env = ''
+        if redis_role == 'replica':
+            topology_env += f'echo "REDIS_ROLE=replica" >> /etc/environment\necho "REDIS_PRIMARY_IP={primary_ip}" >> /etc/environment\n'
+        if REDIS_SENTINEL:
+            topology_env += f'''\
+echo "REDIS_SENTINEL=true" >> /etc/environment
+echo "REDIS_SENTINEL_QUORUM={(REDIS_REPLICAS + 1) // 2 + 1}" >> /etc/environment
+echo "REDIS_CONFIG_COMMAND={config_command}" >> /etc/environment
+'''
         return f'''\
 #!/usr/bin/env bash
 set -euxo pipefail
 exec > >(tee /var/log/redis-userdata.log) 2>&1
 
-apt update && apt install -y gpg
-
+{boot}
 mkdir -p /usr/local/bin
 
 echo "REDIS_PASSWORD={redis_password}" >> /etc/environment
+{topology_env}
+{redis_data_volume}
+{redis_install}
+
+# Included at the end of redis.conf by redis-setup.sh. Pushed over SSM
+# (see updates.py), so tuning changes don't replace the instance
+phase tuning-wait wait_file /etc/redis/tuning.conf {TUNING_WAIT_TIMEOUT}
 
-cat > /usr/local/bin/redis-setup.sh << 'EOF'
+cat > /usr/local/bin/redis-setup.sh << 'FINAL'
 {redis_setup_script}
-EOF
+FINAL
 
 chmod +x /usr/local/bin/redis-setup.sh
 
-/usr/local/bin/redis-setup.sh && \
-rm /usr/local/bin/redis-setup.sh
+phase setup /usr/local/bin/redis-setup.sh && \
+rm /usr/local/bin/redis-setup.sh && \
+ready_mark {ready_name}
 '''
 
     redis_ec2 = aws.ec2.Instance(
-        resource_name = 'redis-server',
-        instance_type = 't2.micro',
-        ami = 'ami-01811d4912b4ccb26',
+        resource_name = f'{NAME_PREFIX}redis-server',
+        instance_type = SIZING["redis"]["instanceType"],
+        ebs_optimized = SIZING["redis"].get("ebsOptimized"),
+        root_block_device = sizing.root_block_device(SIZING["redis"]),
+        ebs_block_devices = sizing.ebs_block_devices(SIZING["redis"]),
+        ami = AMIS.get("redis", BASE_AMI),
         subnet_id = network["private_subnet"].id,
+        private_ip = redis_ip,
+        iam_instance_profile=iam_profile.name,
         key_name = SSH_KEY_NAME,
         vpc_security_group_ids=[
             security_groups["redis"].id
         ],
-        user_data=pulumi.Output.all(REDIS_PASSWORD).apply(
-            lambda args: generate_redis_user_data(args[0]),
+        user_data_base64=pulumi.Output.all(REDIS_PASSWORD, 'primary', '', REDIS_CONFIG_COMMAND, f'{NAME_PREFIX}redis-server').apply(
+            lambda args: render_user_data(f'{NAME_PREFIX}redis-server', generate_redis_user_data, *args),
         ),
         user_data_replace_on_change=True,
         tags = {
-            'Name': 'redis-server'
+            'Name': f'{NAME_PREFIX}redis-server'
         },
         opts=pulumi.ResourceOptions(
-            depends_on=[
-                network["nat_gateway"],
-                network["private_route_table_association"],
-                network["private_subnet"]
-            ] + ([aws_key] if aws_key else [])
+            parent=PARENT,
+            depends_on=network_deps()
         )
     )
 
+    config_association(f'{NAME_PREFIX}redis-server-tuning', config_document, redis_ec2,
+                       '/etc/redis/tuning.conf', redis_tuning, 'systemctl try-restart redis-server', PARENT)
+
+    if not PARALLEL:
+        redis_ip = redis_ec2.private_ip
+
+    # Create Redis replicas, spread over the private subnets
+    redis_replicas = []
+    redis_replica_ips = []
+    for index in range(REDIS_REPLICAS):
+        name = f'{NAME_PREFIX}redis-replica-{index + 1}'
+        subnet = private_subnets[index % len(private_subnets)]
+        replica_ip = subnet.cidr_block.apply(lambda cidr, index=index: host_ip(cidr, HOST_OFFSET + REDIS_REPLICA_HOST_OFFSET + index)) if PARALLEL else None
+
+        replica = aws.ec2.Instance(
+            resource_name = name,
+            instance_type = SIZING["redis"]["instanceType"],
+            ebs_optimized = SIZING["redis"].get("ebsOptimized"),
+            root_block_device = sizing.root_block_device(SIZING["redis"]),
+            ebs_block_devices = sizing.ebs_block_devices(SIZING["redis"]),
+            ami = AMIS.get("redis", BASE_AMI),
+            subnet_id = subnet.id,
+            private_ip = replica_ip,
+            iam_instance_profile=iam_profile.name,
+            key_name = SSH_KEY_NAME,
+            vpc_security_group_ids=[
+                security_groups["redis"].id
+            ],
+            user_data_base64=pulumi.Output.all(REDIS_PASSWORD, 'replica', redis_ip, REDIS_CONFIG_COMMAND, name).apply(
+                lambda args, name=name: render_user_data(name, generate_redis_user_data, *args),
+            ),
+            user_data_replace_on_change=True,
+            tags = {
+                'Name': name
+            },
+            opts=pulumi.ResourceOptions(
+                parent=PARENT,
+                depends_on=network_deps(index) if PARALLEL else [redis_ec2] + network_deps(index)
+            )
+        )
+        config_association(f'{name}-tuning', config_document, replica,
+                           '/etc/redis/tuning.conf', redis_tuning, 'systemctl try-restart redis-server', PARENT)
+        redis_replicas.append(replica)
+        redis_replica_ips.append(replica_ip if PARALLEL else replica.private_ip)
+
+    # Sentinel runs next to every Redis server; clients that speak the
+    # Sentinel protocol follow the primary across failovers
+    if REDIS_SENTINEL:
+        redis_sentinels = pulumi.Output.all(redis_ip, *redis_replica_ips).apply(
+            lambda ips: ','.join(f'{ip}:26379' for ip in ips)
+        )
+    else:
+        redis_sentinels = ''
+
     # Create MySQL instance
-    def generate_mysql_user_data(redis_host_ip, redis_pass, db_vault_pass, private_subnet_cidr):
+    def generate_mysql_user_data(redis_host_ip, redis_pass, db_root_pass, db_vault_pass, db_vault_hosts, db_replication_pass, db_replication_hosts):
+        boot = boot_step(boot_libraries, f'{NAME_PREFIX}db-server', redis_host_ip, redis_pass, ready_name='mysql')
+        pool_env = f'echo "DB_POOL_USER={DB_POOL_USER}" >> /etc/environment' if MYSQL_PROXY else ''
+        replication_env = f'''\
+echo "DB_REPLICATION_USER={DB_REPLICATION_USER}" >> /etc/environment
+echo "DB_REPLICATION_PASS={db_replication_pass}" >> /etc/environment
+echo "DB_REPLICATION_HOSTS={db_replication_hosts}" >> /etc/environment''' if db_replication_pass else ''
         return f'''\
 #!/usr/bin/env bash
 set -euxo pipefail
 exec > >(tee /var/log/mysql-userdata.log) 2>&1
 
+{boot}
 echo "REDIS_HOST_IP={redis_host_ip}" >> /etc/environment
 echo "REDIS_PASSWORD={redis_pass}" >> /etc/environment
-echo "DB_ROOT_PASS={gen_password(12)}" >> /etc/environment
+echo "DB_ROOT_PASS={db_root_pass}" >> /etc/environment
 echo "DB_NAME={DB_NAME}" >> /etc/environment
 echo "DB_VAULT_USER={DB_VAULT_USER}" >> /etc/environment
 echo "DB_VAULT_PASS={db_vault_pass}" >> /etc/environment
-echo "PRIVATE_SUBNET_CIDR={private_subnet_cidr}" >> /etc/environment
-
-apt update
+echo "DB_VAULT_HOSTS={db_vault_hosts}" >> /etc/environment
+{replication_env}
+{pool_env}
 
 mkdir -p /usr/local/bin
 
-cat > /usr/local/bin/mysql-check.sh << 'EOF'
-{mysql_hcheck_script}
-EOF
+{mysql_data_volume}
+{mysql_install}
 
-cat > /etc/systemd/system/mysql-check.service << 'EOF'
-{mysql_hcheck_service}
-EOF
+# Loaded after mysqld.cnf, mysql-setup.sh restarts MySQL to apply it.
+# Pushed over SSM (see updates.py), so tuning changes don't replace the instance
+phase tuning-wait wait_file /etc/mysql/mysql.conf.d/zz-tuning.cnf {TUNING_WAIT_TIMEOUT}
 
 cat > /usr/local/bin/mysql-setup.sh << 'FINAL'
 {mysql_setup_script}
@@ -110,131 +418,311 @@ cat > /tmp/schema.sql << 'EOF'
 {db_schema}
 EOF
 
-chmod u+x /usr/local/bin/mysql-check.sh
 chmod +x /usr/local/bin/mysql-setup.sh
 
+phase setup /usr/local/bin/mysql-setup.sh && \
+rm /usr/local/bin/mysql-setup.sh && \
+ready_mark mysql
 
-/usr/local/bin/mysql-setup.sh && \
-rm /usr/local/bin/mysql-setup.sh
-
-chown mysql:mysql /usr/local/bin/mysql-check.sh
-chmod 500 /usr/local/bin/mysql-check.sh
-
-systemctl enable --now mysql-check.service
-'''
+{mysql_health}'''
 
     db = aws.ec2.Instance(
-        resource_name = 'db-server',
-        instance_type = 't2.micro',
-        ami = 'ami-01811d4912b4ccb26',
+        resource_name = f'{NAME_PREFIX}db-server',
+        instance_type = SIZING["db"]["instanceType"],
+        ebs_optimized = SIZING["db"].get("ebsOptimized"),
+        root_block_device = sizing.root_block_device(SIZING["db"]),
+        ebs_block_devices = sizing.ebs_block_devices(SIZING["db"]),
+        ami = AMIS.get("db", BASE_AMI),
         subnet_id = network["private_subnet"].id,
+        private_ip = db_ip,
+        iam_instance_profile=iam_profile.name,
         key_name = SSH_KEY_NAME,
         vpc_security_group_ids=[
             security_groups["db"].id
         ],
-        user_data=pulumi.Output.all(redis_ec2.private_ip, REDIS_PASSWORD, DB_VAULT_PASS, network["private_subnet"].cidr_block).apply(
-            lambda args: generate_mysql_user_data(*args),
+        user_data_base64=pulumi.Output.all(redis_ip, REDIS_PASSWORD, DB_ROOT_PASS, DB_VAULT_PASS, mysql_hosts(VAULT_CLUSTER_SIZE),
+                                            DB_REPLICATION_PASS, mysql_hosts(MYSQL_REPLICAS)).apply(
+            lambda args: render_user_data(f'{NAME_PREFIX}db-server', generate_mysql_user_data, *args),
         ),
         user_data_replace_on_change=True,
         tags = {
-            'Name': 'db-server'
+            'Name': f'{NAME_PREFIX}db-server'
         },
         opts=pulumi.ResourceOptions(
-            depends_on=[
-                redis_ec2
-            ] + ([aws_key] if aws_key else [])
+            parent=PARENT,
+            depends_on=network_deps() if PARALLEL else [redis_ec2] + key_deps
         )
     )
 
-    # Create Vault instance
-    def generate_vault_user_data(redis_host_ip, redis_pass, db_host_ip, db_user, db_pass):
+    config_association(f'{NAME_PREFIX}db-server-tuning', config_document, db,
+                       '/etc/mysql/mysql.conf.d/zz-tuning.cnf', mysql_tuning, 'systemctl try-restart mysql', PARENT)
+
+    if not PARALLEL:
+        db_ip = db.private_ip
+
+    # Create MySQL read replicas, spread over the private subnets. They
+    # replicate from the primary with GTID auto-positioning
+    def generate_mysql_replica_user_data(replica_name, redis_host_ip, redis_pass, db_host_ip, db_replication_pass):
+        boot = boot_step(boot_libraries, replica_name, redis_host_ip, redis_pass, ready_name=replica_name)
+        replica_health = health_agent_step(['mysql'], health_agent_script, health_agent_service, node=replica_name)
+        return f'''\
+#!/usr/bin/env bash
+set -euxo pipefail
+exec > >(tee /var/log/mysql-userdata.log) 2>&1
+
+{boot}
+echo "REDIS_HOST_IP={redis_host_ip}" >> /etc/environment
+echo "REDIS_PASSWORD={redis_pass}" >> /etc/environment
+echo "DB_HOST_IP={db_host_ip}" >> /etc/environment
+echo "DB_REPLICATION_USER={DB_REPLICATION_USER}" >> /etc/environment
+echo "DB_REPLICATION_PASS={db_replication_pass}" >> /etc/environment
+
+mkdir -p /usr/local/bin
+
+{mysql_data_volume}
+{mysql_install}
+
+phase tuning-wait wait_file /etc/mysql/mysql.conf.d/zz-tuning.cnf {TUNING_WAIT_TIMEOUT}
+
+cat > /usr/local/bin/mysql-replica-setup.sh << 'FINAL'
+{mysql_replica_setup_script}
+FINAL
+
+chmod +x /usr/local/bin/mysql-replica-setup.sh
+
+phase setup /usr/local/bin/mysql-replica-setup.sh && \
+rm /usr/local/bin/mysql-replica-setup.sh && \
+ready_mark {replica_name}
+
+{replica_health}'''
+
+    db_replicas = []
+    db_read_ips = []
+    for index in range(MYSQL_REPLICAS):
+        name = f'{NAME_PREFIX}db-replica-{index + 1}'
+        subnet = private_subnets[index % len(private_subnets)]
+        replica_ip = subnet.cidr_block.apply(lambda cidr, index=index: host_ip(cidr, HOST_OFFSET + DB_REPLICA_HOST_OFFSET + index)) if PARALLEL else None
+
+        replica = aws.ec2.Instance(
+            resource_name = name,
+            instance_type = SIZING["db"]["instanceType"],
+            ebs_optimized = SIZING["db"].get("ebsOptimized"),
+            root_block_device = sizing.root_block_device(SIZING["db"]),
+            ebs_block_devices = sizing.ebs_block_devices(SIZING["db"]),
+            ami = AMIS.get("db", BASE_AMI),
+            subnet_id = subnet.id,
+            private_ip = replica_ip,
+            iam_instance_profile=iam_profile.name,
+            key_name = SSH_KEY_NAME,
+            vpc_security_group_ids=[
+                security_groups["db"].id
+            ],
+            user_data_base64=pulumi.Output.all(name, redis_ip, REDIS_PASSWORD, db_ip, DB_REPLICATION_PASS).apply(
+                lambda args, name=name: render_user_data(name, generate_mysql_replica_user_data, *args),
+            ),
+            user_data_replace_on_change=True,
+            tags = {
+                'Name': name
+            },
+            opts=pulumi.ResourceOptions(
+                parent=PARENT,
+                depends_on=network_deps(index) if PARALLEL else [db] + network_deps(index)
+            )
+        )
+        replica_tuning = tuning.render_mysql_config(SIZING["db"], "read-heavy") + '\n' + \
+            tuning.render_mysql_replication_config(index + 2, replica=True)
+        config_association(f'{name}-tuning', config_document, replica,
+                           '/etc/mysql/mysql.conf.d/zz-tuning.cnf', replica_tuning, 'systemctl try-restart mysql', PARENT)
+        db_replicas.append(replica)
+        db_read_ips.append(replica_ip if PARALLEL else replica.private_ip)
+
+    # Reads go to the replicas, or to the primary when there are none
+    db_read_host_ips = pulumi.Output.all(*db_read_ips).apply(','.join) if db_read_ips else db_ip
+
+    # Create Vault instances. With vaultClusterSize above 1 the nodes form a
+    # Raft cluster, spread over the private subnets and found by their tag
+    def generate_vault_user_data(node_index, redis_host_ip, redis_pass, db_host_ip, db_user, db_pass, seal_secret):
+        node = az_resource_name(f'{NAME_PREFIX}vault-server', node_index)
+        # The first node configures Vault, the app waits for that one
+        ready_name = 'vault' if node_index == 0 else node
+        boot = boot_step(boot_libraries, node, redis_host_ip, redis_pass, ready_name=ready_name)
+        # Cluster nodes each report under their own name, health:vault:<node>
+        vault_health = health_agent_step(['vault'], health_agent_script, health_agent_service,
+                                         node=node if VAULT_CLUSTER_SIZE > 1 else None)
+        cluster_env = f'echo "VAULT_CLUSTER_TAG={VAULT_CLUSTER_TAG}" >> /etc/environment' if VAULT_CLUSTER_SIZE > 1 else ''
+        pool_env = f'echo "DB_POOL_USER={DB_POOL_USER}" >> /etc/environment' if MYSQL_PROXY else ''
+        if VAULT_SEAL["type"] == "awskms":
+            seal_env = f'echo "VAULT_KMS_KEY_ID={seal_secret}" >> /etc/environment'
+        else:
+            seal_env = f'''\
+echo "VAULT_TRANSIT_ADDR={VAULT_SEAL["address"]}" >> /etc/environment
+echo "VAULT_TRANSIT_TOKEN={seal_secret}" >> /etc/environment
+echo "VAULT_TRANSIT_KEY_NAME={VAULT_SEAL.get("keyName", "autounseal")}" >> /etc/environment
+echo "VAULT_TRANSIT_MOUNT_PATH={VAULT_SEAL.get("mountPath", "transit/")}" >> /etc/environment'''
         return f'''\
 #!/usr/bin/env bash
 set -euxo pipefail
 exec > >(tee /var/log/vault-userdata.log) 2>&1
 
+{boot}
 echo "REDIS_HOST_IP={redis_host_ip}" >> /etc/environment
 echo "REDIS_PASSWORD={redis_pass}" >> /etc/environment
+echo "SSM_PREFIX={NAME_PREFIX}" >> /etc/environment
 echo "DB_HOST_IP={db_host_ip}" >> /etc/environment
 echo "DB_USER={db_user}" >> /etc/environment
 echo "DB_PASSWORD={db_pass}" >> /etc/environment
 echo "DB_NAME={DB_NAME}" >> /etc/environment
-
-
-apt update
+echo "REGION_NAME={REGION_NAME}" >> /etc/environment
+echo "VAULT_NODE_INDEX={node_index}" >> /etc/environment
+echo "VAULT_SEAL_TYPE={VAULT_SEAL["type"]}" >> /etc/environment
+{seal_env}
+{cluster_env}
+{pool_env}
 
 mkdir -p /usr/local/bin
 
-cat > /usr/local/bin/vault-check.sh << 'EOF'
-{vault_hcheck_script}
-EOF
-
-cat > /etc/systemd/system/vault-check.service << 'EOF'
-{vault_hcheck_service}
-EOF
+{vault_install}
 
 cat > /usr/local/bin/vault-setup.sh << 'FINAL'
 {vault_setup_script}
 FINAL
 
-chmod u+x /usr/local/bin/vault-check.sh
 chmod 500 /usr/local/bin/vault-setup.sh
 
+phase setup /usr/local/bin/vault-setup.sh
+ready_mark {ready_name}
+
+{vault_health}'''
+
+    # The KMS key ID, or the token of the transit seal
+    seal_secret = VAULT_KMS_KEY.key_id if VAULT_SEAL["type"] == "awskms" else VAULT_SEAL["token"]
+
+    vault_nodes = []
+    for index in range(VAULT_CLUSTER_SIZE):
+        name = az_resource_name(f'{NAME_PREFIX}vault-server', index)
+        tags = {'Name': name}
+        if VAULT_CLUSTER_SIZE > 1:
+            tags['VaultCluster'] = VAULT_CLUSTER_TAG
+
+        vault_nodes.append(aws.ec2.Instance(
+            resource_name = name,
+            instance_type = SIZING["vault"]["instanceType"],
+            ebs_optimized = SIZING["vault"].get("ebsOptimized"),
+            root_block_device = sizing.root_block_device(SIZING["vault"]),
+            ami = AMIS.get("vault", BASE_AMI),
+            iam_instance_profile=iam_profile.name,
+            subnet_id = private_subnets[index % len(private_subnets)].id,
+            private_ip = vault_ip if index == 0 else None,
+            key_name = SSH_KEY_NAME,
+            vpc_security_group_ids=[
+                security_groups["vault"].id
+            ],
+            user_data_base64=pulumi.Output.all(index, redis_ip, REDIS_PASSWORD, db_ip, DB_VAULT_USER, DB_VAULT_PASS, seal_secret).apply(
+                lambda args, name=name: render_user_data(name, generate_vault_user_data, *args),
+            ),
+            user_data_replace_on_change=True,
+            tags = tags,
+            opts=pulumi.ResourceOptions(
+                parent=PARENT,
+                depends_on=network_deps(index) if PARALLEL else [db] + network_deps(index)
+            )
+        ))
+
+    vault_ec2 = vault_nodes[0]
+    if not PARALLEL:
+        vault_ip = vault_ec2.private_ip
+
+    # The app talks to the cluster through an internal NLB instead of a node
+    vault_tier = {}
+    if VAULT_CLUSTER_SIZE > 1:
+        vault_tier = create_vault_load_balancer(network, vault_nodes, security_groups["vault_nlb"], NAME_PREFIX, PARENT)
+        vault_ip = vault_tier["vault_load_balancer"].dns_name
+
+    # ProxySQL sidecar: one thread per app server vCPU, and the primary's
+    # connection limit shared by as many app servers as can run at once
+    nodejs_type = (AUTOSCALING or {}).get("instanceType", SIZING["nodejs"]["instanceType"])
+    app_servers = AUTOSCALING.get("maxSize", 6) if AUTOSCALING else 1
+    db_connections = tuning.mysql_settings(SIZING["db"], MYSQL_TUNING_PROFILE)["max_connections"]
+    proxysql_threads = sizing.instance_resources(nodejs_type)["vcpus"]
+    proxysql_backend_connections = max(10, int(db_connections * 0.8) // app_servers)
 
-/usr/local/bin/vault-setup.sh
-
-chown vault:vault /usr/local/bin/vault-check.sh
-chmod 500 /usr/local/bin/vault-check.sh
-
-systemctl enable --now vault-check.service
+    # Create Node.js instance
+    def generate_nodejs_user_data(redis_host_ip, db_host_ip, vault_host_ip, redis_pass, db_read_host_ips, redis_sentinel_hosts,
+                                  proxysql_admin_pass, db_pool_frontend_pass, app_artifact_url):
+        boot = boot_step(boot_libraries, f'{NAME_PREFIX}nodejs-server', redis_host_ip, redis_pass)
+        # Prebuilt app with its dependencies, instead of cloning and running npm install
+        artifact_env = f'''\
+echo "APP_ARTIFACT_URL={app_artifact_url}" >> /etc/environment
+echo "APP_REVISION={APP_ARTIFACT["revision"]}" >> /etc/environment''' if APP_ARTIFACT else ''
+        proxysql = ''
+        if MYSQL_PROXY:
+            proxysql = f'''\
+echo "MYSQL_PROXY=true" >> /etc/environment
+echo "DB_POOL_USER={DB_POOL_USER}" >> /etc/environment
+echo "DB_POOL_FRONTEND_PASS={db_pool_frontend_pass}" >> /etc/environment
+echo "PROXYSQL_ADMIN_PASS={proxysql_admin_pass}" >> /etc/environment
+echo "PROXYSQL_THREADS={proxysql_threads}" >> /etc/environment
+echo "PROXYSQL_BACKEND_CONNECTIONS={proxysql_backend_connections}" >> /etc/environment
+
+{proxysql_install}
+
+cat > /usr/local/bin/proxysql-setup.sh << 'PROXYSQL'
+{proxysql_setup_script}
+PROXYSQL
+
+cat > /usr/local/bin/proxysql-refresh << 'PROXYSQL'
+{proxysql_refresh_script}
+PROXYSQL
+
+cat > /etc/systemd/system/proxysql-refresh.service << 'PROXYSQL'
+{proxysql_refresh_service}
+PROXYSQL
+
+chmod +x /usr/local/bin/proxysql-setup.sh
+chmod 755 /usr/local/bin/proxysql-refresh
 '''
+        vault_agent = ''
+        if VAULT_AGENT:
+            vault_agent = f'''\
+echo "VAULT_AGENT=true" >> /etc/environment
 
-    vault_ec2 = aws.ec2.Instance(
-        resource_name = 'vault-server',
-        instance_type = 't2.micro',
-        ami = 'ami-01811d4912b4ccb26',
-        iam_instance_profile=iam_profile.name,
-        subnet_id = network["private_subnet"].id,
-        key_name = SSH_KEY_NAME,
-        vpc_security_group_ids=[
-            security_groups["vault"].id
-        ],
-        user_data=pulumi.Output.all(redis_ec2.private_ip, REDIS_PASSWORD, db.private_ip, DB_VAULT_USER, DB_VAULT_PASS).apply(
-            lambda args: generate_vault_user_data(*args),
-        ),
-        user_data_replace_on_change=True,
-        tags = {
-            'Name': 'vault-server'
-        },
-        opts=pulumi.ResourceOptions(
-            depends_on=[
-                db
-            ] + ([aws_key] if aws_key else [])
-        )
-    )
+cat > /usr/local/bin/vault-agent-setup.sh << 'AGENT'
+{vault_agent_setup_script}
+AGENT
 
-    # Create Node.js instance
-    def generate_nodejs_user_data(redis_host_ip, db_host_ip, vault_host_ip, redis_pass):
+cat > /etc/systemd/system/vault-agent.service << 'AGENT'
+{vault_agent_service}
+AGENT
+
+chmod +x /usr/local/bin/vault-agent-setup.sh
+'''
         return f'''\
 #!/usr/bin/env bash
 set -euxo pipefail
 exec > >(tee /var/log/nodejs-userdata.log) 2>&1
 
+{boot}
 echo "REDIS_HOST_IP={redis_host_ip}" >> /etc/environment
 echo "REDIS_PASSWORD={redis_pass}" >> /etc/environment
+echo "REDIS_SENTINELS={redis_sentinel_hosts}" >> /etc/environment
 echo "DB_HOST_IP={db_host_ip}" >> /etc/environment
+echo "DB_READ_HOST_IPS={db_read_host_ips}" >> /etc/environment
 echo "VAULT_HOST_IP={vault_host_ip}" >> /etc/environment
+echo "SSM_PREFIX={NAME_PREFIX}" >> /etc/environment
 echo "DB_NAME={DB_NAME}" >> /etc/environment
 echo "REGION_NAME={REGION_NAME}" >> /etc/environment
-
-apt update
+{artifact_env}
 
 mkdir -p /usr/local/bin
 mkdir -p /opt/app
 
-cat > /usr/local/bin/nodejs-setup.sh << 'EOF'
+{nodejs_install}
+
+{vault_agent}
+{proxysql}
+cat > /usr/local/bin/nodejs-setup.sh << 'FINAL'
 {nodejs_setup_script}
-EOF
+FINAL
 
 cat > /etc/systemd/system/nodejs-app.service << 'EOF'
 {nodejs_app_service}
@@ -243,35 +731,266 @@ EOF
 
 chmod +x /usr/local/bin/nodejs-setup.sh
 
-/usr/local/bin/nodejs-setup.sh
+phase setup /usr/local/bin/nodejs-setup.sh
+ready_mark
 '''
 
-    nodejs = aws.ec2.Instance(
-        resource_name='nodejs-server',
-        instance_type='t2.micro',
-        ami='ami-01811d4912b4ccb26',
-        iam_instance_profile=iam_profile.name,
-        subnet_id=network["public_subnet"].id,
-        key_name=SSH_KEY_NAME,
-        vpc_security_group_ids=[
-            security_groups["nodejs"].id
-        ],
-        associate_public_ip_address=True,
-        user_data=pulumi.Output.all(redis_ec2.private_ip, db.private_ip, vault_ec2.private_ip, REDIS_PASSWORD).apply(
-            lambda args: generate_nodejs_user_data(*args)
-        ),
-        user_data_replace_on_change=True,
-        tags={
-            'Name': 'nodejs-server'
-        },
-        opts=pulumi.ResourceOptions(
-            depends_on=[vault_ec2] + ([aws_key] if aws_key else [])
-        )
+    nodejs_user_data = pulumi.Output.all(redis_ip, db_ip, vault_ip, REDIS_PASSWORD, db_read_host_ips, redis_sentinels,
+                                         PROXYSQL_ADMIN_PASS, DB_POOL_FRONTEND_PASS,
+                                         APP_ARTIFACT["url"] if APP_ARTIFACT else '').apply(
+        lambda args: render_user_data(f'{NAME_PREFIX}nodejs-server', generate_nodejs_user_data, *args)
     )
 
+    if AUTOSCALING:
+        nodejs_tier = create_nodejs_autoscaling(
+            network=network,
+            security_groups=security_groups,
+            iam_profile=iam_profile,
+            user_data=nodejs_user_data,
+            ami=AMIS.get("nodejs", BASE_AMI),
+            ssh_key_name=SSH_KEY_NAME,
+            settings=AUTOSCALING,
+            sizing_spec=SIZING["nodejs"],
+            depends_on=public_network_deps if PARALLEL else vault_nodes + public_network_deps,
+            name_prefix=NAME_PREFIX,
+            parent=PARENT
+        )
+    else:
+        nodejs = aws.ec2.Instance(
+            resource_name=f'{NAME_PREFIX}nodejs-server',
+            instance_type=SIZING["nodejs"]["instanceType"],
+            ebs_optimized=SIZING["nodejs"].get("ebsOptimized"),
+            root_block_device=sizing.root_block_device(SIZING["nodejs"]),
+            ami=AMIS.get("nodejs", BASE_AMI),
+            iam_instance_profile=iam_profile.name,
+            subnet_id=network["public_subnet"].id,
+            key_name=SSH_KEY_NAME,
+            vpc_security_group_ids=[
+                security_groups["nodejs"].id
+            ],
+            associate_public_ip_address=True,
+            user_data_base64=nodejs_user_data,
+            user_data_replace_on_change=True,
+            tags={
+                'Name': f'{NAME_PREFIX}nodejs-server'
+            },
+            opts=pulumi.ResourceOptions(
+                parent=PARENT,
+                depends_on=public_network_deps if PARALLEL else vault_nodes + public_network_deps
+            )
+        )
+        nodejs_tier = {"nodejs": nodejs}
+
     return {
-        "nodejs": nodejs,
+        **nodejs_tier,
+        **vault_tier,
         "db": db,
+        "db_replicas": db_replicas,
         "redis": redis_ec2,
+        "redis_replicas": redis_replicas,
         "vault": vault_ec2
-    }
\ No newline at end of file
+    }
+
+def create_vault_load_balancer(network, vault_nodes, security_group, name_prefix='', parent=None):
+    """Front the Vault cluster with an internal NLB on port 8200"""
+
+    load_balancer = aws.lb.LoadBalancer(
+        resource_name=f'{name_prefix}vault-nlb',
+        load_balancer_type='network',
+        internal=True,
+        subnets=[subnet.id for subnet in network["private_subnets"]],
+        security_groups=[security_group.id],
+        enable_cross_zone_load_balancing=True,
+        tags={'Name': f'{name_prefix}vault-nlb'},
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    # Standbys forward requests to the active node, so they count as healthy
+    target_group = aws.lb.TargetGroup(
+        resource_name=f'{name_prefix}vault-tg',
+        port=8200,
+        protocol='TCP',
+        target_type='instance',
+        vpc_id=network["vpc"].id,
+        deregistration_delay=30,
+        health_check=aws.lb.TargetGroupHealthCheckArgs(
+            protocol='HTTP',
+            path='/v1/sys/health?standbyok=true',
+            port='8200',
+            interval=10,
+            healthy_threshold=2,
+            unhealthy_threshold=2
+        ),
+        tags={'Name': f'{name_prefix}vault-tg'},
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    aws.lb.Listener(
+        resource_name=f'{name_prefix}vault-api',
+        load_balancer_arn=load_balancer.arn,
+        port=8200,
+        protocol='TCP',
+        default_actions=[
+            aws.lb.ListenerDefaultActionArgs(
+                type='forward',
+                target_group_arn=target_group.arn
+            )
+        ],
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    for index, node in enumerate(vault_nodes):
+        aws.lb.TargetGroupAttachment(
+            resource_name=f'{az_resource_name(f"{name_prefix}vault-server", index)}-attachment',
+            target_group_arn=target_group.arn,
+            target_id=node.id,
+            port=8200,
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+    return {
+        "vault_cluster": vault_nodes,
+        "vault_load_balancer": load_balancer
+    }
+
+def create_nodejs_autoscaling(network, security_groups, iam_profile, user_data, ami, ssh_key_name, settings, sizing_spec, depends_on,
+                              name_prefix='', parent=None):
+    """Run the Node.js tier as an Auto Scaling Group behind an ALB"""
+
+    public_subnet_ids = [subnet.id for subnet in network["public_subnets"]]
+    if len(public_subnet_ids) < 2:
+        raise ValueError("nodejsAutoscaling needs availabilityZones >= 2, an ALB spans at least two AZs")
+
+    metric = settings.get("metric", "cpu")
+    if metric not in ("cpu", "requests"):
+        raise ValueError(f"nodejsAutoscaling.metric must be 'cpu' or 'requests', got '{metric}'")
+
+    # Same user_data as the single instance, so every app server is set up
+    # exactly like nodejs-server
+    launch_template = aws.ec2.LaunchTemplate(
+        resource_name=f'{name_prefix}nodejs-launch-template',
+        image_id=ami,
+        instance_type=settings.get("instanceType", sizing_spec["instanceType"]),
+        ebs_optimized='true' if sizing_spec.get("ebsOptimized") else None,
+        block_device_mappings=sizing.launch_template_block_devices(sizing_spec),
+        key_name=ssh_key_name,
+        iam_instance_profile=aws.ec2.LaunchTemplateIamInstanceProfileArgs(
+            name=iam_profile.name
+        ),
+        network_interfaces=[
+            aws.ec2.LaunchTemplateNetworkInterfaceArgs(
+                associate_public_ip_address='true',
+                security_groups=[security_groups["nodejs"].id]
+            )
+        ],
+        user_data=user_data,
+        update_default_version=True,
+        tag_specifications=[
+            aws.ec2.LaunchTemplateTagSpecificationArgs(
+                resource_type='instance',
+                tags={'Name': f'{name_prefix}nodejs-server'}
+            )
+        ],
+        opts=pulumi.ResourceOptions(parent=parent, depends_on=depends_on)
+    )
+
+    load_balancer = aws.lb.LoadBalancer(
+        resource_name=f'{name_prefix}nodejs-alb',
+        load_balancer_type='application',
+        internal=False,
+        subnets=public_subnet_ids,
+        security_groups=[security_groups["alb"].id],
+        tags={'Name': f'{name_prefix}nodejs-alb'},
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    target_group = aws.lb.TargetGroup(
+        resource_name=f'{name_prefix}nodejs-tg',
+        port=3000,
+        protocol='HTTP',
+        target_type='instance',
+        vpc_id=network["vpc"].id,
+        deregistration_delay=30,
+        health_check=aws.lb.TargetGroupHealthCheckArgs(
+            path='/',
+            port='3000',
+            matcher='200-399',
+            interval=15,
+            healthy_threshold=2,
+            unhealthy_threshold=3
+        ),
+        tags={'Name': f'{name_prefix}nodejs-tg'},
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    listener = aws.lb.Listener(
+        resource_name=f'{name_prefix}nodejs-http',
+        load_balancer_arn=load_balancer.arn,
+        port=80,
+        protocol='HTTP',
+        default_actions=[
+            aws.lb.ListenerDefaultActionArgs(
+                type='forward',
+                target_group_arn=target_group.arn
+            )
+        ],
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    min_size = settings.get("minSize", 2)
+    auto_scaling_group = aws.autoscaling.Group(
+        resource_name=f'{name_prefix}nodejs-asg',
+        vpc_zone_identifiers=public_subnet_ids,
+        min_size=min_size,
+        max_size=settings.get("maxSize", 6),
+        desired_capacity=settings.get("desiredCapacity", min_size),
+        launch_template=aws.autoscaling.GroupLaunchTemplateArgs(
+            id=launch_template.id,
+            version=launch_template.latest_version.apply(str)
+        ),
+        target_group_arns=[target_group.arn],
+        health_check_type='ELB',
+        # Installing Node.js and the app takes minutes on a stock AMI
+        health_check_grace_period=settings.get("healthCheckGracePeriod", 900),
+        instance_refresh=aws.autoscaling.GroupInstanceRefreshArgs(
+            strategy='Rolling',
+            preferences=aws.autoscaling.GroupInstanceRefreshPreferencesArgs(
+                min_healthy_percentage=50
+            )
+        ),
+        tags=[
+            aws.autoscaling.GroupTagArgs(
+                key='Name',
+                value=f'{name_prefix}nodejs-server',
+                propagate_at_launch=True
+            )
+        ],
+        opts=pulumi.ResourceOptions(parent=parent, depends_on=[listener] + depends_on)
+    )
+
+    # Target tracking on CPU, or on requests per instance through the ALB
+    if metric == "cpu":
+        metric_specification = aws.autoscaling.PolicyTargetTrackingConfigurationPredefinedMetricSpecificationArgs(
+            predefined_metric_type='ASGAverageCPUUtilization'
+        )
+    else:
+        metric_specification = aws.autoscaling.PolicyTargetTrackingConfigurationPredefinedMetricSpecificationArgs(
+            predefined_metric_type='ALBRequestCountPerTarget',
+            resource_label=pulumi.Output.concat(load_balancer.arn_suffix, '/', target_group.arn_suffix)
+        )
+
+    aws.autoscaling.Policy(
+        resource_name=f'{name_prefix}nodejs-scaling',
+        autoscaling_group_name=auto_scaling_group.name,
+        policy_type='TargetTrackingScaling',
+        target_tracking_configuration=aws.autoscaling.PolicyTargetTrackingConfigurationArgs(
+            predefined_metric_specification=metric_specification,
+            target_value=settings.get("targetValue", 50 if metric == "cpu" else 1000)
+        ),
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    return {
+        "nodejs_asg": auto_scaling_group,
+        "nodejs_load_balancer": load_balancer
+    }
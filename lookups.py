@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pulumi
+import pulumi_aws as aws
+
+# Lookup results are memoized per stack in this directory
+CACHE_DIR = '.pulumi-cache/lookups'
+DEFAULT_TTL = 24 * 60 * 60
+
+# Results resolved in this program run
+_resolved = {}
+
+def _run_invoke(fn, *args):
+    """Run a blocking invoke on a worker thread with its own event loop,
+    timing how long the round trip took"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    started = time.perf_counter()
+    try:
+        return fn(*args), time.perf_counter() - started
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def _fetch_availability_zones():
+    return aws.get_availability_zones(state="available").names
+
+def _fetch_region():
+    return aws.get_region().name
+
+# How the provider reports a key pair that doesn't exist
+KEY_PAIR_NOT_FOUND = ('no matching EC2 Key Pair found', 'InvalidKeyPair.NotFound')
+
+def _fetch_key_pair(key_name):
+    try:
+        key_pair = aws.ec2.get_key_pair(key_name=key_name)
+    except Exception as e:
+        # Invoke errors surface as plain exceptions, so the not-found case
+        # (expected on a fresh account) is told apart by its message. Any
+        # other failure, such as missing credentials or throttling, is raised
+        if not any(marker in str(e) for marker in KEY_PAIR_NOT_FOUND):
+            raise
+        pulumi.log.debug(f"Key pair '{key_name}' not found: {e}")
+        return {"exists": False, "tags": {}}
+    return {"exists": True, "tags": dict(key_pair.tags or {})}
+
+def _cacheable(name, value):
+    """A key pair that doesn't exist yet may be created before the next
+    run, so only its existence is remembered"""
+    return not (name.startswith("key_pair:") and not value["exists"])
+
+def _cache_path():
+    return os.path.join(CACHE_DIR, f'{pulumi.get_stack()}.json')
+
+def _load_cache():
+    try:
+        with open(_cache_path(), 'r') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f'{_cache_path()}.tmp'
+    with open(tmp_path, 'w') as fd:
+        json.dump(cache, fd, indent=2)
+    os.replace(tmp_path, _cache_path())
+
+def prefetch(key_name, ttl=DEFAULT_TTL):
+    """Resolve every startup lookup at once. Fresh cache entries are reused,
+    the rest are invoked concurrently and written back to the cache"""
+    started = time.perf_counter()
+
+    # The configured provider region needs no round trip at all. Without
+    # it the provider picks one from AWS_REGION, AWS_DEFAULT_REGION or the
+    # shared config file, so ask the provider which one it resolved
+    configured_region = pulumi.Config("aws").get("region")
+    if configured_region:
+        _resolved["region"] = configured_region
+    else:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            _resolved["region"] = executor.submit(contextvars.copy_context().run, _run_invoke, _fetch_region).result()[0]
+
+    # Cached AZs and key pairs are only valid for the region they were
+    # fetched in
+    cache = _load_cache() if ttl > 0 else {}
+    if cache.get("region") != _resolved["region"]:
+        cache = {}
+    cache["region"] = _resolved["region"]
+    now = time.time()
+
+    pending = {
+        "availability_zones": (_fetch_availability_zones,),
+        f"key_pair:{key_name}": (_fetch_key_pair, key_name),
+    }
+
+    cached = 0
+    cached_seconds = 0.0
+    for name in list(pending):
+        entry = cache.get(name)
+        if entry and now - entry["fetched_at"] < ttl:
+            _resolved[name] = entry["value"]
+            cached += 1
+            cached_seconds += entry["seconds"]
+            del pending[name]
+
+    fetched_seconds = 0.0
+    if pending:
+        # Pulumi keeps its runtime settings in context variables, which new
+        # threads don't inherit, so every invoke runs in a copy of ours
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = {name: executor.submit(contextvars.copy_context().run, _run_invoke, *call)
+                       for name, call in pending.items()}
+            for name, future in futures.items():
+                value, seconds = future.result()
+                _resolved[name] = value
+                fetched_seconds += seconds
+                if _cacheable(name, value):
+                    cache[name] = {"value": value, "fetched_at": now, "seconds": seconds}
+                else:
+                    cache.pop(name, None)
+        if ttl > 0:
+            _save_cache(cache)
+
+    # Saved time is what running the same lookups one after another would
+    # have cost, minus the time actually spent here
+    elapsed = time.perf_counter() - started
+    saved = max(cached_seconds + fetched_seconds - elapsed, 0.0)
+    pulumi.log.info(
+        f"AWS lookups: {len(pending)} fetched concurrently, {cached} served from cache, "
+        f"{elapsed:.2f}s spent, ~{saved:.2f}s saved"
+    )
+
+def _get(name, fetch, *args):
+    if name not in _resolved:
+        _resolved[name] = fetch(*args)
+    return _resolved[name]
+
+def availability_zones():
+    """Names of the available AZs in the stack's region"""
+    return _get("availability_zones", _fetch_availability_zones)
+
+def region():
+    """Name of the stack's region"""
+    return _get("region", _fetch_region)
+
+def key_pair(key_name):
+    """Whether an EC2 key pair exists, and its tags"""
+    return _get(f"key_pair:{key_name}", _fetch_key_pair, key_name)
@@ -1,63 +1,54 @@
+import ipaddress
 import pulumi
 import pulumi_aws as aws
+import lookups
+from security import create_endpoint_security_group
 
-def create_network_infrastructure():
-    """Create VPC, subnets, gateways and route tables"""
+# Interface endpoints used by the SSM agent and Parameter Store calls
+INTERFACE_ENDPOINT_SERVICES = ['ssm', 'ec2messages', 'ssmmessages']
+
+def az_resource_name(name, index):
+    """Resource name for the given AZ; the first AZ keeps the original name"""
+    return name if index == 0 else f'{name}-{index + 1}'
+
+def create_network_infrastructure(az_count=1, vpc_endpoints=False, reserved_host_offsets=(), name_prefix='', parent=None):
+    """Create VPC, subnets, gateways and route tables. Host offsets in
+    reserved_host_offsets are kept out of automatic address assignment in
+    every private subnet, for instances that pin their private IP"""
 
     VPC_CIDR = '10.0.0.0/16'
-    PRIVATE_SUBNET_CIDR = '10.0.2.0/24'
-    PUBLIC_SUBNET_CIDR = '10.0.1.0/24'
-    AZ_NAME = aws.get_availability_zones(state="available").names[0]
+    AZ_NAMES = lookups.availability_zones()[:az_count]
+    if len(AZ_NAMES) < az_count:
+        raise ValueError(f"Requested {az_count} availability zones but the region only has {len(AZ_NAMES)}")
+
+    # /24 blocks carved out of the VPC: public subnet of AZ i gets block
+    # 2i + 1 and private subnet gets 2i + 2, so the first AZ keeps
+    # 10.0.1.0/24 and 10.0.2.0/24
+    subnet_blocks = list(ipaddress.ip_network(VPC_CIDR).subnets(new_prefix=24))
+    PUBLIC_SUBNET_CIDRS = [str(subnet_blocks[2 * i + 1]) for i in range(az_count)]
+    PRIVATE_SUBNET_CIDRS = [str(subnet_blocks[2 * i + 2]) for i in range(az_count)]
 
     # Create VPC
     vpc = aws.ec2.Vpc(
-        resource_name='poc-vpc',
+        resource_name=f'{name_prefix}poc-vpc',
         cidr_block=VPC_CIDR,
         enable_dns_support=True,
         enable_dns_hostnames=True,
-        tags={'Name': 'poc-vpc'}
-    )
-
-    # Create public subnet
-    public_subnet = aws.ec2.Subnet(
-        resource_name='poc-public-subnet',
-        vpc_id=vpc.id,
-        cidr_block=PUBLIC_SUBNET_CIDR,
-        map_public_ip_on_launch=True,
-        availability_zone=AZ_NAME,
-        tags={'Name': 'poc-public-subnet'}
-    )
-
-    # Create private subnet
-    private_subnet = aws.ec2.Subnet(
-        resource_name='poc-private-subnet',
-        vpc_id=vpc.id,
-        cidr_block=PRIVATE_SUBNET_CIDR,
-        map_public_ip_on_launch=False,
-        availability_zone=AZ_NAME,
-        tags={'Name': 'poc-private-subnet'}
+        tags={'Name': f'{name_prefix}poc-vpc'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
     # Create internet gateway
     internet_gateway = aws.ec2.InternetGateway(
-        resource_name='poc-igw',
+        resource_name=f'{name_prefix}poc-igw',
         vpc_id=vpc.id,
-        tags={'Name': 'poc-igw'}
-    )
-
-    # Create NAT gateway for private subnet internet access
-    elastic_ip = aws.ec2.Eip(resource_name='nat-eip')
-
-    nat_gateway = aws.ec2.NatGateway(
-        resource_name='poc-ngw',
-        allocation_id=elastic_ip.id,
-        subnet_id=public_subnet.id,
-        tags={'Name': 'poc-ngw'}
+        tags={'Name': f'{name_prefix}poc-igw'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
-    # Create route tables
+    # Create public route table, shared by every public subnet
     public_route_table = aws.ec2.RouteTable(
-        resource_name='poc-public-rt',
+        resource_name=f'{name_prefix}poc-public-rt',
         vpc_id=vpc.id,
         routes=[
             aws.ec2.RouteTableRouteArgs(
@@ -65,38 +56,157 @@ def create_network_infrastructure():
                 gateway_id=internet_gateway.id
             )
         ],
-        tags={'Name': 'poc-public-rt'}
+        tags={'Name': f'{name_prefix}poc-public-rt'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
-    private_route_table = aws.ec2.RouteTable(
-        resource_name='poc-private-rt',
-        vpc_id=vpc.id,
-        routes=[
-            aws.ec2.RouteTableRouteArgs(
-                cidr_block='0.0.0.0/0',
-                nat_gateway_id=nat_gateway.id
+    public_subnets = []
+    public_route_table_associations = []
+    private_subnets = []
+    host_reservations = []
+    nat_gateways = []
+    private_route_tables = []
+    private_route_table_associations = []
+
+    # Each AZ gets its own subnets, NAT gateway and private route table so
+    # private egress never crosses AZs
+    for i, az_name in enumerate(AZ_NAMES):
+        # Create public subnet
+        public_subnet = aws.ec2.Subnet(
+            resource_name=az_resource_name(f'{name_prefix}poc-public-subnet', i),
+            vpc_id=vpc.id,
+            cidr_block=PUBLIC_SUBNET_CIDRS[i],
+            map_public_ip_on_launch=True,
+            availability_zone=az_name,
+            tags={'Name': az_resource_name(f'{name_prefix}poc-public-subnet', i)},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        # Create private subnet
+        private_subnet = aws.ec2.Subnet(
+            resource_name=az_resource_name(f'{name_prefix}poc-private-subnet', i),
+            vpc_id=vpc.id,
+            cidr_block=PRIVATE_SUBNET_CIDRS[i],
+            map_public_ip_on_launch=False,
+            availability_zone=az_name,
+            tags={'Name': az_resource_name(f'{name_prefix}poc-private-subnet', i)},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        # Explicit reservations are never auto-assigned, so endpoint, load
+        # balancer and unpinned instance interfaces can't take a pinned
+        # address; the reserved offsets are summarized into CIDR blocks
+        private_network = ipaddress.ip_network(PRIVATE_SUBNET_CIDRS[i])
+        reserved_blocks = ipaddress.collapse_addresses(
+            ipaddress.ip_network(private_network[offset]) for offset in reserved_host_offsets
+        )
+        host_reservations.append([
+            aws.ec2.SubnetCidrReservation(
+                resource_name=f"{az_resource_name(f'{name_prefix}pinned-hosts', i)}-{int(block.network_address) - int(private_network.network_address)}",
+                subnet_id=private_subnet.id,
+                cidr_block=str(block),
+                reservation_type='explicit',
+                description='Private IPs pinned by parallel provisioning',
+                opts=pulumi.ResourceOptions(parent=parent)
             )
-        ],
-        tags={'Name': 'poc-private-rt'}
-    )
+            for block in reserved_blocks
+        ])
 
-    # Associate route tables with subnets
-    public_route_table_association = aws.ec2.RouteTableAssociation(
-        resource_name='public-rt-association',
-        subnet_id=public_subnet.id,
-        route_table_id=public_route_table.id
-    )
+        # Create NAT gateway for private subnet internet access
+        elastic_ip = aws.ec2.Eip(resource_name=az_resource_name(f'{name_prefix}nat-eip', i), opts=pulumi.ResourceOptions(parent=parent))
 
-    private_route_table_association = aws.ec2.RouteTableAssociation(
-        resource_name='private-rt-association',
-        subnet_id=private_subnet.id,
-        route_table_id=private_route_table.id
-    )
+        nat_gateway = aws.ec2.NatGateway(
+            resource_name=az_resource_name(f'{name_prefix}poc-ngw', i),
+            allocation_id=elastic_ip.id,
+            subnet_id=public_subnet.id,
+            tags={'Name': az_resource_name(f'{name_prefix}poc-ngw', i)},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        private_route_table = aws.ec2.RouteTable(
+            resource_name=az_resource_name(f'{name_prefix}poc-private-rt', i),
+            vpc_id=vpc.id,
+            routes=[
+                aws.ec2.RouteTableRouteArgs(
+                    cidr_block='0.0.0.0/0',
+                    nat_gateway_id=nat_gateway.id
+                )
+            ],
+            tags={'Name': az_resource_name(f'{name_prefix}poc-private-rt', i)},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        # Associate route tables with subnets
+        public_route_table_association = aws.ec2.RouteTableAssociation(
+            resource_name=az_resource_name(f'{name_prefix}public-rt-association', i),
+            subnet_id=public_subnet.id,
+            route_table_id=public_route_table.id,
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        private_route_table_association = aws.ec2.RouteTableAssociation(
+            resource_name=az_resource_name(f'{name_prefix}private-rt-association', i),
+            subnet_id=private_subnet.id,
+            route_table_id=private_route_table.id,
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        public_subnets.append(public_subnet)
+        public_route_table_associations.append(public_route_table_association)
+        private_subnets.append(private_subnet)
+        nat_gateways.append(nat_gateway)
+        private_route_tables.append(private_route_table)
+        private_route_table_associations.append(private_route_table_association)
+
+    # Keep S3 and SSM traffic inside the VPC instead of going through NAT
+    endpoints = {}
+    if vpc_endpoints:
+        REGION_NAME = lookups.region()
+
+        # Gateway endpoints are free and work through route tables
+        endpoints["s3"] = aws.ec2.VpcEndpoint(
+            resource_name=f'{name_prefix}poc-s3-endpoint',
+            vpc_id=vpc.id,
+            service_name=f'com.amazonaws.{REGION_NAME}.s3',
+            vpc_endpoint_type='Gateway',
+            route_table_ids=[public_route_table.id] + [rt.id for rt in private_route_tables],
+            tags={'Name': f'{name_prefix}poc-s3-endpoint'},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+        endpoint_security_group = create_endpoint_security_group(vpc, [VPC_CIDR], name_prefix, parent)
+
+        for service in INTERFACE_ENDPOINT_SERVICES:
+            endpoints[service] = aws.ec2.VpcEndpoint(
+                resource_name=f'{name_prefix}poc-{service}-endpoint',
+                vpc_id=vpc.id,
+                service_name=f'com.amazonaws.{REGION_NAME}.{service}',
+                vpc_endpoint_type='Interface',
+                subnet_ids=[subnet.id for subnet in private_subnets],
+                security_group_ids=[endpoint_security_group.id],
+                private_dns_enabled=True,
+                tags={'Name': f'{name_prefix}poc-{service}-endpoint'},
+                opts=pulumi.ResourceOptions(
+                    parent=parent,
+                    depends_on=[reservation for reservations in host_reservations for reservation in reservations]
+                )
+            )
 
     return {
         "vpc": vpc,
-        "public_subnet": public_subnet,
-        "private_subnet": private_subnet,
-        "nat_gateway": nat_gateway,
-        "private_route_table_association": private_route_table_association
-    }
\ No newline at end of file
+        "internet_gateway": internet_gateway,
+        "availability_zones": AZ_NAMES,
+        "public_subnet": public_subnets[0],
+        "private_subnet": private_subnets[0],
+        "nat_gateway": nat_gateways[0],
+        "private_route_table_association": private_route_table_associations[0],
+        "public_subnets": public_subnets,
+        "private_subnets": private_subnets,
+        "nat_gateways": nat_gateways,
+        "public_route_table": public_route_table,
+        "public_route_table_associations": public_route_table_associations,
+        "private_route_tables": private_route_tables,
+        "private_route_table_associations": private_route_table_associations,
+        "host_reservations": host_reservations,
+        "endpoints": endpoints
+    }
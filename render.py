@@ -0,0 +1,27 @@
+import base64
+import gzip
+
+# EC2 limit on raw (decoded) user_data
+USER_DATA_LIMIT = 16 * 1024
+
+def encode_user_data(rendered: str) -> str:
+    """Base64-encode user_data, gzip-compressed when that is smaller.
+    cloud-init detects and unpacks gzip payloads on its own."""
+    raw = rendered.encode()
+    # mtime=0 keeps the output byte-for-byte stable across runs
+    compressed = gzip.compress(raw, compresslevel=9, mtime=0)
+    payload = compressed if len(compressed) < len(raw) else raw
+
+    if len(payload) > USER_DATA_LIMIT:
+        raise ValueError(f"user_data is {len(payload)} bytes after compression, over the {USER_DATA_LIMIT} byte EC2 limit")
+
+    return base64.b64encode(payload).decode()
+
+def render_user_data(name, render, *args) -> str:
+    """Render an instance's user_data and return it base64 encoded.
+    Rendering is cheap, so there is no cache that could go stale when a
+    helper the template calls changes"""
+    try:
+        return encode_user_data(render(*args))
+    except ValueError as error:
+        raise ValueError(f"{name}: {error}") from error
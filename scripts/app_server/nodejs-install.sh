@@ -0,0 +1,30 @@
+#!/usr/bin/env bash
+
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a "/var/log/nodejs-install.log") 2>&1
+
+# Installs Node.js and tooling only. Runs either at boot from user_data or
+# once while baking the nodejs AMI (see images.py); the application itself
+# is deployed by nodejs-setup.sh
+
+echo "Starting NodeJS install at $(date)"
+
+source /usr/local/lib/provisioning/bootstrap.sh
+
+apt_proxy
+# Node.js from NodeSource for a more recent version, the Vault binary for
+# the local Vault Agent
+apt_repo nodesource https://deb.nodesource.com/gpgkey/nodesource-repo.gpg.key "https://deb.nodesource.com/node_18.x nodistro main"
+apt_repo hashicorp https://apt.releases.hashicorp.com/gpg "https://apt.releases.hashicorp.com $(os_codename) main"
+
+# The AWS CLI downloads while apt installs the rest
+if ! command -v aws &>/dev/null; then
+    background awscli install_awscli
+fi
+
+apt_install netcat-openbsd git unzip curl wget redis-tools nodejs vault
+wait_background
+
+echo "NodeJS install completed successfully at $(date)"
@@ -8,14 +8,19 @@ exec > >(tee -a "/var/log/nodejs-setup.log") 2>&1
 echo "Starting NodeJS setup at $(date)"
 
 source /etc/environment
+# Boot phase events (phase, phase_start, phase_end) and readiness markers
+source /usr/local/lib/provisioning/phases.sh
+source /usr/local/lib/provisioning/readiness.sh
 
 # Function to safely retrieve AWS SSM parameters
 function get_ssm_parameter() {
     local param_name="$1"
-    local max_attempts=3
+    # Vault publishes these before marking itself ready, so only SSM's
+    # own propagation delay is left to ride out
+    local max_attempts=${SSM_MAX_ATTEMPTS:-12}
     local attempt=1
 
-    while (($attempt < $max_attempts)); do
+    while (($attempt <= $max_attempts)); do
         echo "Retrieving SSM parameter $param_name (attempt $attempt/$max_attempts)" >&2
         local value
         if value=$(aws ssm get-parameter --name "$param_name" --query "Parameter.Value" --output text --region "$REGION_NAME" 2>/dev/null); then
@@ -31,41 +36,55 @@ function get_ssm_parameter() {
     return 1
 }
 
-# Main script execution
-function main() {
-    apt update
-    apt install -y netcat-openbsd git unzip curl
+# Download the prebuilt app (dependencies included) from S3 into the
+# application directory, leaving it empty when anything fails
+function fetch_app_artifact() {
+    local tarball="/tmp/app.tar.gz"
 
-    # Install Node.js from NodeSource repository for more recent version
-    if ! command -v nodejs &>/dev/null; then
-        curl -fsSL https://deb.nodesource.com/setup_18.x | bash -
-        apt install -y nodejs
+    if aws s3 cp "$APP_ARTIFACT_URL" "$tarball" --region "$REGION_NAME" --only-show-errors &&
+        tar -xzf "$tarball" -C "$APP_DIR"; then
+        rm -f "$tarball"
+        return 0
     fi
 
-    # Install AWS CLI if not present
-    if ! command -v aws &>/dev/null; then
-        apt install -y pipx
-        export PATH="$PATH:~/.local/bin"
-        pipx ensurepath
-        pipx install awscli
-    fi
+    echo "Could not fetch app artifact $APP_ARTIFACT_URL" >&2
+    rm -f "$tarball"
+    find "$APP_DIR" -mindepth 1 -delete
+    return 1
+}
+
+# Main script execution
+function main() {
+    # The AWS CLI is in /usr/local/bin; images installed before that have it
+    # from pipx under root's home
+    export PATH="$PATH:/root/.local/bin"
 
     # Create dedicated user for running the application
     if ! id -u nodejs &>/dev/null; then
         useradd --system --create-home --home-dir /opt/nodejs --shell /bin/false nodejs
     fi
 
-    # Clone application repository
+    # Unpack the prebuilt app when there is one, clone the repository otherwise
     APP_DIR="/opt/app"
-    if [[ -z "$(ls -A $APP_DIR)" ]]; then
-        git clone https://github.com/kcnaiamh/Demo-App-1.git "$APP_DIR"
-    else
+    if [[ -n "$(ls -A $APP_DIR)" ]]; then
         echo "Application directory already exists"
+    elif [[ -n "${APP_ARTIFACT_URL:-}" ]] && phase app-download fetch_app_artifact; then
+        echo "Using app artifact for ${APP_REVISION}"
+    else
+        phase app-clone git clone https://github.com/kcnaiamh/Demo-App-1.git "$APP_DIR"
+        if [[ -n "${APP_REVISION:-}" ]]; then
+            git -C "$APP_DIR" checkout "$APP_REVISION"
+        fi
     fi
 
-    # Install Node.js dependencies
+    # Install Node.js dependencies. The artifact ships them, so only native
+    # addons are rebuilt for this machine
     cd "$APP_DIR"
-    npm install
+    if [[ -d node_modules ]]; then
+        phase npm-rebuild npm rebuild
+    else
+        phase npm-install npm install
+    fi
 
     # Setup environment configuration
     cp "$APP_DIR/src/.env.example" "$APP_DIR/src/.env"
@@ -74,19 +93,65 @@ function main() {
     HOST_IP=$(curl -s ip.me 2>/dev/null || curl -s icanhazip.com 2>/dev/null || curl -s ifconfig.me 2>/dev/null)
 
     # Get Vault credentials from AWS SSM Parameter Store
-    ROLE_ID=$(get_ssm_parameter "role_id")
-    SECRET_ID=$(get_ssm_parameter "secret_id")
+    phase_start approle-wait
+    wait_ready vault
+    ROLE_ID=$(get_ssm_parameter "${SSM_PREFIX:-}role_id")
+    SECRET_ID=$(get_ssm_parameter "${SSM_PREFIX:-}secret_id")
+    phase_end approle-wait
+
+    # With the Vault Agent, local clients talk to its cache instead of Vault
+    VAULT_API_ADDR="http://${VAULT_HOST_IP}:8200"
+    if [[ "${VAULT_AGENT:-false}" == "true" ]]; then
+        ROLE_ID="$ROLE_ID" SECRET_ID="$SECRET_ID" /usr/local/bin/vault-agent-setup.sh
+        VAULT_API_ADDR="http://127.0.0.1:8100"
+    fi
 
     # Update environment configuration
     sed -i "s|^HOST_IP=.*|HOST_IP='${HOST_IP}'|" "$APP_DIR/src/.env"
     sed -i "s|^MYSQL_HOST_IP=.*|MYSQL_HOST_IP='${DB_HOST_IP}'|" "$APP_DIR/src/.env"
+    # Reads can go to the replicas (comma separated, the primary when there are none)
+    grep -q '^MYSQL_READ_HOST_IPS=' "$APP_DIR/src/.env" || echo "MYSQL_READ_HOST_IPS=" >> "$APP_DIR/src/.env"
+    sed -i "s|^MYSQL_READ_HOST_IPS=.*|MYSQL_READ_HOST_IPS='${DB_READ_HOST_IPS}'|" "$APP_DIR/src/.env"
     sed -i "s|^MYSQL_DATABASE=.*|MYSQL_DATABASE='${DB_NAME}'|" "$APP_DIR/src/.env"
-    sed -i "s|^VAULT_ADDR=.*|VAULT_ADDR='http://${VAULT_HOST_IP}:8200'|" "$APP_DIR/src/.env"
+    sed -i "s|^VAULT_ADDR=.*|VAULT_ADDR='${VAULT_API_ADDR}'|" "$APP_DIR/src/.env"
     sed -i "s|^REDIS_HOST=.*|REDIS_HOST='${REDIS_HOST_IP}'|" "$APP_DIR/src/.env"
+    # Sentinel addresses (host:port, comma separated), empty without Sentinel
+    grep -q '^REDIS_SENTINELS=' "$APP_DIR/src/.env" || echo "REDIS_SENTINELS=" >> "$APP_DIR/src/.env"
+    sed -i "s|^REDIS_SENTINELS=.*|REDIS_SENTINELS='${REDIS_SENTINELS}'|" "$APP_DIR/src/.env"
     sed -i "s|^REDIS_PASSWORD=.*|REDIS_PASSWORD='${REDIS_PASSWORD}'|" "$APP_DIR/src/.env"
     sed -i "s|^VAULT_ROLE_ID=.*|VAULT_ROLE_ID='${ROLE_ID}'|" "$APP_DIR/src/.env"
     sed -i "s|^VAULT_SECRET_ID=.*|VAULT_SECRET_ID='${SECRET_ID}'|" "$APP_DIR/src/.env"
 
+    # With the ProxySQL sidecar the app talks to the local pool with a fixed
+    # password; ProxySQL holds the backend connections with Vault-rotated
+    # credentials
+    if [[ "${MYSQL_PROXY:-false}" == "true" ]]; then
+        mkdir -p /etc/proxysql
+        cat > /etc/proxysql/refresh.env <<EOF
+VAULT_ADDR=${VAULT_API_ADDR}
+VAULT_ROLE_ID=${ROLE_ID}
+VAULT_SECRET_ID=${SECRET_ID}
+PROXYSQL_ADMIN_PASS=${PROXYSQL_ADMIN_PASS}
+EOF
+        chmod 600 /etc/proxysql/refresh.env
+        /usr/local/bin/proxysql-setup.sh
+
+        for key in MYSQL_PORT MYSQL_USER MYSQL_PASSWORD; do
+            grep -q "^${key}=" "$APP_DIR/src/.env" || echo "${key}=" >> "$APP_DIR/src/.env"
+        done
+        sed -i "s|^MYSQL_HOST_IP=.*|MYSQL_HOST_IP='127.0.0.1'|" "$APP_DIR/src/.env"
+        sed -i "s|^MYSQL_READ_HOST_IPS=.*|MYSQL_READ_HOST_IPS='127.0.0.1'|" "$APP_DIR/src/.env"
+        sed -i "s|^MYSQL_PORT=.*|MYSQL_PORT='6033'|" "$APP_DIR/src/.env"
+        sed -i "s|^MYSQL_USER=.*|MYSQL_USER='${DB_POOL_USER}'|" "$APP_DIR/src/.env"
+        sed -i "s|^MYSQL_PASSWORD=.*|MYSQL_PASSWORD='${DB_POOL_FRONTEND_PASS}'|" "$APP_DIR/src/.env"
+    fi
+
+    # Credentials rendered by the agent (tmpfs, renewed before they expire)
+    if [[ "${VAULT_AGENT:-false}" == "true" ]]; then
+        grep -q '^VAULT_DB_CREDS_FILE=' "$APP_DIR/src/.env" || echo "VAULT_DB_CREDS_FILE=" >> "$APP_DIR/src/.env"
+        sed -i "s|^VAULT_DB_CREDS_FILE=.*|VAULT_DB_CREDS_FILE='/run/vault-agent/db.env'|" "$APP_DIR/src/.env"
+    fi
+
     # Secure permissions
     chown -R nodejs:nodejs "$APP_DIR"
     chmod -R 750 "$APP_DIR"
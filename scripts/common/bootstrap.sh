@@ -0,0 +1,129 @@
+#!/usr/bin/env bash
+
+# Package installation helpers shared by the role install scripts, which
+# run at boot from user_data or once while baking an AMI. Sourced, not run
+# directly.
+#
+# An install script adds its third-party repositories with apt_repo first
+# and then installs everything with a single apt_install. That refreshes
+# the package lists once, and only the lists no earlier install script on
+# this machine has refreshed yet. Steps that don't use dpkg, such as the
+# AWS CLI, run next to the install with background / wait_background.
+
+APT_STATE_DIR=/var/lib/provisioning/apt
+# Package lists older than this are refreshed in full again
+APT_LISTS_MAX_AGE=${APT_LISTS_MAX_AGE:-3600}
+# unattended-upgrades may hold the dpkg lock right after first boot
+APT_LOCK_TIMEOUT=${APT_LOCK_TIMEOUT:-600}
+
+export DEBIAN_FRONTEND=noninteractive
+declare -A BACKGROUND_PIDS
+
+function os_codename() {
+    (source /etc/os-release && echo "$VERSION_CODENAME")
+}
+
+function _apt_get() {
+    apt-get -o DPkg::Lock::Timeout="$APT_LOCK_TIMEOUT" "$@"
+}
+
+# apt_proxy: send package downloads through APT_PROXY_URL (an apt-cacher-ng
+# style cache in the VPC) when it is set and answers, directly otherwise.
+# Only plain-HTTP archives are cached; HTTPS repositories go direct
+function apt_proxy() {
+    local conf=/etc/apt/apt.conf.d/01provisioning-proxy
+    if [[ -n "${APT_PROXY_URL:-}" ]] && curl -s -o /dev/null --max-time 3 "$APT_PROXY_URL"; then
+        echo "Acquire::http::Proxy \"${APT_PROXY_URL}\";" >"$conf"
+    else
+        rm -f "$conf"
+    fi
+}
+
+# apt_repo NAME KEY_URL SOURCE: add a signed repository, SOURCE being
+# "URI SUITE [COMPONENT...]". Nothing is fetched until apt_install
+function apt_repo() {
+    local name="$1" key_url="$2" source="$3"
+    local keyring="/usr/share/keyrings/${name}-archive-keyring.gpg"
+
+    if [[ ! -s "$keyring" ]]; then
+        curl -fsSL --retry 5 "$key_url" | gpg --dearmor --yes -o "$keyring"
+        chmod 644 "$keyring"
+    fi
+    echo "deb [arch=$(dpkg --print-architecture) signed-by=${keyring}] ${source}" >"/etc/apt/sources.list.d/${name}.list"
+}
+
+# apt_refresh: update the package lists. Within APT_LISTS_MAX_AGE of the
+# last full update, only repositories added or changed since are fetched
+function apt_refresh() {
+    local stamp="$APT_STATE_DIR/sources" changed=() list
+    mkdir -p "$APT_STATE_DIR"
+
+    if [[ -f "$stamp" ]] && (($(date +%s) - $(stat -c %Y "$stamp") < APT_LISTS_MAX_AGE)); then
+        while read -r _ list; do
+            grep -qF "$(sha256sum "$list")" "$stamp" || changed+=("$list")
+        done < <(_apt_sources_digest)
+
+        for list in "${changed[@]}"; do
+            # Anything but a one-line .list file needs the full update
+            if [[ "$list" != /etc/apt/sources.list.d/*.list ]]; then
+                _apt_get update
+                break
+            fi
+            _apt_get update -o Dir::Etc::sourcelist="$list" -o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0
+        done
+        # Keep the age of the last full update
+        _apt_sources_digest >"$stamp.new"
+        touch -r "$stamp" "$stamp.new"
+        mv "$stamp.new" "$stamp"
+        return
+    fi
+
+    _apt_get update
+    _apt_sources_digest >"$stamp"
+}
+
+function _apt_sources_digest() {
+    sha256sum /etc/apt/sources.list /etc/apt/sources.list.d/* 2>/dev/null || true
+}
+
+# apt_install PACKAGE...: refresh once and install in one transaction
+function apt_install() {
+    apt_refresh
+    _apt_get install -y "$@"
+}
+
+# install_awscli: AWS CLI v2 from the official bundle into /usr/local/bin.
+# Uses curl and python3 only (no unzip), so it can run next to apt_install
+function install_awscli() {
+    local work
+    work=$(mktemp -d)
+    curl -fsSL --retry 5 "https://awscli.amazonaws.com/awscli-exe-linux-$(uname -m).zip" -o "$work/awscliv2.zip"
+    python3 -m zipfile -e "$work/awscliv2.zip" "$work"
+    # zipfile drops the permission bits
+    chmod -R u+x "$work/aws"
+    "$work/aws/install" --update
+    rm -rf "$work"
+    aws --version
+}
+
+# background NAME COMMAND [ARGS...]: run a step that doesn't use dpkg while
+# the script goes on; its output goes to /var/log/bootstrap-NAME.log
+function background() {
+    local name="$1"
+    shift
+    "$@" >"/var/log/bootstrap-${name}.log" 2>&1 &
+    BACKGROUND_PIDS[$name]=$!
+}
+
+# wait_background: wait for every background step, fail if any did
+function wait_background() {
+    local name status=0
+    for name in "${!BACKGROUND_PIDS[@]}"; do
+        if ! wait "${BACKGROUND_PIDS[$name]}"; then
+            echo "Background step ${name} failed, see /var/log/bootstrap-${name}.log" >&2
+            status=1
+        fi
+        unset "BACKGROUND_PIDS[$name]"
+    done
+    return "$status"
+}
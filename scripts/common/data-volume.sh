@@ -0,0 +1,68 @@
+#!/usr/bin/env bash
+
+# Helpers for the separate EBS data volume that sizing.py attaches to the
+# db and redis servers. Sourced by the setup scripts, not run directly.
+
+# Find the attached data disk: the only whole disk with no partitions and
+# nothing mounted on it. Nitro instances expose /dev/sdf as an NVMe device,
+# Xen instances as /dev/xvdf, so the name can't be relied on.
+function find_data_device() {
+    local attempt
+    for attempt in $(seq 1 30); do
+        local device
+        device=$(lsblk --noheadings --nodeps --paths --output NAME,TYPE |
+            awk '$2 == "disk" {print $1}' |
+            while read -r disk; do
+                # Skip disks with partitions or mounted filesystems (the root disk)
+                if [[ $(lsblk --noheadings --paths --output NAME "$disk" | wc -l) -eq 1 ]] &&
+                    [[ -z "$(lsblk --noheadings --output MOUNTPOINT "$disk" | tr -d '[:space:]')" ]]; then
+                    echo "$disk"
+                fi
+            done | head -n 1)
+
+        if [[ -n "$device" ]]; then
+            echo "$device"
+            return 0
+        fi
+        echo "Data volume not attached yet (attempt $attempt/30)" >&2
+        sleep 2
+    done
+
+    echo "No data volume found" >&2
+    return 1
+}
+
+# Mount the data volume on a service's data directory, moving over whatever
+# the package install already put there. The caller stops the service first.
+function mount_data_volume() {
+    local mount_point="$1"
+    local owner="$2"
+
+    if mountpoint -q "$mount_point"; then
+        echo "Data volume already mounted on $mount_point"
+        return 0
+    fi
+
+    local device
+    device=$(find_data_device)
+
+    # Only format and seed a blank volume, never one that already holds data
+    if ! blkid "$device" &>/dev/null; then
+        mkfs.ext4 -q -L data "$device"
+
+        local staging
+        staging=$(mktemp -d)
+        mount "$device" "$staging"
+        if [[ -d "$mount_point" ]]; then
+            cp -a "$mount_point/." "$staging/"
+        fi
+        umount "$staging"
+        rmdir "$staging"
+    fi
+
+    mkdir -p "$mount_point"
+    echo "UUID=$(blkid -s UUID -o value "$device") $mount_point ext4 defaults,noatime,nofail 0 2" >> /etc/fstab
+    mount "$mount_point"
+    chown "$owner" "$mount_point"
+    chmod 750 "$mount_point"
+}
@@ -0,0 +1,82 @@
+#!/usr/bin/env bash
+
+# Boot phase events for the deploy timeline (see tools/boot_timeline.py).
+# Sourced by user_data and the setup scripts, not run directly.
+#
+# Every event is appended as one JSON line to $PHASE_LOG and then pushed to
+# the $PHASE_STREAM Redis stream on $BOOT_REDIS_HOST. Events written
+# before redis-cli is installed or while Redis is unreachable stay in the
+# log and are pushed by the next flush; the log doubles as the local
+# fallback when Redis never comes up.
+
+PHASE_LOG=${PHASE_LOG:-/var/log/boot-phases.jsonl}
+PHASE_STREAM=${PHASE_STREAM:-boot:phases}
+PHASE_STREAM_MAXLEN=${PHASE_STREAM_MAXLEN:-100000}
+# Number of log lines already in the stream
+PHASE_OFFSET_FILE=${PHASE_OFFSET_FILE:-/var/lib/boot-phases/offset}
+
+function phase_now_ms() {
+    date +%s%3N
+}
+
+# phase_event NAME EVENT [STATUS] [DURATION_MS]
+function phase_event() {
+    local name="$1" event="$2" status="${3:-}" duration="${4:-}"
+    local line
+    line=$(printf '{"ts":%s,"node":"%s","phase":"%s","event":"%s"' \
+        "$(phase_now_ms)" "${BOOT_NODE:-$(hostname)}" "$name" "$event")
+    [[ -n "$status" ]] && line+=",\"status\":$status"
+    [[ -n "$duration" ]] && line+=",\"duration_ms\":$duration"
+    echo "${line}}" >> "$PHASE_LOG"
+    phases_flush || true
+}
+
+# Start times of the phases in progress, by name
+declare -A PHASE_STARTED=()
+
+# phase_start NAME / phase_end NAME [STATUS]: mark a phase spanning several commands
+function phase_start() {
+    PHASE_STARTED[$1]=$(phase_now_ms)
+    phase_event "$1" start
+}
+
+function phase_end() {
+    local started=${PHASE_STARTED[$1]:-$(phase_now_ms)}
+    phase_event "$1" end "${2:-0}" "$(($(phase_now_ms) - started))"
+}
+
+# phase NAME COMMAND [ARGS...]: run a command as a timed phase and return its status
+function phase() {
+    local name="$1"
+    shift
+    local status=0
+    phase_start "$name"
+    "$@" || status=$?
+    phase_end "$name" "$status"
+    return "$status"
+}
+
+# Record how long the instance took to reach user_data, from kernel start
+function phase_boot() {
+    phase_event boot end 0 "$(awk '{printf "%d", $1 * 1000}' /proc/uptime)"
+}
+
+# Push log lines that are not in the stream yet; stops at the first failure
+function phases_flush() {
+    [[ -n "${BOOT_REDIS_HOST:-}" && -f "$PHASE_LOG" ]] || return 0
+    command -v redis-cli &>/dev/null || return 0
+    mkdir -p "$(dirname "$PHASE_OFFSET_FILE")"
+
+    local sent=0 total line reply
+    [[ -s "$PHASE_OFFSET_FILE" ]] && sent=$(<"$PHASE_OFFSET_FILE")
+    total=$(wc -l < "$PHASE_LOG")
+    while ((sent < total)); do
+        line=$(sed -n "$((sent + 1))p" "$PHASE_LOG")
+        reply=$(REDISCLI_AUTH="${BOOT_REDIS_PASSWORD:-}" timeout 3 redis-cli --no-auth-warning \
+            -h "$BOOT_REDIS_HOST" XADD "$PHASE_STREAM" MAXLEN '~' "$PHASE_STREAM_MAXLEN" '*' event "$line" 2>/dev/null) || return 1
+        # A stream ID comes back on success, an error message otherwise
+        [[ "$reply" =~ ^[0-9]+-[0-9]+$ ]] || return 1
+        sent=$((sent + 1))
+        echo "$sent" > "$PHASE_OFFSET_FILE"
+    done
+}
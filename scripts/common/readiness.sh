@@ -0,0 +1,120 @@
+#!/usr/bin/env bash
+
+# Readiness markers shared through Redis, so instances can boot in any
+# order. Sourced by user_data and the setup scripts, not run directly.
+#
+# A role that finished its setup sets `ready:<name>` with ready_mark, and
+# a role that needs it blocks in wait_ready until the key shows up, checking
+# with exponential backoff up to a deadline. A replaced instance clears its
+# marker with ready_clear as the first user_data step after phase_boot,
+# before anything is installed, so dependents never act on the marker of
+# the instance it replaced. The clear runs in the background and ready_mark
+# waits for it, so it can't remove the new marker either.
+
+READY_TIMEOUT=${READY_TIMEOUT:-1800}
+READY_BACKOFF_INITIAL=${READY_BACKOFF_INITIAL:-2}
+READY_BACKOFF_MAX=${READY_BACKOFF_MAX:-30}
+
+READY_CLEAR_PIDS=()
+
+# Falls back to bash's /dev/tcp until the install step brings redis-cli
+function boot_redis() {
+    if command -v redis-cli &>/dev/null; then
+        REDISCLI_AUTH="${BOOT_REDIS_PASSWORD:-}" timeout 5 redis-cli --no-auth-warning -h "$BOOT_REDIS_HOST" "$@"
+    else
+        timeout 5 bash -c "$(declare -f _boot_redis_raw _resp_command); _boot_redis_raw \"\$@\"" _ "$@"
+    fi
+}
+
+# _boot_redis_raw COMMAND [ARGS...]: send one command in RESP and print the
+# reply the way redis-cli does for status, integer and bulk string replies
+function _boot_redis_raw() {
+    local LC_ALL=C reply fd
+    exec {fd}<>"/dev/tcp/$BOOT_REDIS_HOST/6379" || return 1
+    if [[ -n "${BOOT_REDIS_PASSWORD:-}" ]]; then
+        _resp_command AUTH "$BOOT_REDIS_PASSWORD" >&"$fd"
+        read -r reply <&"$fd" && [[ "$reply" == "+OK"* ]] || return 1
+    fi
+    _resp_command "$@" >&"$fd"
+    read -r reply <&"$fd" || return 1
+    reply="${reply%$'\r'}"
+    case "$reply" in
+        [+:]*) echo "${reply:1}" ;;
+        '$-1') echo ;;
+        '$'*) read -r reply <&"$fd" && echo "${reply%$'\r'}" ;;
+        *) echo "${reply#-}" >&2; return 1 ;;
+    esac
+}
+
+function _resp_command() {
+    local arg
+    printf '*%d\r\n' "$#"
+    for arg in "$@"; do
+        printf '$%d\r\n%s\r\n' "${#arg}" "$arg"
+    done
+}
+
+# ready_mark [NAME]: announce that NAME (this node by default) is ready
+function ready_mark() {
+    local name="${1:-$BOOT_NODE}" value pid
+    for pid in "${READY_CLEAR_PIDS[@]}"; do
+        wait "$pid" || return 1
+    done
+    READY_CLEAR_PIDS=()
+    value=$(printf '{"ts":%s,"node":"%s"}' "$(date +%s)" "$BOOT_NODE")
+    _ready_retry "$READY_TIMEOUT" "set ready:$name" _ready_set "$name" "$value"
+}
+
+# ready_clear NAME: drop a marker left behind by an earlier instance, in
+# the background so the boot doesn't wait on Redis coming up
+function ready_clear() {
+    _ready_retry "$READY_TIMEOUT" "clear ready:$1" _ready_del "$1" &
+    READY_CLEAR_PIDS+=("$!")
+}
+
+# wait_ready NAME [TIMEOUT]: block until NAME is marked ready
+function wait_ready() {
+    _ready_retry "${2:-$READY_TIMEOUT}" "find ready:$1" _ready_get "$1"
+}
+
+# wait_file PATH [TIMEOUT]: block until a file pushed to this instance
+# (e.g. over SSM) shows up; fails once TIMEOUT has passed without it
+function wait_file() {
+    if ! _ready_retry "${2:-$READY_TIMEOUT}" "find $1" test -s "$1"; then
+        echo "$1 was never pushed; check the SSM association of this instance" >&2
+        return 1
+    fi
+}
+
+function _ready_set() {
+    [[ "$(boot_redis SET "ready:$1" "$2" 2>/dev/null)" == "OK" ]]
+}
+
+function _ready_del() {
+    [[ "$(boot_redis DEL "ready:$1" 2>/dev/null)" =~ ^[0-9]+$ ]]
+}
+
+# Markers are JSON; anything else is a missing key or an error reply
+function _ready_get() {
+    local reply
+    reply=$(boot_redis GET "ready:$1" 2>/dev/null) || return 1
+    [[ "$reply" == "{"* ]] && echo "ready:$1 is $reply"
+}
+
+# _ready_retry TIMEOUT DESCRIPTION COMMAND [ARGS...]: run COMMAND until it
+# succeeds, doubling the delay between attempts up to READY_BACKOFF_MAX
+function _ready_retry() {
+    local timeout="$1" description="$2"
+    shift 2
+    local deadline=$((SECONDS + timeout)) delay=$READY_BACKOFF_INITIAL
+
+    until "$@"; do
+        if ((SECONDS >= deadline)); then
+            echo "Gave up trying to ${description} after ${timeout} seconds" >&2
+            return 1
+        fi
+        echo "Could not ${description} yet, retrying in ${delay}s" >&2
+        sleep "$((delay < deadline - SECONDS ? delay : deadline - SECONDS))"
+        delay=$((delay * 2 < READY_BACKOFF_MAX ? delay * 2 : READY_BACKOFF_MAX))
+    done
+}
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Health agent publishing systemd unit state to Redis.
+
+Watches the units listed in HEALTH_UNITS (comma separated, e.g. "mysql")
+through systemd's D-Bus signals instead of polling `systemctl is-active`.
+Every state change is published right away on the `health:<unit>` channel
+and appended to the `health:events` stream, so consumers that were not
+subscribed at the time can replay history with XRANGE/XREAD. The
+`health:<unit>` key is refreshed with a TTL on every heartbeat so it
+expires only when the agent itself stops reporting. When several servers
+report the same unit (e.g. MySQL replicas), HEALTH_NODE names this one and
+keys and channels become `health:<unit>:<node>`.
+
+All writes of one tick, for every monitored unit, go out as a single
+MULTI/EXEC pipeline over one authenticated connection that is kept open
+for the agent's lifetime and re-established on demand if Redis restarts.
+"""
+import os
+import socket
+import sys
+import time
+
+REDIS_PORT = 6379
+HEARTBEAT_INTERVAL = int(os.environ.get("HEALTH_HEARTBEAT", "30"))
+# Key outlives a few missed heartbeats before consumers see it disappear
+STATUS_TTL = int(os.environ.get("HEALTH_TTL", str(HEARTBEAT_INTERVAL * 3)))
+EVENTS_STREAM = "health:events"
+# Approximate cap on stream length, trimmed by Redis as it grows
+EVENTS_MAXLEN = int(os.environ.get("HEALTH_EVENTS_MAXLEN", "10000"))
+NODE = os.environ.get("HEALTH_NODE", "")
+
+
+class RedisError(Exception):
+    """Error reply from Redis"""
+
+
+class RedisConnection:
+    """Minimal RESP client keeping one authenticated connection open"""
+
+    def __init__(self, host, port=REDIS_PORT, password=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._send([('AUTH', self.password)])
+            reply = self._read_reply()
+            if isinstance(reply, RedisError):
+                self.close()
+                raise reply
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._reader = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+
+    def _send(self, commands):
+        self._sock.sendall(b''.join(self._encode(args) for args in commands))
+
+    def _read_reply(self):
+        """Read one complete reply. Error replies, nested ones in an EXEC
+        array included, are returned as RedisError so that the rest of the
+        reply is still consumed and the connection stays in step"""
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            return RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise ConnectionError(f"Unexpected reply: {line!r}")
+
+    def pipeline(self, commands):
+        """Send several commands in one write and read all their replies,
+        reconnecting once if the connection dropped. Error replies are
+        returned in place rather than raised."""
+        for attempt in (1, 2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._send(commands)
+                return [self._read_reply() for _ in commands]
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def transaction(self, commands):
+        """Run commands atomically as MULTI/EXEC in a single round trip"""
+        replies = self.pipeline([('MULTI',)] + list(commands) + [('EXEC',)])
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        # EXEC returns one reply per queued command, errors included
+        for reply in replies[-1] or []:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies[-1]
+
+    def command(self, *args):
+        """Run one command"""
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+
+class HealthAgent:
+    """Tracks unit states and mirrors them into Redis"""
+
+    def __init__(self, redis, units):
+        self.redis = redis
+        self.states = {unit: "UNKNOWN" for unit in units}
+        # Transitions that could not be published yet (Redis unreachable)
+        self.unpublished = set()
+
+    def update(self, unit, active_state):
+        status = "UP" if active_state in ("active", "reloading") else "DOWN"
+        if self.states[unit] != status:
+            print(f"{unit}: {self.states[unit]} -> {status}", flush=True)
+            self.states[unit] = status
+            self.unpublished.add(unit)
+            self.flush()
+
+    @staticmethod
+    def key(unit):
+        return f'health:{unit}:{NODE}' if NODE else f'health:{unit}'
+
+    def batch(self):
+        """Commands for one tick: refresh every status key, then publish
+        and record pending transitions"""
+        commands = []
+        for unit, status in self.states.items():
+            commands.append(('SET', self.key(unit), status, 'EX', STATUS_TTL))
+        for unit in sorted(self.unpublished):
+            status = self.states[unit]
+            commands.append(('PUBLISH', self.key(unit), status))
+            fields = ('unit', unit, 'status', status, 'ts', f'{time.time():.3f}')
+            if NODE:
+                fields += ('node', NODE)
+            commands.append(('XADD', EVENTS_STREAM, 'MAXLEN', '~', EVENTS_MAXLEN, '*') + fields)
+        return commands
+
+    def flush(self):
+        """Send the tick's batch in one MULTI/EXEC round trip"""
+        try:
+            self.redis.transaction(self.batch())
+            self.unpublished.clear()
+        except (OSError, ConnectionError, RedisError) as e:
+            print(f"Redis unavailable, retrying on next heartbeat: {e}", file=sys.stderr, flush=True)
+        return True  # keep the GLib timer running
+
+
+def main():
+    # System packages (python3-dbus, python3-gi), only needed on the servers
+    import dbus
+    from dbus.mainloop.glib import DBusGMainLoop
+    from gi.repository import GLib
+
+    units = [unit.strip() for unit in os.environ["HEALTH_UNITS"].split(',') if unit.strip()]
+    redis = RedisConnection(os.environ["REDIS_HOST_IP"], password=os.environ.get("REDIS_PASSWORD"))
+    agent = HealthAgent(redis, units)
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+    manager = dbus.Interface(
+        bus.get_object('org.freedesktop.systemd1', '/org/freedesktop/systemd1'),
+        'org.freedesktop.systemd1.Manager'
+    )
+    # Without a subscription systemd does not emit unit change signals
+    manager.Subscribe()
+
+    for unit in units:
+        unit_path = manager.LoadUnit(f'{unit}.service')
+        unit_properties = dbus.Interface(
+            bus.get_object('org.freedesktop.systemd1', unit_path),
+            'org.freedesktop.DBus.Properties'
+        )
+
+        def on_properties_changed(interface, changed, invalidated, unit=unit, unit_properties=unit_properties):
+            if interface != 'org.freedesktop.systemd1.Unit':
+                return
+            if 'ActiveState' in changed:
+                agent.update(unit, str(changed['ActiveState']))
+            elif 'ActiveState' in invalidated:
+                agent.update(unit, str(unit_properties.Get('org.freedesktop.systemd1.Unit', 'ActiveState')))
+
+        unit_properties.connect_to_signal('PropertiesChanged', on_properties_changed)
+        agent.update(unit, str(unit_properties.Get('org.freedesktop.systemd1.Unit', 'ActiveState')))
+
+    GLib.timeout_add_seconds(HEARTBEAT_INTERVAL, agent.flush)
+    GLib.MainLoop().run()
+
+
+if __name__ == '__main__':
+    main()
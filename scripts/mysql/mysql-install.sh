@@ -0,0 +1,18 @@
+#!/usr/bin/env bash
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a /var/log/mysql-install.log) 2>&1
+
+# Installs MySQL packages only. Runs either at boot from user_data or once
+# while baking the db AMI (see images.py); configuration is done by
+# mysql-setup.sh
+
+echo "Starting MySQL install at $(date)"
+
+source /usr/local/lib/provisioning/bootstrap.sh
+
+apt_proxy
+apt_install mysql-server redis-tools python3-dbus python3-gi
+
+echo "MySQL install completed successfully at $(date)"
@@ -0,0 +1,51 @@
+#!/usr/bin/env bash
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a /var/log/mysql-replica-setup.log) 2>&1
+
+echo "Starting MySQL replica setup at $(date)"
+
+source /etc/environment
+# Boot phase events (phase, phase_start, phase_end) and readiness markers
+source /usr/local/lib/provisioning/phases.sh
+source /usr/local/lib/provisioning/readiness.sh
+
+# Users, schema and the root password all replicate from the primary, so
+# this only points the replica at it. Local admin commands use the
+# debian-sys-maint account, which is never touched by replication
+MYSQL_ADMIN="mysql --defaults-file=/etc/mysql/debian.cnf"
+DB_REPLICATION_USER="${DB_REPLICATION_USER}"
+DB_REPLICATION_PASS="${DB_REPLICATION_PASS}"
+DB_WAIT_TIMEOUT=${DB_WAIT_TIMEOUT:-900}
+
+# Move the datadir onto the separate data volume when one is attached
+if [[ "${DATA_VOLUME:-false}" == "true" ]]; then
+    source /usr/local/lib/provisioning/data-volume.sh
+    systemctl stop mysql
+    mount_data_volume /var/lib/mysql mysql:mysql
+fi
+
+echo "Configuring MySQL for remote access..."
+sed -i 's/bind-address\s*=.*/bind-address = 0.0.0.0/' /etc/mysql/mysql.conf.d/mysqld.cnf
+systemctl enable mysql
+systemctl restart mysql
+
+# The primary may still be booting; it marks itself ready once the
+# replication user exists
+phase primary-wait wait_ready mysql "${DB_WAIT_TIMEOUT}"
+
+# GTID auto-positioning fetches everything the primary has executed
+if [[ -z "$(${MYSQL_ADMIN} -N -e "SHOW REPLICA STATUS")" ]]; then
+    ${MYSQL_ADMIN} <<SQL
+CHANGE REPLICATION SOURCE TO
+    SOURCE_HOST='${DB_HOST_IP}',
+    SOURCE_USER='${DB_REPLICATION_USER}',
+    SOURCE_PASSWORD='${DB_REPLICATION_PASS}',
+    SOURCE_AUTO_POSITION=1,
+    GET_SOURCE_PUBLIC_KEY=1;
+START REPLICA;
+SQL
+fi
+
+echo "MySQL replica setup completed successfully at $(date)"
@@ -13,12 +13,19 @@ DB_ROOT_PASS="${DB_ROOT_PASS}"
 DB_NAME="${DB_NAME}"
 DB_VAULT_USER="${DB_VAULT_USER}"
 DB_VAULT_PASS="${DB_VAULT_PASS}"
-PRIVATE_SUBNET="$(echo "${PRIVATE_SUBNET_CIDR}" | awk -F'[./]' '{print $1"."$2"."$3".%"}')"
-
-
-apt update
-apt install -y mysql-server redis-tools
-
+# Account hosts (address/netmask, comma separated) of the private subnets
+# the Vault nodes and the replicas actually run in
+IFS=',' read -ra DB_VAULT_HOSTS <<< "${DB_VAULT_HOSTS}"
+DB_REPLICATION_PASS="${DB_REPLICATION_PASS:-}"
+IFS=',' read -ra DB_REPLICATION_HOSTS <<< "${DB_REPLICATION_HOSTS:-}"
+DB_POOL_USER="${DB_POOL_USER:-}"
+
+# Move the datadir onto the separate data volume when one is attached
+if [[ "${DATA_VOLUME:-false}" == "true" ]]; then
+    source /usr/local/lib/provisioning/data-volume.sh
+    systemctl stop mysql
+    mount_data_volume /var/lib/mysql mysql:mysql
+fi
 
 if ! systemctl is-active --quiet mysql.service; then
     echo 'MySQL server is not running. Starting MySQL server...'
@@ -30,6 +37,15 @@ echo "Configuring MySQL for remote access..."
 sed -i 's/bind-address\s*=.*/bind-address = 0.0.0.0/' /etc/mysql/mysql.conf.d/mysqld.cnf
 systemctl restart mysql
 
+# Replicas start from an empty GTID history, so drop the binary logs the
+# package install wrote before GTIDs were enabled. Everything below is then
+# replayed on the replicas through GTID auto-positioning
+if [[ -n "${DB_REPLICATION_PASS}" ]] &&
+    [[ -z "$(mysql --defaults-file=/etc/mysql/debian.cnf -N -e "SELECT @@GLOBAL.gtid_executed")" ]]; then
+    mysql --defaults-file=/etc/mysql/debian.cnf -e "RESET BINARY LOGS AND GTIDS" ||
+        mysql --defaults-file=/etc/mysql/debian.cnf -e "RESET MASTER"
+fi
+
 # ---------------------------------------------------------------------------- #
 # SET DATABASE ROOT USER PASSWORD
 # ---------------------------------------------------------------------------- #
@@ -55,16 +71,43 @@ DROP DATABASE IF EXISTS test; DELETE FROM mysql.db WHERE Db='test';
 FLUSH PRIVILEGES;
 EOF
 
+# ---------------------------------------------------------------------------- #
+# POOL USER FOR PROXYSQL
+# ---------------------------------------------------------------------------- #
+# Created before the Vault user, so it exists by the time Vault can connect
+# and take over its password through the static role
+if [[ -n "${DB_POOL_USER}" ]]; then
+    mysql --defaults-file=/root/.my.cnf <<EOF
+CREATE DATABASE IF NOT EXISTS ${DB_NAME};
+CREATE USER IF NOT EXISTS '${DB_POOL_USER}'@'%' IDENTIFIED WITH caching_sha2_password BY '$(openssl rand -hex 24)';
+GRANT SELECT, INSERT, UPDATE ON ${DB_NAME}.* TO '${DB_POOL_USER}'@'%';
+FLUSH PRIVILEGES;
+EOF
+fi
+
 # ---------------------------------------------------------------------------- #
 # VAULT USER CREATION & PERMISSION SETUP
 # ---------------------------------------------------------------------------- #
-mysql --defaults-file=/root/.my.cnf <<EOF
+for host in "${DB_VAULT_HOSTS[@]}"; do
+    mysql --defaults-file=/root/.my.cnf <<EOF
 CREATE DATABASE IF NOT EXISTS ${DB_NAME};
-CREATE USER IF NOT EXISTS '${DB_VAULT_USER}'@'${PRIVATE_SUBNET}' IDENTIFIED WITH caching_sha2_password BY '${DB_VAULT_PASS}';
-GRANT CREATE USER ON *.* TO '${DB_VAULT_USER}'@'${PRIVATE_SUBNET}';
-GRANT SELECT, INSERT, UPDATE, GRANT OPTION ON ${DB_NAME}.* TO '${DB_VAULT_USER}'@'${PRIVATE_SUBNET}';
+CREATE USER IF NOT EXISTS '${DB_VAULT_USER}'@'${host}' IDENTIFIED WITH caching_sha2_password BY '${DB_VAULT_PASS}';
+GRANT CREATE USER ON *.* TO '${DB_VAULT_USER}'@'${host}';
+GRANT SELECT, INSERT, UPDATE, GRANT OPTION ON ${DB_NAME}.* TO '${DB_VAULT_USER}'@'${host}';
+FLUSH PRIVILEGES;
+EOF
+done
+
+# ---------------------------------------------------------------------------- #
+# REPLICATION USER FOR THE READ REPLICAS
+# ---------------------------------------------------------------------------- #
+for host in "${DB_REPLICATION_HOSTS[@]}"; do
+    mysql --defaults-file=/root/.my.cnf <<EOF
+CREATE USER IF NOT EXISTS '${DB_REPLICATION_USER}'@'${host}' IDENTIFIED WITH caching_sha2_password BY '${DB_REPLICATION_PASS}';
+GRANT REPLICATION SLAVE ON *.* TO '${DB_REPLICATION_USER}'@'${host}';
 FLUSH PRIVILEGES;
 EOF
+done
 
 
 # ---------------------------------------------------------------------------- #
@@ -0,0 +1,20 @@
+#!/usr/bin/env bash
+
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a "/var/log/proxysql-install.log") 2>&1
+
+# Installs ProxySQL and the MySQL client used to drive its admin interface.
+# Configuration is done by proxysql-setup.sh
+
+echo "Starting ProxySQL install at $(date)"
+
+source /usr/local/lib/provisioning/bootstrap.sh
+
+# Runs after nodejs-install.sh, so only the ProxySQL list is fetched
+apt_proxy
+apt_repo proxysql https://repo.proxysql.com/ProxySQL/proxysql-2.7.x/repo_pub_key "https://repo.proxysql.com/ProxySQL/proxysql-2.7.x/$(os_codename)/ ./"
+apt_install mysql-client python3 proxysql
+
+echo "ProxySQL install completed successfully at $(date)"
@@ -0,0 +1,85 @@
+#!/usr/bin/env bash
+
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a "/var/log/proxysql-setup.log") 2>&1
+
+echo "Starting ProxySQL setup at $(date)"
+
+source /etc/environment
+
+# Written by nodejs-setup.sh: Vault address, AppRole and admin credentials
+source /etc/proxysql/refresh.env
+
+PROXYSQL_CNF="/etc/proxysql.cnf"
+WRITER_HOSTGROUP=10
+READER_HOSTGROUP=20
+
+# Primary in the writer hostgroup; replicas (if any) in the reader hostgroup
+SERVERS="{ address=\"${DB_HOST_IP}\", port=3306, hostgroup=${WRITER_HOSTGROUP}, max_connections=${PROXYSQL_BACKEND_CONNECTIONS} }"
+RULES=""
+if [[ -n "${DB_READ_HOST_IPS}" && "${DB_READ_HOST_IPS}" != "${DB_HOST_IP}" ]]; then
+    IFS=',' read -ra READ_HOSTS <<<"${DB_READ_HOST_IPS}"
+    for host in "${READ_HOSTS[@]}"; do
+        SERVERS+=",
+    { address=\"${host}\", port=3306, hostgroup=${READER_HOSTGROUP}, max_connections=${PROXYSQL_BACKEND_CONNECTIONS} }"
+    done
+    RULES="
+    { rule_id=1, active=1, match_digest=\"^SELECT.*FOR UPDATE\", destination_hostgroup=${WRITER_HOSTGROUP}, apply=1 },
+    { rule_id=2, active=1, match_digest=\"^SELECT\", destination_hostgroup=${READER_HOSTGROUP}, apply=1 }"
+fi
+
+# The whole configuration is declared in proxysql.cnf, which ProxySQL only
+# reads when its database doesn't exist yet. The backend row of the pool
+# user is added by proxysql-refresh once Vault hands out its password
+systemctl stop proxysql
+cat >"${PROXYSQL_CNF}" <<CNF
+datadir="/var/lib/proxysql"
+
+admin_variables=
+{
+    admin_credentials="admin:${PROXYSQL_ADMIN_PASS}"
+    mysql_ifaces="127.0.0.1:6032"
+}
+
+mysql_variables=
+{
+    interfaces="127.0.0.1:6033"
+    threads=${PROXYSQL_THREADS}
+    max_connections=4096
+    default_query_timeout=36000000
+    # Keep idle backend connections warm instead of reconnecting per request
+    free_connections_pct=50
+    connection_max_age_ms=0
+    multiplexing=true
+    # Backends aren't probed; failed connections still shun a server
+    monitor_enabled=false
+    server_version="8.0.0"
+}
+
+mysql_servers=
+(
+    ${SERVERS}
+)
+
+mysql_query_rules=
+(${RULES}
+)
+
+mysql_users=
+(
+    { username="${DB_POOL_USER}", password="${DB_POOL_FRONTEND_PASS}", default_hostgroup=${WRITER_HOSTGROUP}, frontend=1, backend=0 }
+)
+CNF
+chown proxysql:proxysql "${PROXYSQL_CNF}"
+chmod 600 "${PROXYSQL_CNF}"
+
+rm -f /var/lib/proxysql/proxysql.db
+systemctl enable proxysql
+systemctl start proxysql
+
+systemctl daemon-reload
+systemctl enable --now proxysql-refresh.service
+
+echo "ProxySQL setup completed successfully at $(date)"
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Keeps ProxySQL's backend credentials in step with Vault.
+
+The app connects to the local ProxySQL with a fixed frontend password, and
+ProxySQL holds warm connections to MySQL as the pool user. That user's
+password is owned by a Vault static role (database/static-creds/...), so
+it rotates on Vault's schedule without a CREATE USER per lease. This
+agent logs in with the AppRole, reads the current password and, when it
+changed, swaps the backend row in ProxySQL's admin interface. Open backend
+connections keep working; new ones use the new password.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+VAULT_ADDR = os.environ["VAULT_ADDR"].rstrip('/')
+STATIC_ROLE = os.environ.get("VAULT_DB_STATIC_ROLE", "nodejs-pool")
+WRITER_HOSTGROUP = 10
+# Re-read at least this often, and right after every rotation
+MAX_INTERVAL = int(os.environ.get("PROXYSQL_REFRESH_INTERVAL", "300"))
+RETRY_INTERVAL = 10
+
+
+class VaultClient:
+    """AppRole login with the token reused until Vault rejects it"""
+
+    def __init__(self, addr, role_id, secret_id):
+        self.addr = addr
+        self.role_id = role_id
+        self.secret_id = secret_id
+        self.token = None
+
+    def _request(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(f'{self.addr}/v1/{path}', data=data)
+        if self.token:
+            request.add_header('X-Vault-Token', self.token)
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.load(response)
+
+    def login(self):
+        self.token = None
+        reply = self._request('auth/approle/login', {"role_id": self.role_id, "secret_id": self.secret_id})
+        self.token = reply["auth"]["client_token"]
+
+    def read(self, path):
+        if not self.token:
+            self.login()
+        try:
+            return self._request(path)
+        except urllib.error.HTTPError as e:
+            if e.code != 403:
+                raise
+            self.login()
+            return self._request(path)
+
+
+def sql_string(value):
+    # The admin interface parses statements as SQLite, where a backslash is
+    # an ordinary character and only quotes are doubled
+    return "'" + value.replace("'", "''") + "'"
+
+
+def apply_credentials(username, password):
+    """Replace the pool user's backend row and activate it"""
+    statements = f'''\
+REPLACE INTO mysql_users (username, password, default_hostgroup, frontend, backend)
+    VALUES ({sql_string(username)}, {sql_string(password)}, {WRITER_HOSTGROUP}, 0, 1);
+LOAD MYSQL USERS TO RUNTIME;
+SAVE MYSQL USERS TO DISK;
+'''
+    subprocess.run(
+        ['mysql', '--host=127.0.0.1', '--port=6032', '--user=admin'],
+        input=statements.encode(),
+        env={**os.environ, "MYSQL_PWD": os.environ["PROXYSQL_ADMIN_PASS"]},
+        check=True
+    )
+
+
+def main():
+    vault = VaultClient(VAULT_ADDR, os.environ["VAULT_ROLE_ID"], os.environ["VAULT_SECRET_ID"])
+    current = None
+
+    while True:
+        try:
+            creds = vault.read(f'database/static-creds/{STATIC_ROLE}')["data"]
+            if creds["password"] != current:
+                apply_credentials(creds["username"], creds["password"])
+                current = creds["password"]
+                print(f"Backend credentials for {creds['username']} updated", flush=True)
+            # ttl counts down to the next rotation
+            time.sleep(max(1, min(int(creds["ttl"]) + 1, MAX_INTERVAL)))
+        except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+            print(f"Refresh failed, retrying in {RETRY_INTERVAL}s: {e}", file=sys.stderr, flush=True)
+            time.sleep(RETRY_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
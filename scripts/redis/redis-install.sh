@@ -0,0 +1,20 @@
+#!/usr/bin/env bash
+
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a /var/log/redis-install.log) 2>&1
+
+# Installs Redis packages only. Runs either at boot from user_data or once
+# while baking the redis AMI (see images.py); configuration is done by
+# redis-setup.sh
+
+echo "Starting Redis install at $(date)"
+
+source /usr/local/lib/provisioning/bootstrap.sh
+
+apt_proxy
+apt_repo redis https://packages.redis.io/gpg "https://packages.redis.io/deb $(os_codename) main"
+apt_install redis redis-sentinel
+
+echo "Redis install completed successfully at $(date)"
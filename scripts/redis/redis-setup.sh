@@ -9,23 +9,23 @@ echo "Starting Redis setup at $(date)"
 
 source /etc/environment
 
-apt update && apt install -y lsb-release curl gpg
-
-# ---------------------------------------------------------------------------- #
-# INSTALL REDIS
-# ---------------------------------------------------------------------------- #
-
-curl -fsSL https://packages.redis.io/gpg | gpg --dearmor -o /usr/share/keyrings/redis-archive-keyring.gpg
-chmod 644 /usr/share/keyrings/redis-archive-keyring.gpg
-echo "deb [signed-by=/usr/share/keyrings/redis-archive-keyring.gpg] https://packages.redis.io/deb $(lsb_release -cs) main" | tee /etc/apt/sources.list.d/redis.list
-apt update
-apt install -y redis
-
 # ---------------------------------------------------------------------------- #
 # CONFIGURE REDIS
 # ---------------------------------------------------------------------------- #
 
 REDIS_CONF="/etc/redis/redis.conf"
+# Pushed over SSM from tuning.py (memory, persistence, threads, backlog)
+REDIS_TUNING_CONF="/etc/redis/tuning.conf"
+SENTINEL_CONF="/etc/redis/sentinel.conf"
+REDIS_ROLE="${REDIS_ROLE:-primary}"
+REDIS_SENTINEL="${REDIS_SENTINEL:-false}"
+REDIS_PRIMARY_IP="${REDIS_PRIMARY_IP:-}"
+
+# The primary's own user_data can't know its address, ask the metadata service
+if [[ -z "${REDIS_PRIMARY_IP}" ]]; then
+    IMDS_TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+    REDIS_PRIMARY_IP=$(curl -s -H "X-aws-ec2-metadata-token: ${IMDS_TOKEN}" http://169.254.169.254/latest/meta-data/local-ipv4)
+fi
 
 # Backup original configuration
 cp -f "$REDIS_CONF" "${REDIS_CONF}.bak"
@@ -35,28 +35,88 @@ sed -i 's/^bind .*/bind 0.0.0.0/' ${REDIS_CONF}
 sed -i 's/^protected-mode no/protected-mode yes/' ${REDIS_CONF}
 sed -i "s/^# requirepass .*/requirepass ${REDIS_PASSWORD}/" ${REDIS_CONF}
 
-# Performance settings
-sed -i 's/^# maxmemory .*/maxmemory 256mb/' ${REDIS_CONF}
-sed -i 's/^# maxmemory-policy .*/maxmemory-policy allkeys-lru/' ${REDIS_CONF}
-
-# Persistence settings
-sed -i 's/^save 900 1/save 60 1/' ${REDIS_CONF}
-sed -i 's/^save 300 10/# save 300 10/' ${REDIS_CONF}
-sed -i 's/^save 60 10000/# save 60 10000/' ${REDIS_CONF}
-sed -i 's/^# appendonly no/appendonly yes/' ${REDIS_CONF}
+# save lines add up with the ones from the tuning fragment, so drop the
+# stock ones
+sed -i 's/^save /# save /' ${REDIS_CONF}
 
 # Service settings
 sed -i 's/^supervised no/supervised systemd/' ${REDIS_CONF}
 sed -i 's/^daemonize no/daemonize yes/' ${REDIS_CONF}
 
-# Additional hardening
-echo "tcp-backlog 128" >>"$REDIS_CONF"
-echo "timeout 30" >>"$REDIS_CONF"
+# The accept queue is capped by the kernel, keep it above tcp-backlog.
+# Overcommit and no transparent huge pages keep AOF rewrite forks cheap
+cat >/etc/sysctl.d/60-redis.conf <<EOF
+net.core.somaxconn = 1024
+vm.overcommit_memory = 1
+EOF
+sysctl --system
+echo never >/sys/kernel/mm/transparent_hugepage/enabled
+
+# Additional hardening. Sentinel reconfigures servers through CONFIG during
+# a failover, so in that mode it is renamed to a secret instead of disabled
 echo "rename-command FLUSHALL \"\"" >>"$REDIS_CONF"
 echo "rename-command FLUSHDB \"\"" >>"$REDIS_CONF"
-echo "rename-command CONFIG \"\"" >>"$REDIS_CONF"
+if [[ "${REDIS_SENTINEL}" == "true" ]]; then
+    echo "rename-command CONFIG \"${REDIS_CONFIG_COMMAND}\"" >>"$REDIS_CONF"
+else
+    echo "rename-command CONFIG \"\"" >>"$REDIS_CONF"
+fi
+
+# Replicas follow the primary. Every node knows the password of the
+# primary, since Sentinel may promote any of them
+echo "masterauth ${REDIS_PASSWORD}" >>"$REDIS_CONF"
+if [[ "${REDIS_ROLE}" == "replica" ]]; then
+    echo "replicaof ${REDIS_PRIMARY_IP} 6379" >>"$REDIS_CONF"
+    echo "replica-read-only yes" >>"$REDIS_CONF"
+fi
+
+# Performance and persistence settings come from the tuning fragment,
+# included after every other line so it wins
+echo "include ${REDIS_TUNING_CONF}" >>"$REDIS_CONF"
+
+# Keep the AOF and RDB files on the separate data volume when one is attached
+if [[ "${DATA_VOLUME:-false}" == "true" ]]; then
+    source /usr/local/lib/provisioning/data-volume.sh
+    systemctl stop redis-server
+    mount_data_volume /var/lib/redis redis:redis
+fi
 
 systemctl enable redis-server
 systemctl restart redis-server
 
+# ---------------------------------------------------------------------------- #
+# CONFIGURE SENTINEL
+# ---------------------------------------------------------------------------- #
+
+# Only clients that ask Sentinel follow a failover. The boot phase and
+# readiness helpers and the health agents keep writing to the initial
+# primary (BOOT_REDIS_HOST, REDIS_HOST_IP), which answers READONLY once it
+# rejoins as a replica; until it is promoted back, markers and health
+# writes fail and instances booting then wait out READY_TIMEOUT
+if [[ "${REDIS_SENTINEL}" == "true" ]]; then
+    # Sentinel rewrites this file with the current topology, so it is only
+    # written once
+    if ! grep -q "^sentinel monitor" "$SENTINEL_CONF" 2>/dev/null; then
+        cat >"$SENTINEL_CONF" <<EOF
+bind 0.0.0.0
+port 26379
+protected-mode no
+requirepass "${REDIS_PASSWORD}"
+sentinel sentinel-pass "${REDIS_PASSWORD}"
+sentinel monitor redis-primary ${REDIS_PRIMARY_IP} 6379 ${REDIS_SENTINEL_QUORUM}
+sentinel auth-pass redis-primary "${REDIS_PASSWORD}"
+sentinel rename-command redis-primary CONFIG "${REDIS_CONFIG_COMMAND}"
+sentinel down-after-milliseconds redis-primary 5000
+sentinel failover-timeout redis-primary 60000
+sentinel parallel-syncs redis-primary 1
+EOF
+        chown redis:redis "$SENTINEL_CONF"
+        chmod 640 "$SENTINEL_CONF"
+    fi
+    systemctl enable redis-sentinel
+    systemctl restart redis-sentinel
+elif systemctl list-unit-files redis-sentinel.service &>/dev/null; then
+    systemctl disable --now redis-sentinel
+fi
+
 echo "Redis setup completed successfully at $(date)"
@@ -0,0 +1,27 @@
+#!/usr/bin/env bash
+
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -eux
+exec > >(tee -a /var/log/vault-install.log) 2>&1
+
+# Installs Vault and its tooling only. Runs either at boot from user_data or
+# once while baking the vault AMI (see images.py); configuration is done by
+# vault-setup.sh
+
+echo "Starting Vault install at $(date)"
+
+source /usr/local/lib/provisioning/bootstrap.sh
+
+apt_proxy
+apt_repo hashicorp https://apt.releases.hashicorp.com/gpg "https://apt.releases.hashicorp.com $(os_codename) main"
+
+# The AWS CLI downloads while apt installs Vault and its tooling
+if ! command -v aws &>/dev/null; then
+	background awscli install_awscli
+fi
+
+apt_install wget jq redis-tools unzip python3-dbus python3-gi vault
+wait_background
+
+echo "Vault install completed successfully at $(date)"
@@ -8,8 +8,15 @@ exec > >(tee -a /var/log/vault-setup.log) 2>&1
 echo "Starting Vault setup at $(date)"
 
 source /etc/environment
-
-VAULT_HOST_IP=${VAULT_HOST_IP:-"127.0.0.1"}
+# Boot phase events (phase, phase_start, phase_end) and readiness markers
+source /usr/local/lib/provisioning/phases.sh
+source /usr/local/lib/provisioning/readiness.sh
+
+VAULT_NODE_INDEX=${VAULT_NODE_INDEX:-0}
+VAULT_CLUSTER_TAG=${VAULT_CLUSTER_TAG:-""}
+VAULT_SEAL_TYPE=${VAULT_SEAL_TYPE:-"awskms"}
+# Environment name prefix of the SSM parameters, empty for a single environment
+SSM_PREFIX=${SSM_PREFIX:-""}
 DB_HOST_IP=${DB_HOST_IP}
 DB_USER=${DB_USER}
 DB_PASSWORD=${DB_PASSWORD}
@@ -21,25 +28,14 @@ if [[ -z "${DB_HOST_IP}" || -z "${DB_USER}" || -z "${DB_PASSWORD}" ]]; then
 	exit 1
 fi
 
-apt update
-apt install -y wget jq redis-tools unzip
-
-# Install AWS CLI if not already present
-if ! command -v aws &>/dev/null; then
-	apt install -y pipx
-	pipx ensurepath
-	pipx install awscli
-	pipx ensurepath
-	export PATH=$PATH:/root/.local/bin
-	aws --version
-fi
+# The AWS CLI is in /usr/local/bin; images installed before that have it
+# from pipx under root's home
+export PATH=$PATH:/root/.local/bin
 
-# Install HashiCorp Vault if not already present
-if [[ ! -f /usr/share/keyrings/hashicorp-archive-keyring.gpg ]]; then
-	wget -O - https://apt.releases.hashicorp.com/gpg 2>/dev/null | gpg --dearmor -o /usr/share/keyrings/hashicorp-archive-keyring.gpg
-	echo "deb [arch=$(dpkg --print-architecture) signed-by=/usr/share/keyrings/hashicorp-archive-keyring.gpg] https://apt.releases.hashicorp.com $(lsb_release -cs) main" | tee /etc/apt/sources.list.d/hashicorp.list
-	apt update && apt install -y vault
-fi
+# Address and ID of this node, advertised to the other Raft peers
+IMDS_TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+NODE_IP=$(curl -s -H "X-aws-ec2-metadata-token: ${IMDS_TOKEN}" http://169.254.169.254/latest/meta-data/local-ipv4)
+NODE_ID=$(curl -s -H "X-aws-ec2-metadata-token: ${IMDS_TOKEN}" http://169.254.169.254/latest/meta-data/instance-id)
 
 # Set up Vault directories
 export VAULT_DATA=/opt/vault/data
@@ -55,16 +51,55 @@ setcap cap_ipc_lock=+ep $(readlink -f $(which vault))
 chown -R vault:vault ${VAULT_DATA}
 chmod -R 750 ${VAULT_DATA}
 
-# Overwrite Vault configuration file
+# In cluster mode every node finds its peers through the shared EC2 tag
+RETRY_JOIN=""
+if [[ -n "${VAULT_CLUSTER_TAG}" ]]; then
+	RETRY_JOIN="
+	retry_join {
+		auto_join = \"provider=aws region=${REGION_NAME} tag_key=VaultCluster tag_value=${VAULT_CLUSTER_TAG}\"
+		auto_join_scheme = \"http\"
+	}"
+fi
+
+# Vault unseals itself on every start through the seal, so a reboot no
+# longer needs an operator. awskms uses the key from create_iam_resources;
+# transit points at another Vault (e.g. a local dev server)
+case "${VAULT_SEAL_TYPE}" in
+awskms)
+	SEAL_CONFIG="seal \"awskms\" {
+	region = \"${REGION_NAME}\"
+	kms_key_id = \"${VAULT_KMS_KEY_ID}\"
+}"
+	;;
+transit)
+	SEAL_CONFIG="seal \"transit\" {
+	address = \"${VAULT_TRANSIT_ADDR}\"
+	token = \"${VAULT_TRANSIT_TOKEN}\"
+	key_name = \"${VAULT_TRANSIT_KEY_NAME:-autounseal}\"
+	mount_path = \"${VAULT_TRANSIT_MOUNT_PATH:-transit/}\"
+}"
+	;;
+*)
+	echo "Error: unsupported VAULT_SEAL_TYPE ${VAULT_SEAL_TYPE}"
+	exit 1
+	;;
+esac
+
+# Overwrite Vault configuration file. Integrated Raft storage replaces the
+# file backend; HashiCorp recommends disabling mlock with Raft
 cat >${VAULT_CONFIG}/vault.hcl <<EOF
 ui = false
-api_addr = "http://${VAULT_HOST_IP}:8200"
-disable_mlock = false
+api_addr = "http://${NODE_IP}:8200"
+cluster_addr = "http://${NODE_IP}:8201"
+disable_mlock = true
 
-storage "file" {
+storage "raft" {
 	path = "/opt/vault/data"
+	node_id = "${NODE_ID}"${RETRY_JOIN}
 }
 
+${SEAL_CONFIG}
+
 listener "tcp" {
 	address = "0.0.0.0:8200"
 	tls_disable = "true"
@@ -81,29 +116,49 @@ systemctl start vault
 
 
 # Set Vault API address for CLI commands
-export VAULT_ADDR="http://${VAULT_HOST_IP}:8200"
+export VAULT_ADDR="http://127.0.0.1:8200"
 
-touch ${OUTPUT_KEYS_FILE}
-
-# Initialize Vault if not already initialized
-if ! jq -e '.unseal_keys_b64 // empty' "${OUTPUT_KEYS_FILE}" >/dev/null; then
-	INIT_RESPONSE=$(vault operator init -key-shares=3 -key-threshold=2 -format=json)
+# vault status exits 1 on errors and 2 when sealed, so wait for anything but 1
+function vault_api_up() {
+	local rc=0
+	vault status >/dev/null 2>&1 || rc=$?
+	[[ $rc -ne 1 ]]
+}
 
-	echo "${INIT_RESPONSE}" >${OUTPUT_KEYS_FILE}
-	chmod 600 ${OUTPUT_KEYS_FILE}
+phase_start vault-start
+until vault_api_up; do
+	echo "Waiting for the Vault API..."
+	sleep 2
+done
+phase_end vault-start
+
+# Secrets engines, auth methods and policies live in the replicated Raft
+# storage, so they are only configured once, from the first node. The other
+# nodes join through retry_join and unseal with the same seal on their own
+if [[ "${VAULT_NODE_INDEX}" -ne 0 ]]; then
+	echo "Vault node ${NODE_ID} started at $(date)"
+	exit 0
 fi
 
-# Unseal Vault if currently sealed
-if vault status -format=json 2>/dev/null | grep -q '"sealed": true'; then
-	echo "Vault is sealed. Unsealing Vault..."
+touch ${OUTPUT_KEYS_FILE}
+chmod 600 ${OUTPUT_KEYS_FILE}
 
-	UNSEAL_KEY_1=$(jq -r .unseal_keys_b64[0] "${OUTPUT_KEYS_FILE}")
-	UNSEAL_KEY_2=$(jq -r .unseal_keys_b64[1] "${OUTPUT_KEYS_FILE}")
+# Initialize Vault if not already initialized. With auto-unseal, init returns
+# recovery keys (used for e.g. generate-root) instead of unseal keys
+phase_start vault-init
+if [[ "$(vault status -format=json 2>/dev/null | jq -r .initialized)" != "true" ]]; then
+	INIT_RESPONSE=$(vault operator init -recovery-shares=3 -recovery-threshold=2 -format=json)
 
-	vault operator unseal "${UNSEAL_KEY_1}"
-	vault operator unseal "${UNSEAL_KEY_2}"
+	echo "${INIT_RESPONSE}" >${OUTPUT_KEYS_FILE}
 fi
 
+# Wait for the seal to unseal Vault (vault status exits 0 once unsealed)
+until vault status >/dev/null 2>&1; do
+	echo "Waiting for Vault to unseal..."
+	sleep 2
+done
+phase_end vault-init
+
 # Authenticate with root token
 echo "Authenticating with root token..."
 ROOT_TOKEN=$(jq -r .root_token "${OUTPUT_KEYS_FILE}")
@@ -118,13 +173,23 @@ fi
 echo "Configuring secrets and authentication..."
 vault secrets enable database
 
+# The ProxySQL pool user gets a static role, so it needs to be allowed too
+DB_POOL_USER=${DB_POOL_USER:-""}
+ALLOWED_ROLES="nodejs-app,nodejs-app-read"
+if [[ -n "${DB_POOL_USER}" ]]; then
+	ALLOWED_ROLES="${ALLOWED_ROLES},nodejs-pool"
+fi
+
 # Configure MySQL database connection
-# This will create database conneciton when executed
-# So your database should be up and running
+# This will create database conneciton when executed. The database server may
+# still be booting (instances are provisioned in parallel), so wait until it
+# has marked itself ready, i.e. the Vault user exists
+DB_WAIT_TIMEOUT=${DB_WAIT_TIMEOUT:-900}
+phase mysql-wait wait_ready mysql "${DB_WAIT_TIMEOUT}"
 vault write database/config/mysql-database \
 	plugin_name=mysql-database-plugin \
 	connection_url="{{username}}:{{password}}@tcp(${DB_HOST_IP}:3306)/" \
-	allowed_roles="nodejs-app" \
+	allowed_roles="${ALLOWED_ROLES}" \
 	username="${DB_USER}" \
 	password="${DB_PASSWORD}"
 
@@ -135,6 +200,25 @@ vault write database/roles/nodejs-app \
 	default_ttl="1h" \
 	max_ttl="24h"
 
+# Read-only credentials for the read replicas. Users are created on the
+# primary and replicate to the (super_read_only) replicas, so the role is
+# scoped by privilege: SELECT only
+vault write database/roles/nodejs-app-read \
+	db_name=mysql-database \
+	creation_statements="CREATE USER '{{name}}'@'%' IDENTIFIED BY '{{password}}'; GRANT SELECT ON ${DB_NAME}.* TO '{{name}}'@'%';" \
+	default_ttl="1h" \
+	max_ttl="24h"
+
+# Static role for the ProxySQL pool user: one long-lived MySQL user whose
+# password Vault rotates, instead of a CREATE USER per lease
+if [[ -n "${DB_POOL_USER}" ]]; then
+	vault write database/static-roles/nodejs-pool \
+		db_name=mysql-database \
+		username="${DB_POOL_USER}" \
+		rotation_statements="ALTER USER '{{name}}'@'%' IDENTIFIED BY '{{password}}';" \
+		rotation_period="24h"
+fi
+
 # Enable AppRole authentication method
 vault auth enable approle
 
@@ -143,6 +227,14 @@ cat >nodejs-policy.hcl <<EOF
 path "database/creds/nodejs-app" {
 	capabilities = ["read"]
 }
+
+path "database/creds/nodejs-app-read" {
+	capabilities = ["read"]
+}
+
+path "database/static-creds/nodejs-pool" {
+	capabilities = ["read"]
+}
 EOF
 
 vault policy write nodejs-policy nodejs-policy.hcl
@@ -163,7 +255,7 @@ jq --arg role_id "$ROLE_ID" --arg secret_id "$SECRET_ID" \
 	mv ${OUTPUT_KEYS_FILE}.tmp ${OUTPUT_KEYS_FILE}
 
 # Store credentials in AWS SSM Parameter Store
-aws ssm put-parameter --name "role_id" --value "${ROLE_ID}" --type "String" --overwrite --region "ap-southeast-1"
-aws ssm put-parameter --name "secret_id" --value "${SECRET_ID}" --type "String" --overwrite --region "ap-southeast-1"
+aws ssm put-parameter --name "${SSM_PREFIX}role_id" --value "${ROLE_ID}" --type "String" --overwrite --region "${REGION_NAME}"
+aws ssm put-parameter --name "${SSM_PREFIX}secret_id" --value "${SECRET_ID}" --type "String" --overwrite --region "${REGION_NAME}"
 
 echo "Vault setup completed successfully at $(date)"
\ No newline at end of file
@@ -0,0 +1,104 @@
+#!/usr/bin/env bash
+
+# Exit on error, trace commands, don't allow unset variables,
+# pileline status code is 0 iff all commands in pipeline has status code 0
+set -euxo pipefail
+exec > >(tee -a "/var/log/vault-agent-setup.log") 2>&1
+
+# Configures a local Vault Agent for the app server. It logs in with the
+# app's AppRole, caches tokens and leases for local clients on
+# 127.0.0.1:8100 and renders database credentials to /run/vault-agent,
+# which lives on tmpfs. Expects ROLE_ID and SECRET_ID in the environment.
+
+echo "Starting Vault Agent setup at $(date)"
+
+source /etc/environment
+
+AGENT_DIR="/etc/vault-agent"
+mkdir -p "$AGENT_DIR"
+
+# AppRole credentials; kept after reading so the agent can log in again
+# after a restart
+echo -n "$ROLE_ID" > "$AGENT_DIR/role_id"
+echo -n "$SECRET_ID" > "$AGENT_DIR/secret_id"
+
+cat > "$AGENT_DIR/db.env.ctmpl" <<'EOF'
+{{ with secret "database/creds/nodejs-app" -}}
+MYSQL_USER={{ .Data.username }}
+MYSQL_PASSWORD={{ .Data.password }}
+{{ end -}}
+{{ with secret "database/creds/nodejs-app-read" -}}
+MYSQL_READ_USER={{ .Data.username }}
+MYSQL_READ_PASSWORD={{ .Data.password }}
+{{ end -}}
+EOF
+
+cat > "$AGENT_DIR/agent.hcl" <<EOF
+pid_file = "/run/vault-agent/agent.pid"
+
+vault {
+  address = "http://${VAULT_HOST_IP}:8200"
+  retry {
+    num_retries = -1
+  }
+}
+
+auto_auth {
+  method "approle" {
+    config = {
+      role_id_file_path                   = "${AGENT_DIR}/role_id"
+      secret_id_file_path                 = "${AGENT_DIR}/secret_id"
+      remove_secret_id_file_after_reading = false
+    }
+  }
+
+  sink "file" {
+    config = {
+      path = "/run/vault-agent/token"
+      mode = 0640
+    }
+  }
+}
+
+# Requests without a token use the agent's own, and leased responses are
+# cached and renewed here instead of hitting Vault on every call
+api_proxy {
+  use_auto_auth_token = true
+}
+
+cache {}
+
+listener "tcp" {
+  address     = "127.0.0.1:8100"
+  tls_disable = true
+}
+
+# Credentials are renewed by the agent and rendered again before they expire
+template {
+  source      = "${AGENT_DIR}/db.env.ctmpl"
+  destination = "/run/vault-agent/db.env"
+  perms       = "0640"
+}
+EOF
+
+chown -R vault:vault "$AGENT_DIR"
+chmod 700 "$AGENT_DIR"
+chmod 600 "$AGENT_DIR"/*
+
+systemctl daemon-reload
+systemctl enable --now vault-agent
+
+# Wait for the first credentials so the app never starts without them
+AGENT_RENDER_TIMEOUT=${AGENT_RENDER_TIMEOUT:-300}
+deadline=$((SECONDS + AGENT_RENDER_TIMEOUT))
+until [[ -s /run/vault-agent/db.env ]]; do
+    if ((SECONDS >= deadline)); then
+        echo "Vault Agent did not render /run/vault-agent/db.env within ${AGENT_RENDER_TIMEOUT}s" >&2
+        journalctl -u vault-agent --no-pager -n 50 >&2 || true
+        exit 1
+    fi
+    echo "Waiting for Vault Agent to render credentials"
+    sleep 5
+done
+
+echo "Vault Agent setup completed successfully at $(date)"
@@ -1,12 +1,65 @@
 import pulumi
 import pulumi_aws as aws
 
-def create_security_groups(vpc, public_subnet, private_subnet):
+def create_security_groups(vpc, load_balanced=False, vault_cluster=False, redis_sentinel=False,
+                           name_prefix='', parent=None):
     """Create security groups for each component"""
 
-    # Node.js application security group
+    # The data tier only accepts traffic from this set of security groups,
+    # never from address ranges, so environments sharing a VPC can't reach
+    # each other's servers
+    def from_groups(port, groups, itself=False):
+        return aws.ec2.SecurityGroupIngressArgs(
+            protocol='tcp',
+            from_port=port,
+            to_port=port,
+            security_groups=[group.id for group in groups],
+            self=itself
+        )
+
+    # Load balancer security group, only used when the Node.js tier runs
+    # in an Auto Scaling Group behind an ALB
+    alb_security_group = None
+    if load_balanced:
+        alb_security_group = aws.ec2.SecurityGroup(
+            resource_name=f'{name_prefix}alb-security-group',
+            vpc_id=vpc.id,
+            description="Security group for the Node.js load balancer",
+            ingress=[
+                aws.ec2.SecurityGroupIngressArgs(
+                    protocol='tcp',
+                    from_port=80,
+                    to_port=80,
+                    cidr_blocks=['0.0.0.0/0']
+                )
+            ],
+            egress=[
+                aws.ec2.SecurityGroupEgressArgs(
+                    protocol='-1',
+                    from_port=0,
+                    to_port=0,
+                    cidr_blocks=['0.0.0.0/0']
+                )
+            ],
+            tags={'Name': f'{name_prefix}alb-security-group'},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+    # Behind a load balancer the app port is only reachable from the ALB
+    if alb_security_group:
+        app_ingress = from_groups(3000, [alb_security_group])
+    else:
+        app_ingress = aws.ec2.SecurityGroupIngressArgs(
+            protocol='tcp',
+            from_port=3000,
+            to_port=3000,
+            cidr_blocks=['0.0.0.0/0']
+        )
+
+    # Node.js application security group. The app servers are also the SSH
+    # jump host for the private instances
     nodejs_security_group = aws.ec2.SecurityGroup(
-        resource_name='nodejs-security-group',
+        resource_name=f'{name_prefix}nodejs-security-group',
         vpc_id=vpc.id,
         description="Security group for Node.js application",
         ingress=[
@@ -16,13 +69,58 @@ def create_security_groups(vpc, public_subnet, private_subnet):
                 to_port=22,
                 cidr_blocks=['0.0.0.0/0']
             ),
-            aws.ec2.SecurityGroupIngressArgs(
-                protocol='tcp',
-                from_port=3000,
-                to_port=3000,
+            app_ingress
+        ],
+        egress=[
+            aws.ec2.SecurityGroupEgressArgs(
+                protocol='-1',
+                from_port=0,
+                to_port=0,
                 cidr_blocks=['0.0.0.0/0']
             )
         ],
+        tags={'Name': f'{name_prefix}nodejs-security-group'},
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+    # Vault cluster load balancer. The NLB keeps the client address, so app
+    # traffic reaches the nodes from the app servers; its own group covers
+    # the health checks
+    vault_nlb_security_group = None
+    if vault_cluster:
+        vault_nlb_security_group = aws.ec2.SecurityGroup(
+            resource_name=f'{name_prefix}vault-nlb-security-group',
+            vpc_id=vpc.id,
+            description='Security group for the Vault load balancer',
+            ingress=[from_groups(8200, [nodejs_security_group])],
+            egress=[
+                aws.ec2.SecurityGroupEgressArgs(
+                    protocol='-1',
+                    from_port=0,
+                    to_port=0,
+                    cidr_blocks=['0.0.0.0/0']
+                )
+            ],
+            tags={'Name': f'{name_prefix}vault-nlb-security-group'},
+            opts=pulumi.ResourceOptions(parent=parent)
+        )
+
+    # A Vault cluster also takes API calls from its peers and the NLB, and
+    # Raft traffic between its nodes
+    vault_ingress = [
+        from_groups(22, [nodejs_security_group]),
+        from_groups(8200, [nodejs_security_group] + ([vault_nlb_security_group] if vault_cluster else []),
+                    itself=vault_cluster)
+    ]
+    if vault_cluster:
+        vault_ingress.append(from_groups(8201, [], itself=True))
+
+    # Vault security group
+    vault_security_group = aws.ec2.SecurityGroup(
+        resource_name=f'{name_prefix}vault-security-group',
+        vpc_id=vpc.id,
+        description='Security group for Vault server',
+        ingress=vault_ingress,
         egress=[
             aws.ec2.SecurityGroupEgressArgs(
                 protocol='-1',
@@ -31,27 +129,19 @@ def create_security_groups(vpc, public_subnet, private_subnet):
                 cidr_blocks=['0.0.0.0/0']
             )
         ],
-        tags={'Name': 'nodejs-security-group'}
+        tags={'Name': f'{name_prefix}vault-security-group'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
-    # Database security group
+    # Database security group. Vault connects to create credentials, the
+    # replicas to replicate from the primary
     db_security_group = aws.ec2.SecurityGroup(
-        resource_name='db-security-group',
+        resource_name=f'{name_prefix}db-security-group',
         vpc_id=vpc.id,
         description='Security group for MySQL database',
         ingress=[
-            aws.ec2.SecurityGroupIngressArgs(
-                protocol='tcp',
-                from_port=22,
-                to_port=22,
-                cidr_blocks=[public_subnet.cidr_block],
-            ),
-            aws.ec2.SecurityGroupIngressArgs(
-                protocol='tcp',
-                from_port=3306,
-                to_port=3306,
-                cidr_blocks=[public_subnet.cidr_block, private_subnet.cidr_block]
-            )
+            from_groups(22, [nodejs_security_group]),
+            from_groups(3306, [nodejs_security_group, vault_security_group], itself=True)
         ],
         egress=[
             aws.ec2.SecurityGroupEgressArgs(
@@ -61,28 +151,27 @@ def create_security_groups(vpc, public_subnet, private_subnet):
                 cidr_blocks=['0.0.0.0/0']
             )
         ],
-        tags={'Name': 'db-security-group'}
+        tags={'Name': f'{name_prefix}db-security-group'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
-    # Vault security group
-    vault_security_group = aws.ec2.SecurityGroup(
-        resource_name='vault-security-group',
+    # Every instance writes boot phases, readiness markers and health to
+    # Redis, and replicas replicate from the primary. Sentinels talk to each
+    # other and answer clients on 26379
+    redis_clients = [nodejs_security_group, db_security_group, vault_security_group]
+    redis_ingress = [
+        from_groups(22, [nodejs_security_group]),
+        from_groups(6379, redis_clients, itself=True)
+    ]
+    if redis_sentinel:
+        redis_ingress.append(from_groups(26379, [nodejs_security_group], itself=True))
+
+    # Redis security group
+    redis_security_group = aws.ec2.SecurityGroup(
+        resource_name=f'{name_prefix}redis-security-group',
         vpc_id=vpc.id,
-        description='Security group for Vault server',
-        ingress=[
-            aws.ec2.SecurityGroupIngressArgs(
-                protocol='tcp',
-                from_port=22,
-                to_port=22,
-                cidr_blocks=[public_subnet.cidr_block],
-            ),
-            aws.ec2.SecurityGroupIngressArgs(
-                protocol='tcp',
-                from_port=8200,
-                to_port=8200,
-                cidr_blocks=[public_subnet.cidr_block]
-            )
-        ],
+        description='Security group for Redis server',
+        ingress=redis_ingress,
         egress=[
             aws.ec2.SecurityGroupEgressArgs(
                 protocol='-1',
@@ -91,26 +180,33 @@ def create_security_groups(vpc, public_subnet, private_subnet):
                 cidr_blocks=['0.0.0.0/0']
             )
         ],
-        tags={'Name': 'vault-security-group'}
+        tags={'Name': f'{name_prefix}redis-security-group'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
-    # Redis security group
-    redis_security_group = aws.ec2.SecurityGroup(
-        resource_name='redis-security-group',
+    return {
+        "nodejs": nodejs_security_group,
+        "db": db_security_group,
+        "vault": vault_security_group,
+        "redis": redis_security_group,
+        "alb": alb_security_group,
+        "vault_nlb": vault_nlb_security_group
+    }
+
+def create_endpoint_security_group(vpc, cidr_blocks, name_prefix='', parent=None):
+    """Create the security group for VPC interface endpoints"""
+
+    # Interface endpoints only serve HTTPS to clients inside the VPC
+    endpoint_security_group = aws.ec2.SecurityGroup(
+        resource_name=f'{name_prefix}endpoint-security-group',
         vpc_id=vpc.id,
-        description='Security group for Redis server',
+        description='Security group for VPC interface endpoints',
         ingress=[
             aws.ec2.SecurityGroupIngressArgs(
                 protocol='tcp',
-                from_port=22,
-                to_port=22,
-                cidr_blocks=[public_subnet.cidr_block],
-            ),
-            aws.ec2.SecurityGroupIngressArgs(
-                protocol='tcp',
-                from_port=6379,
-                to_port=6379,
-                cidr_blocks=[public_subnet.cidr_block, private_subnet.cidr_block]
+                from_port=443,
+                to_port=443,
+                cidr_blocks=cidr_blocks
             )
         ],
         egress=[
@@ -121,17 +217,13 @@ def create_security_groups(vpc, public_subnet, private_subnet):
                 cidr_blocks=['0.0.0.0/0']
             )
         ],
-        tags={'Name': 'redis-security-group'}
+        tags={'Name': f'{name_prefix}endpoint-security-group'},
+        opts=pulumi.ResourceOptions(parent=parent)
     )
 
-    return {
-        "nodejs": nodejs_security_group,
-        "db": db_security_group,
-        "vault": vault_security_group,
-        "redis": redis_security_group
-    }
+    return endpoint_security_group
 
-def create_iam_resources():
+def create_iam_resources(vault_cluster=False, vault_seal="awskms"):
     """Create IAM roles and policies for EC2 instances"""
 
     # Create IAM role for EC2 instances
@@ -185,6 +277,61 @@ def create_iam_resources():
         policy_arn=ssm_parameter_policy.arn
     )
 
+    # Vault nodes discover their Raft peers by listing tagged instances
+    if vault_cluster:
+        vault_auto_join_policy = aws.iam.Policy("vaultAutoJoinPolicy",
+            policy='''\
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Effect": "Allow",
+      "Action": "ec2:DescribeInstances",
+      "Resource": "*"
+    }
+  ]
+}
+'''
+        )
+
+        aws.iam.RolePolicyAttachment("vaultAutoJoinAttachment",
+            role=ec2_role.name,
+            policy_arn=vault_auto_join_policy.arn
+        )
+
+    # KMS key Vault uses to auto-unseal on every start
+    vault_kms_key = None
+    if vault_seal == "awskms":
+        vault_kms_key = aws.kms.Key("vaultUnsealKey",
+            description="Vault auto-unseal key",
+            deletion_window_in_days=7,
+            enable_key_rotation=True
+        )
+
+        vault_kms_policy = aws.iam.Policy("vaultKmsPolicy",
+            policy=vault_kms_key.arn.apply(lambda arn: f'''\
+{{
+  "Version": "2012-10-17",
+  "Statement": [
+    {{
+      "Effect": "Allow",
+      "Action": [
+        "kms:Encrypt",
+        "kms:Decrypt",
+        "kms:DescribeKey"
+      ],
+      "Resource": "{arn}"
+    }}
+  ]
+}}
+''')
+        )
+
+        aws.iam.RolePolicyAttachment("vaultKmsAttachment",
+            role=ec2_role.name,
+            policy_arn=vault_kms_policy.arn
+        )
+
     # Create an instance profile to attach the role to EC2 instances
     instance_profile = aws.iam.InstanceProfile("ec2InstanceProfile",
         role=ec2_role.name
@@ -192,5 +339,66 @@ def create_iam_resources():
 
     return {
         "role": ec2_role,
-        "instance_profile": instance_profile
-    }
\ No newline at end of file
+        "instance_profile": instance_profile,
+        "vault_kms_key": vault_kms_key
+    }
+
+def create_image_builder_security_group(vpc):
+    """Create the security group used by EC2 Image Builder build instances"""
+
+    # Build instances only need outbound access to package mirrors and SSM
+    image_builder_security_group = aws.ec2.SecurityGroup(
+        resource_name='image-builder-security-group',
+        vpc_id=vpc.id,
+        description='Security group for EC2 Image Builder instances',
+        egress=[
+            aws.ec2.SecurityGroupEgressArgs(
+                protocol='-1',
+                from_port=0,
+                to_port=0,
+                cidr_blocks=['0.0.0.0/0']
+            )
+        ],
+        tags={'Name': 'image-builder-security-group'}
+    )
+
+    return image_builder_security_group
+
+def create_image_builder_iam_resources():
+    """Create IAM role and instance profile for EC2 Image Builder"""
+
+    image_builder_role = aws.iam.Role("imageBuilderRole",
+        assume_role_policy='''\
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Effect": "Allow",
+      "Principal": {
+        "Service": "ec2.amazonaws.com"
+      },
+      "Action": "sts:AssumeRole"
+    }
+  ]
+}
+'''
+    )
+
+    # Image Builder drives the build instance through SSM
+    for name, policy_arn in [
+        ("imageBuilderSsmAttachment", "arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore"),
+        ("imageBuilderAttachment", "arn:aws:iam::aws:policy/EC2InstanceProfileForImageBuilder"),
+    ]:
+        aws.iam.RolePolicyAttachment(name,
+            role=image_builder_role.name,
+            policy_arn=policy_arn
+        )
+
+    image_builder_profile = aws.iam.InstanceProfile("imageBuilderInstanceProfile",
+        role=image_builder_role.name
+    )
+
+    return {
+        "role": image_builder_role,
+        "instance_profile": image_builder_profile
+    }
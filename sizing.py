@@ -0,0 +1,142 @@
+import copy
+import pulumi_aws as aws
+
+# Memory (MiB) and vCPU count of the instance types used by the sizing
+# profiles, also used to derive service tuning from the instance size
+INSTANCE_TYPES = {
+    't2.micro': {"memory_mib": 1024, "vcpus": 1},
+    't2.small': {"memory_mib": 2048, "vcpus": 1},
+    't2.medium': {"memory_mib": 4096, "vcpus": 2},
+    't3.micro': {"memory_mib": 1024, "vcpus": 2},
+    't3.small': {"memory_mib": 2048, "vcpus": 2},
+    't3.medium': {"memory_mib": 4096, "vcpus": 2},
+    't3.large': {"memory_mib": 8192, "vcpus": 2},
+    'm6i.large': {"memory_mib": 8192, "vcpus": 2},
+    'm6i.xlarge': {"memory_mib": 16384, "vcpus": 4},
+    'm6i.2xlarge': {"memory_mib": 32768, "vcpus": 8},
+    'c6i.large': {"memory_mib": 4096, "vcpus": 2},
+    'c6i.xlarge': {"memory_mib": 8192, "vcpus": 4},
+    'r6i.large': {"memory_mib": 16384, "vcpus": 2},
+    'r6i.xlarge': {"memory_mib": 32768, "vcpus": 4},
+    'r6i.2xlarge': {"memory_mib": 65536, "vcpus": 8},
+}
+
+ROLES = ["redis", "db", "vault", "nodejs"]
+
+# Per-role defaults. Volumes are gp3; iops/throughput left out use the gp3
+# baseline (3000 IOPS, 125 MiB/s). dataVolume is only honoured for db
+# (MySQL datadir) and redis (AOF/RDB directory). Data volumes are encrypted
+# unless "encrypted" is false; root volumes only with "encrypted": true,
+# since changing it replaces the instance
+PROFILES = {
+    "dev": {
+        "redis": {"instanceType": 't2.micro', "rootVolume": {"size": 8}},
+        "db": {"instanceType": 't2.micro', "rootVolume": {"size": 8}},
+        "vault": {"instanceType": 't2.micro', "rootVolume": {"size": 8}},
+        "nodejs": {"instanceType": 't2.micro', "rootVolume": {"size": 8}},
+    },
+    "prod": {
+        "redis": {"instanceType": 'm6i.large', "ebsOptimized": True, "rootVolume": {"size": 16},
+                  "dataVolume": {"size": 50}},
+        "db": {"instanceType": 'r6i.large', "ebsOptimized": True, "rootVolume": {"size": 16},
+               "dataVolume": {"size": 200, "iops": 6000, "throughput": 250}},
+        "vault": {"instanceType": 't3.small', "rootVolume": {"size": 16}},
+        "nodejs": {"instanceType": 't3.medium', "rootVolume": {"size": 16}},
+    },
+    "high-throughput": {
+        "redis": {"instanceType": 'r6i.xlarge', "ebsOptimized": True, "rootVolume": {"size": 16},
+                  "dataVolume": {"size": 100, "iops": 6000, "throughput": 500}},
+        "db": {"instanceType": 'r6i.2xlarge', "ebsOptimized": True, "rootVolume": {"size": 32},
+               "dataVolume": {"size": 500, "iops": 16000, "throughput": 1000}},
+        "vault": {"instanceType": 'm6i.large', "ebsOptimized": True, "rootVolume": {"size": 16}},
+        "nodejs": {"instanceType": 'c6i.xlarge', "ebsOptimized": True, "rootVolume": {"size": 16}},
+    },
+}
+
+DATA_VOLUME_ROLES = ("db", "redis")
+
+# Device names as seen by EC2; the setup scripts find the disk themselves
+# since Nitro instances expose it as NVMe
+ROOT_DEVICE_NAME = '/dev/sda1'
+DATA_DEVICE_NAME = '/dev/sdf'
+
+def _merge(base, override):
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def resolve_sizing(profile="dev", overrides=None):
+    """Per-role sizing from a named profile, with per-role overrides from
+    stack config applied on top"""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown sizing profile '{profile}', expected one of {', '.join(PROFILES)}")
+    overrides = overrides or {}
+    unknown_roles = set(overrides) - set(ROLES)
+    if unknown_roles:
+        raise ValueError(f"instanceSizing has unknown roles: {', '.join(sorted(unknown_roles))}")
+
+    sizing = {}
+    for role in ROLES:
+        spec = _merge(PROFILES[profile][role], overrides.get(role))
+        if spec.get("dataVolume") and role not in DATA_VOLUME_ROLES:
+            raise ValueError(f"dataVolume is only supported for {' and '.join(DATA_VOLUME_ROLES)}, not {role}")
+        # t2 instances can't be EBS-optimized
+        if spec.get("ebsOptimized") and spec["instanceType"].startswith('t2.'):
+            raise ValueError(f"{role}: {spec['instanceType']} does not support EBS optimization")
+        sizing[role] = spec
+    return sizing
+
+def instance_resources(instance_type):
+    """Memory and vCPUs of an instance type"""
+    if instance_type not in INSTANCE_TYPES:
+        raise ValueError(f"Unknown instance type '{instance_type}', add it to sizing.INSTANCE_TYPES")
+    return INSTANCE_TYPES[instance_type]
+
+def root_block_device(spec):
+    """gp3 root volume arguments for an aws.ec2.Instance"""
+    volume = spec.get("rootVolume", {})
+    return aws.ec2.InstanceRootBlockDeviceArgs(
+        volume_type='gp3',
+        volume_size=volume.get("size"),
+        iops=volume.get("iops"),
+        throughput=volume.get("throughput"),
+        encrypted=volume.get("encrypted")
+    )
+
+def ebs_block_devices(spec):
+    """Separate gp3 data volume arguments for an aws.ec2.Instance, if any"""
+    volume = spec.get("dataVolume")
+    if not volume:
+        return None
+    return [
+        aws.ec2.InstanceEbsBlockDeviceArgs(
+            device_name=DATA_DEVICE_NAME,
+            volume_type='gp3',
+            volume_size=volume["size"],
+            iops=volume.get("iops"),
+            throughput=volume.get("throughput"),
+            encrypted=volume.get("encrypted", True),
+            delete_on_termination=True
+        )
+    ]
+
+def launch_template_block_devices(spec):
+    """gp3 root volume mapping for an aws.ec2.LaunchTemplate"""
+    volume = spec.get("rootVolume", {})
+    return [
+        aws.ec2.LaunchTemplateBlockDeviceMappingArgs(
+            device_name=ROOT_DEVICE_NAME,
+            ebs=aws.ec2.LaunchTemplateBlockDeviceMappingEbsArgs(
+                volume_type='gp3',
+                volume_size=volume.get("size"),
+                iops=volume.get("iops"),
+                throughput=volume.get("throughput"),
+                encrypted='true' if volume.get("encrypted") else None,
+                delete_on_termination='true'
+            )
+        )
+    ]
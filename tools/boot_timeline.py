@@ -0,0 +1,136 @@
+"""Merge boot phase events into a per-instance deploy waterfall.
+
+The user_data of every instance records its boot phases (see
+scripts/common/phases.sh) as JSON lines in /var/log/boot-phases.jsonl and
+in the `boot:phases` Redis stream. This tool reads either source:
+
+  from Redis    through a tunnel to the Redis server, e.g.
+                ssh -L 6379:<redis private ip>:6379 nodejs-server
+                python tools/boot_timeline.py --redis 127.0.0.1:6379
+                (password from --password or REDIS_PASSWORD)
+  from files    logs copied from the instances, or - for stdin, e.g.
+                ssh db-server cat /var/log/boot-phases.jsonl | python tools/boot_timeline.py -
+
+Phases are laid out on one time axis starting at the earliest event, so
+waits between instances show up next to the work that caused them.
+Phases that started but never ended are shown as still running.
+
+Usage: python tools/boot_timeline.py [--redis HOST:PORT] [--json] [FILE ...]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'scripts', 'health', 'health_agent.py')
+
+STREAM = 'boot:phases'
+BAR_WIDTH = 50
+
+
+def load_agent():
+    """Import the health agent (for its Redis client) from its script path"""
+    spec = importlib.util.spec_from_file_location('health_agent', AGENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_redis(address, password, stream=STREAM):
+    """Read every event from the boot phase stream"""
+    host, _, port = address.partition(':')
+    agent = load_agent()
+    conn = agent.RedisConnection(host, int(port or agent.REDIS_PORT), password)
+    try:
+        entries = conn.command('XRANGE', stream, '-', '+')
+    finally:
+        conn.close()
+    events = []
+    for _, fields in entries or []:
+        values = dict(zip(fields[::2], fields[1::2]))
+        events.append(json.loads(values['event']))
+    return events
+
+
+def read_files(paths):
+    """Read events from JSON lines files, - is stdin"""
+    events = []
+    for path in paths:
+        fd = sys.stdin if path == '-' else open(path)
+        with fd:
+            events += [json.loads(line) for line in fd if line.strip()]
+    return events
+
+
+def build_phases(events):
+    """Pair start and end events into phases: node, phase, start, end (ms), status"""
+    # The same event can come from both the stream and a copied log
+    unique = {json.dumps(event, sort_keys=True): event for event in events}
+    events = sorted(unique.values(), key=lambda event: event['ts'])
+    last_seen = {}
+    open_phases = {}
+    phases = []
+    for event in events:
+        key = (event['node'], event['phase'])
+        last_seen[event['node']] = event['ts']
+        if event['event'] == 'start':
+            open_phases[key] = event['ts']
+        elif event['event'] == 'end':
+            started = open_phases.pop(key, event['ts'] - event.get('duration_ms', 0))
+            phases.append({"node": event['node'], "phase": event['phase'],
+                           "start": started, "end": event['ts'], "status": event.get('status')})
+    for (node, name), started in open_phases.items():
+        phases.append({"node": node, "phase": name, "start": started,
+                       "end": last_seen[node], "status": None})
+    return sorted(phases, key=lambda phase: (phase['start'], -phase['end']))
+
+
+def render(phases):
+    """Text waterfall grouped by node, in the order the nodes started"""
+    if not phases:
+        return 'No boot phase events found'
+    origin = min(phase['start'] for phase in phases)
+    total = max(phase['end'] for phase in phases) - origin or 1
+    scale = BAR_WIDTH / total
+
+    nodes = []
+    for phase in phases:
+        if phase['node'] not in nodes:
+            nodes.append(phase['node'])
+
+    lines = [f"{'node / phase':<32} {'start':>8} {'took':>8}  timeline (total {total / 1000:.1f}s)"]
+    for node in nodes:
+        lines.append(node)
+        for phase in (p for p in phases if p['node'] == node):
+            offset = min(int((phase['start'] - origin) * scale), BAR_WIDTH - 1)
+            width = min(max(1, int((phase['end'] - phase['start']) * scale)), BAR_WIDTH - offset)
+            bar = ' ' * offset + ('#' if phase['status'] == 0 else '!' if phase['status'] else '.') * width
+            state = '' if phase['status'] == 0 else ' running' if phase['status'] is None else f" exit {phase['status']}"
+            lines.append(f"  {phase['phase']:<30} {(phase['start'] - origin) / 1000:>7.1f}s "
+                         f"{(phase['end'] - phase['start']) / 1000:>7.1f}s  |{bar:<{BAR_WIDTH}}|{state}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', metavar='FILE', help='boot-phases.jsonl files, - for stdin')
+    parser.add_argument('--redis', metavar='HOST:PORT', help='read the boot:phases stream from this Redis')
+    parser.add_argument('--password', default=os.environ.get('REDIS_PASSWORD'), help='Redis password')
+    parser.add_argument('--json', action='store_true', help='print the merged phases as JSON')
+    args = parser.parse_args()
+
+    if not args.redis and not args.files:
+        parser.error('give --redis or at least one FILE')
+
+    events = read_files(args.files)
+    if args.redis:
+        events += read_redis(args.redis, args.password)
+
+    phases = build_phases(events)
+    if args.json:
+        json.dump(phases, sys.stdout, indent=2)
+        print()
+    else:
+        print(render(phases))
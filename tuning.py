@@ -0,0 +1,176 @@
+import sizing
+
+# Named MySQL profiles. Fractions are of instance memory, multipliers scale
+# the settings derived from instance size
+MYSQL_PROFILES = {
+    # Durable commits with a large redo log and aggressive background flushing
+    "oltp-write-heavy": {
+        "extra_buffer_pool_fraction": 0.0,
+        "redo_log_fraction": 0.25,
+        "io_capacity_multiplier": 1.0,
+        "read_io_threads_per_vcpu": 1,
+        "write_io_threads_per_vcpu": 2,
+        "log_buffer_mib": 64,
+        "table_open_cache": 4000,
+    },
+    # Most memory for the buffer pool, more read threads, a smaller redo log
+    "read-heavy": {
+        "extra_buffer_pool_fraction": 0.05,
+        "redo_log_fraction": 0.1,
+        "io_capacity_multiplier": 0.5,
+        "read_io_threads_per_vcpu": 2,
+        "write_io_threads_per_vcpu": 1,
+        "log_buffer_mib": 16,
+        "table_open_cache": 8000,
+    },
+}
+
+# gp3 baseline when the volume spec sets no IOPS
+GP3_BASELINE_IOPS = 3000
+
+def _clamp(value, lowest, highest):
+    return max(lowest, min(highest, value))
+
+def mysql_settings(spec, profile="oltp-write-heavy"):
+    """mysqld settings for a role's sizing spec (see sizing.py)"""
+    if profile not in MYSQL_PROFILES:
+        raise ValueError(f"Unknown MySQL tuning profile '{profile}', expected one of {', '.join(MYSQL_PROFILES)}")
+    tuning = MYSQL_PROFILES[profile]
+    resources = sizing.instance_resources(spec["instanceType"])
+    memory_mib = resources["memory_mib"]
+    vcpus = resources["vcpus"]
+
+    # Leave room for the OS, connection buffers and the health agent; small
+    # instances need proportionally more of it
+    if memory_mib < 4096:
+        pool_fraction = 0.4
+    elif memory_mib < 16384:
+        pool_fraction = 0.65
+    else:
+        pool_fraction = 0.7
+    buffer_pool_mib = int(memory_mib * (pool_fraction + tuning["extra_buffer_pool_fraction"]))
+    # Buffer pool size must be a multiple of chunk size x instances (128 MiB chunks)
+    buffer_pool_instances = _clamp(buffer_pool_mib // 1024, 1, 8)
+    buffer_pool_mib -= buffer_pool_mib % (128 * buffer_pool_instances)
+    buffer_pool_mib = max(buffer_pool_mib, 128)
+
+    redo_log_mib = _clamp(int(buffer_pool_mib * tuning["redo_log_fraction"]), 128, 8192)
+
+    # The datadir lives on the data volume when there is one, so its IOPS
+    # bound InnoDB flushing; otherwise the root volume
+    volume = spec.get("dataVolume") or spec.get("rootVolume") or {}
+    # Background flushing gets half the volume's IOPS, bursts up to all of it
+    io_capacity = int((volume.get("iops") or GP3_BASELINE_IOPS) * tuning["io_capacity_multiplier"] / 2)
+
+    # Roughly 10 MiB per connection; Vault opens one per lease it manages
+    max_connections = _clamp(memory_mib // 10, 100, 4000)
+
+    return {
+        "innodb_buffer_pool_size": f"{buffer_pool_mib}M",
+        "innodb_buffer_pool_instances": buffer_pool_instances,
+        "innodb_redo_log_capacity": f"{redo_log_mib}M",
+        "innodb_log_buffer_size": f"{min(tuning['log_buffer_mib'], memory_mib // 64)}M",
+        "innodb_flush_log_at_trx_commit": 1,
+        "sync_binlog": 1,
+        "innodb_flush_method": "O_DIRECT",
+        "innodb_io_capacity": io_capacity,
+        "innodb_io_capacity_max": io_capacity * 2,
+        "innodb_read_io_threads": _clamp(vcpus * tuning["read_io_threads_per_vcpu"], 4, 64),
+        "innodb_write_io_threads": _clamp(vcpus * tuning["write_io_threads_per_vcpu"], 4, 64),
+        "max_connections": max_connections,
+        # Connection churn from Vault's CREATE USER/DROP USER per lease
+        "thread_cache_size": _clamp(max_connections // 20, 8, 100),
+        "skip_name_resolve": "ON",
+        "table_open_cache": min(tuning["table_open_cache"], memory_mib * 2),
+        "table_definition_cache": 2000,
+    }
+
+def render_mysql_config(spec, profile="oltp-write-heavy"):
+    """Render a mysqld.cnf fragment for a role's sizing spec"""
+    resources = sizing.instance_resources(spec["instanceType"])
+    settings = mysql_settings(spec, profile)
+    lines = [
+        f"# Generated by tuning.py for {spec['instanceType']} "
+        f"({resources['memory_mib']} MiB, {resources['vcpus']} vCPUs), profile {profile}",
+        "[mysqld]",
+    ] + [f"{key} = {value}" for key, value in settings.items()]
+    return '\n'.join(lines) + '\n'
+
+def render_mysql_replication_config(server_id, replica=False):
+    """Render the mysqld.cnf fragment for GTID replication; server_id 1 is the primary"""
+    lines = [
+        "# Generated by tuning.py for GTID replication",
+        "[mysqld]",
+        f"server_id = {server_id}",
+        "gtid_mode = ON",
+        "enforce_gtid_consistency = ON",
+    ]
+    if replica:
+        lines += [
+            "read_only = ON",
+            "super_read_only = ON",
+            "relay_log_recovery = ON",
+        ]
+    return '\n'.join(lines) + '\n'
+
+# Redis persistence modes. "aof" keeps an append-only file with an RDB
+# preamble on rewrite but no periodic RDB snapshots, which would fork the
+# whole dataset every time they trigger
+REDIS_PERSISTENCE = {
+    "aof": {"appendonly": "yes", "save": '""'},
+    "aof+rdb": {"appendonly": "yes", "save": "3600 1"},
+    "rdb": {"appendonly": "no", "save": "3600 1 300 100"},
+    "none": {"appendonly": "no", "save": '""'},
+}
+
+REDIS_DEFAULTS = {
+    "memoryFraction": 0.5,
+    "maxmemoryPolicy": "allkeys-lru",
+    "persistence": "aof",
+    "appendfsync": "everysec",
+    "tcpBacklog": 511,
+    "timeout": 0,
+}
+
+def redis_settings(spec, settings=None):
+    """redis.conf settings for a role's sizing spec (see sizing.py) and
+    the per-stack overrides from the redisTuning config"""
+    settings = {**REDIS_DEFAULTS, **(settings or {})}
+    unknown = set(settings) - set(REDIS_DEFAULTS) - {"ioThreads"}
+    if unknown:
+        raise ValueError(f"redisTuning has unknown keys: {', '.join(sorted(unknown))}")
+    if settings["persistence"] not in REDIS_PERSISTENCE:
+        raise ValueError(f"redisTuning.persistence must be one of {', '.join(REDIS_PERSISTENCE)}, got '{settings['persistence']}'")
+    if settings["appendfsync"] not in ("always", "everysec", "no"):
+        raise ValueError(f"redisTuning.appendfsync must be always, everysec or no, got '{settings['appendfsync']}'")
+    if not 0 < settings["memoryFraction"] < 1:
+        raise ValueError(f"redisTuning.memoryFraction must be between 0 and 1, got {settings['memoryFraction']}")
+
+    resources = sizing.instance_resources(spec["instanceType"])
+    # IO threads only pay off with 4+ cores; leave one for the main thread
+    io_threads = settings.get("ioThreads")
+    if io_threads is None:
+        io_threads = _clamp(resources["vcpus"] - 1, 1, 8) if resources["vcpus"] >= 4 else 1
+
+    return {
+        "maxmemory": f"{int(resources['memory_mib'] * settings['memoryFraction'])}mb",
+        "maxmemory-policy": settings["maxmemoryPolicy"],
+        **REDIS_PERSISTENCE[settings["persistence"]],
+        "appendfsync": settings["appendfsync"],
+        "aof-use-rdb-preamble": "yes",
+        # Don't block writes on fsync while an AOF rewrite is running
+        "no-appendfsync-on-rewrite": "yes",
+        "io-threads": io_threads,
+        "io-threads-do-reads": "yes" if io_threads > 1 else "no",
+        "tcp-backlog": settings["tcpBacklog"],
+        "timeout": settings["timeout"],
+    }
+
+def render_redis_config(spec, settings=None):
+    """Render the redis.conf fragment included at the end of redis.conf"""
+    resources = sizing.instance_resources(spec["instanceType"])
+    lines = [
+        f"# Generated by tuning.py for {spec['instanceType']} "
+        f"({resources['memory_mib']} MiB, {resources['vcpus']} vCPUs)",
+    ] + [f"{key} {value}" for key, value in redis_settings(spec, settings).items()]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,73 @@
+import base64
+import json
+import pulumi
+import pulumi_aws as aws
+
+# Command document that writes one configuration file and, when its content
+# changed, runs the command that makes the service pick it up. The file
+# travels base64 encoded so it can't break out of the shell script, and
+# every parameter is pinned down by a pattern.
+APPLY_CONFIG_DOCUMENT = {
+    "schemaVersion": "2.2",
+    "description": "Write a configuration file and reload the service that reads it",
+    "parameters": {
+        "path": {
+            "type": "String",
+            "description": "Absolute path of the file",
+            "allowedPattern": "^/[A-Za-z0-9._/-]+$",
+        },
+        "content": {
+            "type": "String",
+            "description": "File content, base64 encoded",
+            "allowedPattern": "^[A-Za-z0-9+/=]*$",
+        },
+        "reload": {
+            "type": "String",
+            "description": "Command run after the file changed",
+            "default": "true",
+            "allowedPattern": "^[A-Za-z0-9 ._@-]+$",
+        },
+    },
+    "mainSteps": [{
+        "action": "aws:runShellScript",
+        "name": "applyConfig",
+        "inputs": {
+            "runCommand": [
+                "set -euo pipefail",
+                "mkdir -p \"$(dirname '{{ path }}')\"",
+                "echo '{{ content }}' | base64 -d > '{{ path }}.new'",
+                "if cmp -s '{{ path }}.new' '{{ path }}'; then rm '{{ path }}.new'; exit 0; fi",
+                "mv '{{ path }}.new' '{{ path }}'",
+                "{{ reload }}",
+            ],
+        },
+    }],
+}
+
+def create_config_document(name_prefix='', parent=None):
+    """Create the SSM document that pushes configuration files in place"""
+    return aws.ssm.Document(f'{name_prefix}apply-config',
+        document_type="Command",
+        document_format="JSON",
+        content=json.dumps(APPLY_CONFIG_DOCUMENT),
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
+
+def config_association(name, document, instance, path, content, reload, parent=None):
+    """Keep a configuration file on an instance in sync with its rendered
+    content. State Manager applies the association when the instance's SSM
+    agent registers and again whenever the content changes, so editing the
+    file's settings updates the running server instead of replacing it."""
+    return aws.ssm.Association(name,
+        name=document.name,
+        targets=[aws.ssm.AssociationTargetArgs(
+            key="InstanceIds",
+            values=[instance.id],
+        )],
+        parameters={
+            "path": path,
+            "content": base64.b64encode(content.encode()).decode(),
+            "reload": reload,
+        },
+        opts=pulumi.ResourceOptions(parent=parent)
+    )
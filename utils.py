@@ -1,41 +1,50 @@
 import pulumi
 import pulumi_aws as aws
+import pulumi_random as random
 import pulumi_tls as tls
+import lookups
+import ipaddress
 import os
-import secrets
-import string
 
 def read_file(file_path: str) -> str:
     """Read and return the contents of a file"""
     with open(f'./{file_path}', 'r') as fd:
         return fd.read()
 
-def gen_password(n: int) -> str:
-    """Generate a secure random password of length n"""
-    # Character pools
-    uppercase = secrets.choice(string.ascii_uppercase)
-    lowercase = secrets.choice(string.ascii_lowercase)
-    digit = secrets.choice(string.digits)
-
-    # Fill the rest of the password length
-    all_chars = string.ascii_letters + string.digits
-    remaining_chars = [secrets.choice(all_chars) for _ in range(n - 3)]
-
-    # Combine and shuffle to randomize order
-    password_list = [uppercase, lowercase, digit] + remaining_chars
-    secrets.SystemRandom().shuffle(password_list)  # Secure shuffle
-
-    return ''.join(password_list)
+def host_ip(cidr: str, offset: int) -> str:
+    """Return the address at the given offset inside a CIDR block"""
+    return str(ipaddress.ip_network(cidr)[offset])
+
+def mysql_host_pattern(cidr: str) -> str:
+    """Return the MySQL account host that matches a CIDR block"""
+    network = ipaddress.ip_network(cidr)
+    return f'{network.network_address}/{network.netmask}'
+
+def stable_password(name: str, n: int, parent=None) -> pulumi.Output:
+    """Password of length n that is generated once and kept in the stack
+    state, so later runs render the same user_data"""
+    return random.RandomPassword(name,
+        length=n,
+        special=False,
+        min_upper=1,
+        min_lower=1,
+        min_numeric=1,
+        opts=pulumi.ResourceOptions(parent=parent)
+    ).result
 
 def create_ssh_key(key_name):
     """Create or use an existing SSH key pair"""
-    try:
-        existing_key = aws.ec2.get_key_pair(key_name=key_name)
-        print(f"Using existing AWS key pair: {existing_key.key_name}")
+    existing_key = lookups.key_pair(key_name)
+
+    # A key pair tagged with this stack was created by an earlier run and is
+    # still managed here; anything else is treated as user provided
+    if existing_key["exists"] and existing_key["tags"].get("pulumi:stack") != pulumi.get_stack():
+        print(f"Using existing AWS key pair: {key_name}")
         return None  # Use existing key
 
-    except:
-        print(f"Key pair '{key_name}' not found. Creating a new one...")
+    else:
+        if not existing_key["exists"]:
+            print(f"Key pair '{key_name}' not found. Creating a new one...")
 
         ssh_key = tls.PrivateKey(
             key_name,
@@ -46,7 +55,8 @@ def create_ssh_key(key_name):
         aws_key = aws.ec2.KeyPair(
             key_name,
             key_name=key_name,
-            public_key=ssh_key.public_key_openssh
+            public_key=ssh_key.public_key_openssh,
+            tags={'pulumi:stack': pulumi.get_stack()}
         )
 
         # Save private key locally
@@ -61,44 +71,62 @@ def create_ssh_key(key_name):
 
         return aws_key
 
-def create_config_file(instances, ssh_key_name):
-    """Create SSH config file for connecting to instances"""
+def create_config_file(instances, ssh_key_name, name_prefix=''):
+    """Create SSH config file for connecting to instances. Host aliases of
+    an environment carry its name prefix and go to their own file, used with
+    `ssh -F ~/.ssh/config-<environment>`"""
+    autoscaled = "nodejs_asg" in instances
+
     def write_config(all_ips):
         nodejs_ip = all_ips[0]
         db_ip = all_ips[1]
         redis_ip = all_ips[2]
         vault_ip = all_ips[3]
 
-        config_content = f'''\
-Host nodejs-server
+        # App servers in an Auto Scaling Group come and go, so the jump host
+        # is resolved to a running group member when connecting
+        if autoscaled:
+            nodejs_host = f'''\
+Host {name_prefix}nodejs-server
+    User ubuntu
+    IdentityFile ~/.ssh/{ssh_key_name}.id_rsa
+    ProxyCommand sh -c 'nc "$(aws ec2 describe-instances --region {lookups.region()} --filters Name=tag:aws:autoscaling:groupName,Values={nodejs_ip} Name=instance-state-name,Values=running --query "Reservations[0].Instances[0].PublicIpAddress" --output text)" %p'
+'''
+        else:
+            nodejs_host = f'''\
+Host {name_prefix}nodejs-server
     HostName {nodejs_ip}
     User ubuntu
     IdentityFile ~/.ssh/{ssh_key_name}.id_rsa
+'''
 
-Host db-server
-    ProxyJump nodejs-server
+        config_content = f'''\
+{nodejs_host}
+Host {name_prefix}db-server
+    ProxyJump {name_prefix}nodejs-server
     HostName {db_ip}
     User ubuntu
     IdentityFile ~/.ssh/{ssh_key_name}.id_rsa
 
-Host redis-server
-    ProxyJump nodejs-server
+Host {name_prefix}redis-server
+    ProxyJump {name_prefix}nodejs-server
     HostName {redis_ip}
     User ubuntu
     IdentityFile ~/.ssh/{ssh_key_name}.id_rsa
 
-Host vault-server
-    ProxyJump nodejs-server
+Host {name_prefix}vault-server
+    ProxyJump {name_prefix}nodejs-server
     HostName {vault_ip}
     User ubuntu
     IdentityFile ~/.ssh/{ssh_key_name}.id_rsa
 '''
-        config_path = os.path.expanduser("~/.ssh/config")
+        config_name = f"config-{name_prefix.rstrip('-')}" if name_prefix else "config"
+        config_path = os.path.expanduser(f"~/.ssh/{config_name}")
         with open(config_path, "w") as config_file:
             config_file.write(config_content)
 
     pulumi.Output.all(
-        instances["nodejs"].public_ip,
+        instances["nodejs_asg"].name if autoscaled else instances["nodejs"].public_ip,
         instances["db"].private_ip,
         instances["redis"].private_ip,
         instances["vault"].private_ip